@@ -0,0 +1,23 @@
+"""Use the tools of MCWorldTools from Python.
+
+The scan functions take a world folder and return iterators over the found objects. They are compact records that
+can be indexed like the dicts in the json output files and are converted to these dicts with ``to_dict()``.
+Invalid arguments raise an InputError instead of exiting::
+
+    from mcworldtools import api
+
+    stats = api.ScanStats()
+    for entity in api.find_entities('world', entity_id='zombie', dimension='overworld', stats=stats):
+        print(entity['uuid'], entity['loc'])
+    print(stats.not_readable_chunks, 'chunks could not be read')
+"""
+from .tools.block_entities import scan as find_block_entities
+from .tools.command_blocks import scan as find_command_blocks
+from .tools.entities import estimate as estimate_entities, scan as find_entities, \
+    scan_duplicates as find_duplicate_entities
+from .region import use_zlib_backend, zlib_backends
+from .util import InputError, ScanStats, dimensions, get_dimensions
+
+__all__ = ['estimate_entities', 'find_block_entities', 'find_command_blocks', 'find_duplicate_entities',
+           'find_entities', 'InputError', 'ScanStats', 'dimensions', 'get_dimensions', 'use_zlib_backend',
+           'zlib_backends']
@@ -0,0 +1,280 @@
+import json
+import signal
+import threading
+import time
+from argparse import ArgumentParser
+from io import BytesIO
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from .query import compile_query
+from .tools import block_entities, command_blocks, entities
+from .util import *
+
+default_port = 8149
+# chunks without these bytes in their block entities contain no command blocks
+command_block_needles = [command_block_type.encode() for command_block_type in command_blocks.types]
+
+
+class RegionIndex:
+    """The cached header signature and the entity and block entity lists of every chunk of one region file."""
+
+    def __init__(self):
+        self.signature = None
+        # (x, z) -> (timestamp, world_x, world_z, entities, block_entities) with the lists packed by ``pack_list``,
+        # None for not readable chunks
+        self.chunks = {}
+
+
+def pack_list(data, name):
+    """Returns the NBT list of a chunk as uncompressed NBT, which takes a fraction of the memory of the parsed tags, or
+    None if it is missing or empty."""
+    if name not in data or not data[name].tags:
+        return None
+    buffer = BytesIO()
+    data[name]._render_buffer(buffer)
+    return buffer.getvalue()
+
+
+def unpack_list(packed):
+    return TAG_List(buffer=BytesIO(packed)).tags if packed else []
+
+
+class WorldIndex:
+    """Keeps the entities and block entities of a world in memory between queries. They are kept as uncompressed NBT
+    and only parsed while answering a query.
+
+    Before each query the region files are checked via their modification time and size. Only the chunks of changed
+    files whose timestamp in the region header changed are read again.
+    """
+
+    def __init__(self, world_folder):
+        self.world_folder = world_folder
+        self.lock = threading.Lock()
+        self.regions = {}
+        self.region_files = {}
+        self.entity_files = {}
+        self.not_readable_chunks = 0
+
+    def refresh(self):
+        self.region_files = map_files(get_region_folders(self.world_folder))
+        self.entity_files = get_entity_files(self.world_folder)
+
+        used = set()
+        for files in (self.region_files, self.entity_files):
+            for region_file in get_all_files(files):
+                used.add(region_file)
+                stat = region_file.stat()
+                signature = (stat.st_mtime_ns, stat.st_size)
+                region_index = self.regions.setdefault(region_file, RegionIndex())
+                if region_index.signature != signature:
+                    self._update(region_file, region_index)
+                    region_index.signature = signature
+
+        for region_file in set(self.regions) - used:
+            del self.regions[region_file]
+        self.not_readable_chunks = sum(1 for region_index in self.regions.values()
+                                       for chunk in region_index.chunks.values() if chunk is None)
+
+    @staticmethod
+    def _update(region_file, region_index):
+        with region_file.open('rb') as file:
+            region = open_region(file, region_file)
+            chunks = {}
+            for metadata in region.get_metadata():
+                coords = metadata.x, metadata.z
+                cached = region_index.chunks.get(coords)
+                if cached is not None and metadata.timestamp and cached[0] == metadata.timestamp:
+                    chunks[coords] = cached
+                    continue
+
+                try:
+                    chunk = region.get_chunk(*coords)
+                except ChunkDataError:
+                    chunks[coords] = None
+                    continue
+
+                data = chunk['Level'] if 'Level' in chunk else chunk
+                chunks[coords] = (metadata.timestamp, chunk.loc.x, chunk.loc.z, pack_list(data, 'Entities'),
+                                  pack_list(data, 'block_entities' if 'block_entities' in data else 'TileEntities'))
+            region_index.chunks = chunks
+
+    def iter_chunks(self, files, dimension=None, list_index=3, needles=None):
+        """Yield the chunks with their parsed entities (``list_index`` 3) or block entities (4). With ``needles``,
+        chunks whose packed list contains none of these bytes are skipped without parsing them."""
+        for dimension_, region_files in files.items():
+            if dimension and dimension_ != dimension:
+                continue
+            for region_file in region_files:
+                for (x, z), chunk in self.regions[region_file].chunks.items():
+                    if chunk is None or not chunk[list_index]:
+                        continue
+                    if needles and not any(needle in chunk[list_index] for needle in needles):
+                        continue
+                    yield dimension_, x, z, chunk[1], chunk[2], unpack_list(chunk[list_index])
+
+    def find_entities(self, entity_id=None, dimension=None, nbt_keys=None, query=None):
+        if entity_id is not None:
+            entity_id = strip_id(entity_id.lower())
+        dimension = check_dimension(dimension)
+        query = compile_query(query, entities.normalize_entity_id) if query is not None else None
+        for dimension_, x, z, world_x, world_z, chunk_entities in self.iter_chunks(self.entity_files, dimension):
+            yield from entities.find_in_chunk(chunk_entities, dimension_, x, z, world_x, world_z, entity_id, nbt_keys,
+                                              query)
+
+    def find_command_blocks(self, dimension=None, only_executing=False, search=None, search_type='literal',
+                            search_in=('command',)):
+        dimension = check_dimension(dimension)
+        text_filter, search_in = command_blocks.compile_search(search, search_type, search_in) if search \
+            else (None, ())
+        for dimension_, x, z, world_x, world_z, chunk_block_entities in self.iter_chunks(self.region_files, dimension,
+                                                                                          4, command_block_needles):
+            yield from command_blocks.find_in_chunk(chunk_block_entities, dimension_, x, z, world_x, world_z,
+                                                    only_executing, text_filter, search_in)
+
+    def find_block_entities(self, block_entity_ids, dimension=None, nbt_keys=None, query=None):
+        if not block_entity_ids:
+            raise InputError('"ids" has to contain at least one block entity id.')
+        id_index = block_entities.IdIndex(set(normalize_block_entity_id(block_entity_id)
+                                              for block_entity_id in block_entity_ids))
+        dimension = check_dimension(dimension)
+        query = compile_query(query, normalize_block_entity_id) if query is not None else None
+        for dimension_, x, z, world_x, world_z, chunk_block_entities in self.iter_chunks(self.region_files,
+                                                                                          dimension, 4):
+            yield from block_entities.find_in_chunk(chunk_block_entities, dimension_, x, z, world_x, world_z,
+                                                    id_index, nbt_keys, query)
+
+
+def _get(query, name, default=None):
+    return query[name][-1] if name in query else default
+
+
+def _get_list(query, name, split=True):
+    """Returns None if the parameter is missing and an empty list if it is empty.
+    Lists may be stated as multiple parameters or, if ``split`` is enabled, separated by commas."""
+    if name not in query:
+        return None
+    return [value for values in query[name] for value in (values.split(',') if split else [values]) if value]
+
+
+def _get_bool(query, name):
+    return _get(query, name, '').lower() in ('1', 'true', 'yes')
+
+
+routes = {
+    '/entities': lambda index, query: index.find_entities(entity_id=_get(query, 'id'),
+                                                          dimension=_get(query, 'dimension'),
+                                                          nbt_keys=_get_list(query, 'nbt_keys'),
+                                                          query=_get(query, 'query')),
+    '/command_blocks': lambda index, query: index.find_command_blocks(dimension=_get(query, 'dimension'),
+                                                                      only_executing=_get_bool(query, 'only_executing'),
+                                                                      search=_get_list(query, 'search', split=False),
+                                                                      search_type=_get(query, 'search_type', 'literal'),
+                                                                      search_in=_get_list(query, 'search_in') or
+                                                                      ['command']),
+    '/block_entities': lambda index, query: index.find_block_entities(_get_list(query, 'ids'),
+                                                                      dimension=_get(query, 'dimension'),
+                                                                      nbt_keys=_get_list(query, 'nbt_keys'),
+                                                                      query=_get(query, 'query'))
+}
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query, keep_blank_values=True)
+
+        if url.path == '/worlds':
+            self.send_json(200, {'worlds': list(self.server.indexes)})
+            return
+
+        if url.path not in routes:
+            paths_str = '"' + '", "'.join(['/worlds'] + list(routes)) + '"'
+            self.send_json(404, {'error': f'Unknown path "{url.path}". Use one of {paths_str}'})
+            return
+
+        world = _get(query, 'world')
+        if world is None and len(self.server.indexes) == 1:
+            world = next(iter(self.server.indexes))
+        index = self.server.indexes.get(str(Path(world).resolve())) if world else None
+        if not index:
+            self.send_json(404, {'error': f'The world "{world}" is not served by this daemon.'})
+            return
+
+        start_time = time.time()
+        try:
+            with index.lock:
+                index.refresh()
+                results = list(routes[url.path](index, query))
+                not_readable_chunks = index.not_readable_chunks
+        except InputError as e:
+            self.send_json(400, {'error': str(e)})
+            return
+
+        elapsed_time = int(round((time.time() - start_time) * 1000))
+        self.send_json(200, {
+            'world': str(index.world_folder),
+            'results': results,
+            'count': len(results),
+            'not_readable_chunks': not_readable_chunks,
+            'elapsed_time': {
+                'raw': elapsed_time,
+                'human_readable': format_time(elapsed_time)
+            }
+        })
+
+    def send_json(self, status, data):
+        body = json.dumps(data, default=expand_record).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if not self.server.quiet:
+            super().log_message(format, *args)
+
+
+def main():
+    parser = ArgumentParser(prog='mcworldtools-daemon',
+                            description='--- MCWorldTools daemon by Rapha149 ---'
+                                        '\nAnswers find queries over HTTP and keeps the worlds indexed in memory.',
+                            allow_abbrev=False)
+    parser.add_argument('-w', '--world', action='append',
+                        help='A world folder to serve. You can provide this option multiple times for multiple worlds.'
+                             '\nDefaults to the current working directory.')
+    parser.add_argument('--host', default='127.0.0.1', help='The host to listen on. Defaults to "127.0.0.1".')
+    parser.add_argument('-p', '--port', type=int, default=default_port,
+                        help=f'The port to listen on. Defaults to {default_port}.')
+    parser.add_argument('-q', '--quiet', action='store_true', help='Do not log requests.')
+    args = parser.parse_args()
+
+    print('--- MCWorldTools daemon by Rapha149 ---')
+    indexes = {}
+    for world in args.world or [Path.cwd()]:
+        world_folder = Path(world).resolve()
+        if not Path(world_folder, 'level.dat').is_file():
+            eprint(f'"{world}" is not a world folder.')
+            exit(2)
+
+        print(f'Indexing world "{world_folder}"...')
+        start_time = time.time()
+        index = indexes[str(world_folder)] = WorldIndex(world_folder)
+        index.refresh()
+        print(f'Indexed {sum(len(region_index.chunks) for region_index in index.regions.values())} chunks. '
+              f'(Elapsed time: {format_time(int(round((time.time() - start_time) * 1000)))})')
+
+    server = ThreadingHTTPServer((args.host, args.port), RequestHandler)
+    server.indexes = indexes
+    server.quiet = args.quiet
+    signal.signal(signal.SIGINT, lambda s, frame: threading.Thread(target=server.shutdown).start())
+    print(f'\nListening on http://{args.host}:{args.port}/')
+    server.serve_forever()
+    server.server_close()
+    print('Stopped.')
+
+
+if __name__ == '__main__':
+    main()
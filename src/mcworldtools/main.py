@@ -1,13 +1,20 @@
-import json
 import signal
+import sys
 from argparse import ArgumentParser
-from json import JSONDecodeError
+from importlib import import_module
+from pathlib import Path
 
-from .tools import remove_unused_chunks, blocks, command_blocks, entities
-from .util import *
+from . import metrics
 
 current_version = '1.2.6'
-available_tools = ('Remove unused chunks', 'Remove/Find blocks', 'Remove/Find command blocks', 'Remove/Find entities')
+available_tools = ('Remove unused chunks', 'Remove/Find blocks', 'Remove/Find command blocks', 'Remove/Find entities',
+                   'Chunk density heatmap', 'Find block entities', 'Verify chunks', 'Compare worlds',
+                   'Back up/restore worlds')
+# Tools are only imported once they are selected to keep the startup fast.
+tool_modules = ('remove_unused_chunks', 'blocks', 'command_blocks', 'entities', 'heatmap', 'block_entities',
+                'verify', 'compare', 'backup')
+# tools that support only reading the chunks saved since a time with "--since"
+since_tools = ('command_blocks', 'entities')
 
 
 def sigint_handler():
@@ -35,6 +42,15 @@ def main():
     parser.add_argument('-i', '--input-file', help='Select a file to read input values from.'
                                                    '\nSee the Github page for more information: https://github.com/Rapha149/MCWorldTools#input-files')
     parser.add_argument('--confirm', action='store_true', help='Automatically confirm any confirmation requests')
+    parser.add_argument('--metrics', metavar='FILE',
+                        help='Periodically write progress and throughput metrics to a file. The file is written in the '
+                             'Prometheus text format if it ends with ".prom" and as json otherwise.')
+    parser.add_argument('--metrics-interval', type=float, default=metrics.default_interval, metavar='SECONDS',
+                        help=f'The interval in which the metrics file is written. Defaults to '
+                             f'{metrics.default_interval} seconds.')
+    parser.add_argument('--since', help='Only read the chunks saved since a unix timestamp, a date or the last run '
+                                        '("last") and use the results of the last run for the other chunks.'
+                                        '\nOnly supported when finding command blocks or entities.')
     args = parser.parse_args()
 
     print('--- MCWorldTools by Rapha149 ---')
@@ -42,6 +58,10 @@ def main():
         print(f'Installed version: {current_version}')
         exit()
 
+    # nbt is only imported once it is needed, so that "--version" doesn't load it
+    from nbt.nbt import NBTFile
+    from .util import InputError, eprint
+
     if not args.world:
         world_folders = [Path.cwd()]
     else:
@@ -91,10 +111,11 @@ def main():
         if not input_file.is_file():
             eprint(f'The input file "{input_file}" does not exist or is a folder.')
             exit(1)
+        import json
         with input_file.open('r') as file:
             try:
                 input_data = json.load(file)
-            except JSONDecodeError:
+            except json.JSONDecodeError:
                 eprint(f'The input file "{input_file}" does not have valid json content.')
                 exit(1)
 
@@ -122,14 +143,27 @@ def main():
             break
     print(f'Using tool "{available_tools[tool - 1]}"')
 
-    if tool == 1:
-        remove_unused_chunks.start(world_folders, output_file, args.output_format, input_data, args.confirm)
-    elif tool == 2:
-        blocks.start(world_folders, output_file, args.output_format, input_data, args.confirm)
-    elif tool == 3:
-        command_blocks.start(world_folders, output_file, args.output_format, input_data, args.confirm)
-    elif tool == 4:
-        entities.start(world_folders, output_file, args.output_format, input_data, args.confirm)
+    kwargs = {}
+    if args.since is not None:
+        if tool_modules[tool - 1] not in since_tools:
+            eprint('The option "--since" is only supported when finding command blocks or entities.')
+            exit(1)
+        kwargs['since'] = args.since
+
+    if args.metrics:
+        if args.metrics_interval <= 0:
+            eprint('The metrics interval has to be positive.')
+            exit(1)
+        metrics.enable(args.metrics, args.metrics_interval, available_tools[tool - 1])
+
+    tool_module = import_module(f'.tools.{tool_modules[tool - 1]}', __package__)
+    try:
+        tool_module.start(world_folders, output_file, args.output_format, input_data, args.confirm, **kwargs)
+    except InputError as e:
+        eprint(e)
+        exit(3)
+    finally:
+        metrics.disable()
 
 
 if __name__ == '__main__':
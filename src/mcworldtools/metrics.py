@@ -0,0 +1,213 @@
+"""Progress and throughput metrics of long-running tools, written periodically to a status file.
+
+The file is written in the Prometheus text format if it ends with ".prom" (e.g. for the textfile collector of the node
+exporter) and as json otherwise. Metrics are only collected once ``enable`` was called, otherwise all functions return
+right away.
+"""
+import json
+import threading
+import time
+from pathlib import Path
+
+default_interval = 15
+
+_metrics = None
+
+
+class WorldMetrics:
+
+    def __init__(self, world):
+        self.world = world
+        self.start_time = time.time()
+        self.end_time = None
+        self.total_bytes = 0
+        self.processed_bytes = 0
+        self.chunks_decoded = 0
+        self.chunks_skipped = 0
+        self.not_readable_chunks = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+
+    def to_dict(self, now):
+        elapsed = (self.end_time or now) - self.start_time
+        chunks = self.chunks_decoded + self.chunks_skipped + self.not_readable_chunks
+        progress = 1 if self.end_time else min(1, self.processed_bytes / self.total_bytes) if self.total_bytes else 0
+        eta = 0 if self.end_time else elapsed / progress - elapsed if progress else None
+        return {
+            'world': self.world,
+            'finished': self.end_time is not None,
+            'elapsed_seconds': round(elapsed, 3),
+            'chunks_decoded': self.chunks_decoded,
+            'chunks_skipped': self.chunks_skipped,
+            'not_readable_chunks': self.not_readable_chunks,
+            'chunks_per_second': round(chunks / elapsed, 3) if elapsed > 0 else 0,
+            'bytes_read': self.bytes_read,
+            'bytes_written': self.bytes_written,
+            'total_bytes': self.total_bytes,
+            'processed_bytes': self.processed_bytes,
+            'progress': round(progress, 5),
+            'eta_seconds': round(eta, 3) if eta is not None else None
+        }
+
+
+class Metrics:
+
+    def __init__(self, file, interval=default_interval, tool=None):
+        self.file = Path(file)
+        self.interval = interval
+        self.tool = tool
+        self.start_time = time.time()
+        self.finished = False
+        self.worlds = {}
+        self.current = None
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name='metrics', daemon=True)
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            self.write()
+
+    def to_dict(self):
+        now = time.time()
+        with self.lock:
+            worlds = [world.to_dict(now) for world in self.worlds.values()]
+        return {
+            'tool': self.tool,
+            'finished': self.finished,
+            'start_time': round(self.start_time, 3),
+            'last_update': round(now, 3),
+            'worlds': worlds
+        }
+
+    def to_prometheus(self):
+        data = self.to_dict()
+        lines = [f'# HELP mcworldtools_last_update_timestamp_seconds The time the metrics were written.',
+                 f'# TYPE mcworldtools_last_update_timestamp_seconds gauge',
+                 f'mcworldtools_last_update_timestamp_seconds{{tool="{_escape(data["tool"])}"}} '
+                 f'{data["last_update"]}',
+                 f'# HELP mcworldtools_finished Whether the tool finished.',
+                 f'# TYPE mcworldtools_finished gauge',
+                 f'mcworldtools_finished{{tool="{_escape(data["tool"])}"}} {int(data["finished"])}']
+        for name, metric_type, key, description in prometheus_metrics:
+            lines.append(f'# HELP mcworldtools_{name} {description}')
+            lines.append(f'# TYPE mcworldtools_{name} {metric_type}')
+            for world in data['worlds']:
+                value = world[key]
+                if value is None:
+                    continue
+                lines.append(f'mcworldtools_{name}{{tool="{_escape(data["tool"])}",world="{_escape(world["world"])}"}} '
+                             f'{int(value) if isinstance(value, bool) else value}')
+        return '\n'.join(lines) + '\n'
+
+    def write(self):
+        text = self.to_prometheus() if self.file.suffix == '.prom' else json.dumps(self.to_dict(), indent=3)
+        # the file is replaced at once, so that it is never read half written
+        temp_file = self.file.with_name(self.file.name + '.tmp')
+        try:
+            temp_file.write_text(text)
+            temp_file.replace(self.file)
+        except OSError:
+            pass
+
+
+# (name, type, key in WorldMetrics.to_dict, description)
+prometheus_metrics = [
+    ('world_finished', 'gauge', 'finished', 'Whether the world was processed completely.'),
+    ('elapsed_seconds', 'gauge', 'elapsed_seconds', 'The time the world has been processed for.'),
+    ('chunks_decoded_total', 'counter', 'chunks_decoded', 'The number of chunks that were read and decompressed.'),
+    ('chunks_skipped_total', 'counter', 'chunks_skipped', 'The number of chunks that were skipped without reading.'),
+    ('chunks_not_readable_total', 'counter', 'not_readable_chunks', 'The number of chunks that could not be read.'),
+    ('chunks_per_second', 'gauge', 'chunks_per_second', 'The number of processed chunks per second.'),
+    ('bytes_read_total', 'counter', 'bytes_read', 'The number of bytes of chunks that were read.'),
+    ('bytes_written_total', 'counter', 'bytes_written', 'The number of bytes of chunks that were written.'),
+    ('total_bytes', 'gauge', 'total_bytes', 'The size of the chunks to process according to the region headers.'),
+    ('processed_bytes', 'gauge', 'processed_bytes', 'The size of the processed chunks.'),
+    ('progress_ratio', 'gauge', 'progress', 'The processed part of the chunks (0-1).'),
+    ('eta_seconds', 'gauge', 'eta_seconds', 'The estimated remaining time.')
+]
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def enable(file, interval=default_interval, tool=None):
+    """Collect metrics and write them to ``file`` every ``interval`` seconds until ``disable`` is called."""
+    global _metrics
+    _metrics = Metrics(file, interval, tool)
+    _metrics.write()
+    _metrics.thread.start()
+
+
+def disable():
+    """Mark the run as finished, write the metrics a last time and stop collecting them."""
+    global _metrics
+    metrics, _metrics = _metrics, None
+    if metrics is None:
+        return
+    metrics.stopped.set()
+    metrics.thread.join()
+    with metrics.lock:
+        if metrics.current is not None and metrics.current.end_time is None:
+            metrics.current.end_time = time.time()
+    metrics.finished = True
+    metrics.write()
+
+
+def start_world(world_folder):
+    """Start collecting metrics of a world, the previous world is finished."""
+    if _metrics is None:
+        return
+    with _metrics.lock:
+        if _metrics.current is not None and _metrics.current.end_time is None:
+            _metrics.current.end_time = time.time()
+        world = str(Path(world_folder).resolve())
+        _metrics.current = _metrics.worlds[world] = WorldMetrics(world)
+
+
+def start_worker():
+    """Collect the counters in a worker process, e.g. of a dimension that is scanned in parallel. Returns the
+    WorldMetrics they are counted in, which are added to the current world of the main process with ``add_counts``."""
+    global _metrics
+    _metrics = _WorkerMetrics()
+    return _metrics.current
+
+
+class _WorkerMetrics:
+
+    def __init__(self):
+        self.current = WorldMetrics(None)
+
+
+def add_counts(counts):
+    """Add the counters of a worker process to the current world."""
+    count(counts.chunks_decoded, counts.chunks_skipped, counts.not_readable_chunks, counts.bytes_read,
+          counts.bytes_written)
+
+
+def add_work(size):
+    """Add the size of chunks that will be processed to the current world."""
+    if _metrics is None or _metrics.current is None:
+        return
+    _metrics.current.total_bytes += size
+
+
+def progress(size):
+    """Count the size of processed chunks in the current world."""
+    if _metrics is None or _metrics.current is None:
+        return
+    _metrics.current.processed_bytes += size
+
+
+def count(chunks_decoded=0, chunks_skipped=0, not_readable_chunks=0, bytes_read=0, bytes_written=0):
+    """Add to the counters of the current world."""
+    if _metrics is None or _metrics.current is None:
+        return
+    current = _metrics.current
+    # only the main thread counts, so the counters are not locked
+    current.chunks_decoded += chunks_decoded
+    current.chunks_skipped += chunks_skipped
+    current.not_readable_chunks += not_readable_chunks
+    current.bytes_read += bytes_read
+    current.bytes_written += bytes_written
@@ -0,0 +1,330 @@
+"""A small query language to filter NBT compounds like entities and block entities, e.g.
+``id in (zombie, skeleton) and Age > 6000 and CustomName exists``.
+
+A query is compiled once into nested closures that are called with the NBT compound of each entity or block entity
+while scanning, so that only matching ones are converted. The operands of "and" and "or" are evaluated from the
+cheapest to the most expensive one.
+
+Syntax:
+- ``key exists`` - Whether the key exists.
+- ``key = value``, ``!=``, ``<``, ``<=``, ``>``, ``>=`` - Compares a number or text. ``==`` is the same as ``=``.
+- ``key in (value, value, ...)`` and ``key not in (...)`` - Whether the value is one of the given ones.
+- ``key contains value`` - Whether a text contains the given text or a list contains the given value.
+- ``key matches "regex"`` - Whether a text matches the regular expression.
+- ``and``, ``or``, ``not`` and parentheses to combine them.
+
+Keys may be nested with dots and list indices, e.g. ``Pos[1]`` or ``Items[0].id``. Values are numbers, texts in
+quotes, ``true``/``false`` (1/0) or texts without quotes that contain no spaces or special characters. Comparisons with
+keys that don't exist are false, including ``!=`` and ``not in``. Comparisons with values of another type are false
+as well, except for ``not in``, which is true for every number or text that is not in the list. ``not`` in front of a
+condition is true for keys that don't exist.
+"""
+import operator
+import re
+
+from nbt.nbt import TAG_Byte, TAG_Short, TAG_Int, TAG_Long, TAG_Float, TAG_Double, TAG_String, TAG_List, TAG_Compound
+
+from .util import InputError
+
+numeric_tags = (TAG_Byte, TAG_Short, TAG_Int, TAG_Long, TAG_Float, TAG_Double)
+keywords = {'and', 'or', 'not', 'in', 'exists', 'contains', 'matches', 'true', 'false'}
+operators = {
+    '=': operator.eq,
+    '==': operator.eq,
+    '!=': operator.ne,
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge
+}
+
+_whitespace_pattern = re.compile(r'\s*')
+_token_pattern = re.compile(r'''(?:
+    (?P<string>"(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*')
+    |(?P<number>-?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?(?![\w:.]))
+    |(?P<word>[A-Za-z_][\w:/-]*(?:\.[A-Za-z_][\w:/-]*|\[-?\d+])*)
+    |(?P<symbol>==|!=|<=|>=|[=<>(),])
+    )''', re.VERBOSE)
+_path_part_pattern = re.compile(r'\.?([^.\[\]]+)|\[(-?\d+)]')
+
+
+def compile_query(text, normalize_id=None):
+    """Compile a query into a function that returns whether an NBT compound matches it.
+
+    ``normalize_id`` is applied to the texts compared with the key "id" and to the ids of the compounds, e.g. to match
+    ids with or without "minecraft:". Raises an InputError if the query is invalid."""
+    if not isinstance(text, str):
+        raise InputError(f'"query" has to be text but is {type(text).__name__}')
+    return _Parser(text, normalize_id).parse()[0]
+
+
+def _tokenize(text):
+    tokens, position = [], 0
+    while True:
+        position = _whitespace_pattern.match(text, position).end()
+        if position == len(text):
+            return tokens
+        match = _token_pattern.match(text, position)
+        if not match:
+            raise InputError(f'Invalid query: unexpected character "{text[position]}" at position {position + 1}')
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == 'string':
+            value = re.sub(r'\\(.)', r'\1', value[1:-1])
+        elif kind == 'number':
+            value = float(value) if any(c in value for c in '.eE') else int(value)
+        elif kind == 'word' and value.lower() in keywords:
+            kind, value = 'keyword', value.lower()
+        tokens.append((kind, value, position + 1))
+        position = match.end()
+
+
+def _get_path(path):
+    """Returns a function that returns the tag at the path of a compound or None."""
+    parts = [int(index) if index else key for key, index in _path_part_pattern.findall(path)]
+    if len(parts) == 1:
+        key = parts[0]
+
+        def get(tag):
+            try:
+                return tag[key]
+            except KeyError:
+                return None
+
+        return get, 1
+
+    def get(tag):
+        for part in parts:
+            if isinstance(part, int):
+                if not isinstance(tag, TAG_List) or not -len(tag.tags) <= part < len(tag.tags):
+                    return None
+                tag = tag.tags[part]
+            else:
+                if not isinstance(tag, TAG_Compound):
+                    return None
+                try:
+                    tag = tag[part]
+                except KeyError:
+                    return None
+        return tag
+
+    return get, len(parts)
+
+
+def _get_value_type(value):
+    return (TAG_String,) if isinstance(value, str) else numeric_tags
+
+
+class _Parser:
+
+    def __init__(self, text, normalize_id):
+        self.tokens = _tokenize(text)
+        self.position = 0
+        self.normalize_id = normalize_id
+
+    def error(self, expected):
+        if self.position < len(self.tokens):
+            kind, value, position = self.tokens[self.position]
+            return InputError(f'Invalid query: expected {expected} at position {position} but found "{value}"')
+        return InputError(f'Invalid query: expected {expected} at the end')
+
+    def peek(self, *values):
+        if self.position < len(self.tokens):
+            kind, value, _ = self.tokens[self.position]
+            if kind in ('keyword', 'symbol') and value in values:
+                return value
+        return None
+
+    def take(self, *values):
+        value = self.peek(*values)
+        if value is None:
+            raise self.error(' or '.join(f'"{value}"' for value in values))
+        self.position += 1
+        return value
+
+    def parse(self):
+        if not self.tokens:
+            raise InputError('Invalid query: the query is empty')
+        test = self.parse_or()
+        if self.position < len(self.tokens):
+            raise self.error('"and", "or" or the end')
+        return test
+
+    def parse_or(self):
+        operands = [self.parse_and()]
+        while self.peek('or'):
+            self.position += 1
+            operands.append(self.parse_and())
+        return self.combine(operands, False)
+
+    def parse_and(self):
+        operands = [self.parse_not()]
+        while self.peek('and'):
+            self.position += 1
+            operands.append(self.parse_not())
+        return self.combine(operands, True)
+
+    def parse_not(self):
+        if self.peek('not'):
+            self.position += 1
+            test, cost = self.parse_not()
+            return (lambda tag: not test(tag)), cost
+        if self.peek('('):
+            self.position += 1
+            test = self.parse_or()
+            self.take(')')
+            return test
+        return self.parse_condition()
+
+    @staticmethod
+    def combine(operands, conjunction):
+        """Combine tests with "and" or "or", ordered from the cheapest to the most expensive one."""
+        if len(operands) == 1:
+            return operands[0]
+        operands.sort(key=lambda operand: operand[1])
+        tests = [test for test, _ in operands]
+        cost = sum(cost for _, cost in operands)
+        if len(tests) == 2:
+            first, second = tests
+            if conjunction:
+                return (lambda tag: first(tag) and second(tag)), cost
+            return (lambda tag: first(tag) or second(tag)), cost
+
+        if conjunction:
+            def test(tag):
+                for operand in tests:
+                    if not operand(tag):
+                        return False
+                return True
+        else:
+            def test(tag):
+                for operand in tests:
+                    if operand(tag):
+                        return True
+                return False
+
+        return test, cost
+
+    def parse_value(self):
+        if self.position < len(self.tokens):
+            kind, value, _ = self.tokens[self.position]
+            if kind in ('string', 'number', 'word') or (kind == 'keyword' and value in ('true', 'false')):
+                self.position += 1
+                if kind == 'keyword':
+                    return 1 if value == 'true' else 0
+                return value
+        raise self.error('a value')
+
+    def parse_condition(self):
+        if self.position >= len(self.tokens) or self.tokens[self.position][0] != 'word':
+            raise self.error('a key')
+        path = self.tokens[self.position][1]
+        self.position += 1
+        get, cost = _get_path(path)
+        normalize = self.normalize_id if path == 'id' else None
+
+        if self.peek('exists'):
+            self.position += 1
+            return (lambda tag: get(tag) is not None), cost
+
+        if self.peek('not'):
+            self.position += 1
+            self.take('in')
+            return self.parse_in(get, cost, normalize, True)
+        if self.peek('in'):
+            self.position += 1
+            return self.parse_in(get, cost, normalize)
+
+        if self.peek('contains'):
+            self.position += 1
+            value = self.parse_value()
+            value_type = _get_value_type(value)
+
+            def test(tag):
+                found = get(tag)
+                if isinstance(found, TAG_String):
+                    return isinstance(value, str) and value in found.value
+                if isinstance(found, TAG_List):
+                    return any(isinstance(item, value_type) and item.value == value for item in found.tags)
+                return False
+
+            return test, cost + 3
+
+        if self.peek('matches'):
+            self.position += 1
+            pattern = self.parse_value()
+            if not isinstance(pattern, str):
+                raise InputError(f'Invalid query: "matches" needs a regular expression but got {pattern}')
+            try:
+                search = re.compile(pattern).search
+            except re.error as e:
+                raise InputError(f'Invalid query: invalid regular expression "{pattern}": {e}')
+
+            def test(tag):
+                found = get(tag)
+                return isinstance(found, TAG_String) and search(found.value) is not None
+
+            return test, cost + 5
+
+        symbol = self.take(*operators)
+        compare = operators[symbol]
+        value = self.parse_value()
+        value_type = _get_value_type(value)
+        if normalize and isinstance(value, str) and symbol in ('=', '==', '!='):
+            value = normalize(value)
+            normalized = _NormalizedIds(normalize)
+
+            def test(tag):
+                found = get(tag)
+                return isinstance(found, TAG_String) and compare(normalized[found.value], value)
+
+            return test, cost
+
+        def test(tag):
+            found = get(tag)
+            return isinstance(found, value_type) and compare(found.value, value)
+
+        return test, cost + 1
+
+    def parse_in(self, get, cost, normalize, negate=False):
+        """Parse the values of "in" or "not in". Like the other comparisons, both are false if the key doesn't exist
+        or its value is no number or text."""
+        self.take('(')
+        values = [self.parse_value()]
+        while self.peek(','):
+            self.position += 1
+            values.append(self.parse_value())
+        self.take(')')
+
+        if normalize:
+            values = set(normalize(value) if isinstance(value, str) else value for value in values)
+            normalized = _NormalizedIds(normalize)
+
+            def test(tag):
+                found = get(tag)
+                return isinstance(found, TAG_String) and (normalized[found.value] in values) != negate
+
+            return test, cost
+
+        strings = set(value for value in values if isinstance(value, str))
+        numbers = set(value for value in values if not isinstance(value, str))
+
+        def test(tag):
+            found = get(tag)
+            if isinstance(found, TAG_String):
+                return (found.value in strings) != negate
+            return isinstance(found, numeric_tags) and (found.value in numbers) != negate
+
+        return test, cost + 1
+
+
+class _NormalizedIds(dict):
+    """Normalizes every distinct id only once."""
+
+    def __init__(self, normalize):
+        super().__init__()
+        self.normalize = normalize
+
+    def __missing__(self, raw_id):
+        self[raw_id] = normalized = self.normalize(raw_id)
+        return normalized
@@ -0,0 +1,335 @@
+import struct
+import zlib
+from importlib import import_module
+from io import BytesIO
+from pathlib import Path
+
+from nbt.nbt import NBTFile, MalformedFileError
+from nbt.region import RegionFile, ChunkDataError, Location, SECTOR_LENGTH, STATUS_CHUNK_OK, \
+    STATUS_CHUNK_OVERLAPPING, STATUS_CHUNK_MISMATCHED_LENGTHS, STATUS_CHUNK_ZERO_LENGTH, STATUS_CHUNK_NOT_CREATED
+
+from . import metrics
+
+# compression ids used by Minecraft, nbt uses 0 instead of 3 for uncompressed chunks
+COMPRESSION_GZIP = 1
+COMPRESSION_ZLIB = 2
+COMPRESSION_NONE = 3
+COMPRESSION_LZ4 = 4
+# set in the compression id of chunks that are saved in external c.X.Z.mcc files (1.15+)
+EXTERNAL_FLAG = 128
+
+# zlib compatible modules to de- and compress chunks with, the first installed one is used by default
+zlib_backends = {
+    'isal': 'isal.isal_zlib',
+    'zlib_ng': 'zlib_ng.zlib_ng',
+    'zlib': 'zlib'
+}
+_zlib = None
+_zlib_backend = None
+# the largest decompressed size per size class of compressed data, used as initial output buffer size
+_buffer_sizes = {}
+_default_buffer_size = 16 * 1024
+
+_readable_statuses = (STATUS_CHUNK_OK, STATUS_CHUNK_OVERLAPPING, STATUS_CHUNK_MISMATCHED_LENGTHS)
+_lz4_magic = b'LZ4Block'
+_lz4_header = struct.Struct('<Biii')
+_lz4_method_raw = 0x10
+_lz4_method_lz4 = 0x20
+# an int tag named "DataVersion"
+_data_version_tag = b'\x03\x00\x0bDataVersion'
+_int = struct.Struct('>i')
+
+
+def use_zlib_backend(name=None):
+    """Select the zlib implementation used for chunks, one of ``zlib_backends``. Without a name, the fastest installed
+    one is used. Returns the name of the selected backend. Raises an ImportError if the backend is not installed."""
+    global _zlib, _zlib_backend
+    if name is not None:
+        if name not in zlib_backends:
+            raise ValueError(f'Unknown zlib backend "{name}"')
+        _zlib, _zlib_backend = import_module(zlib_backends[name]), name
+        return name
+
+    for backend, module in zlib_backends.items():
+        try:
+            _zlib, _zlib_backend = import_module(module), backend
+            return backend
+        except ImportError:
+            continue
+
+
+def get_zlib_backend():
+    if _zlib is None:
+        use_zlib_backend()
+    return _zlib_backend
+
+
+def _inflate(data, wbits):
+    if _zlib is None:
+        use_zlib_backend()
+    # chunks of similar compressed size have similar decompressed sizes, so the output buffer is allocated with the
+    # right size right away instead of growing it repeatedly
+    size_class = len(data).bit_length()
+    buffer_size = _buffer_sizes.get(size_class, _default_buffer_size)
+    data = _zlib.decompress(data, wbits, buffer_size)
+    if len(data) > buffer_size:
+        _buffer_sizes[size_class] = len(data)
+    return data
+
+
+def decompress(data, compression):
+    """Decompress chunk data with the given Minecraft compression id. Raises a ChunkDataError if that fails."""
+    try:
+        if compression == COMPRESSION_ZLIB:
+            return _inflate(data, zlib.MAX_WBITS)
+        if compression == COMPRESSION_GZIP:
+            return _inflate(data, zlib.MAX_WBITS | 16)
+        if compression == COMPRESSION_NONE or compression == 0:
+            return bytes(data)
+        if compression == COMPRESSION_LZ4:
+            return decompress_lz4(data)
+    except ChunkDataError:
+        raise
+    except Exception as e:
+        raise ChunkDataError(str(e) or type(e).__name__)
+    raise ChunkDataError(f'Unknown chunk compression/format ({compression})')
+
+
+def compress(data, compression):
+    if _zlib is None:
+        use_zlib_backend()
+    if compression == COMPRESSION_ZLIB:
+        return _zlib.compress(data)
+    if compression == COMPRESSION_GZIP:
+        compressor = _zlib.compressobj(wbits=zlib.MAX_WBITS | 16)
+        return compressor.compress(data) + compressor.flush()
+    if compression == COMPRESSION_NONE:
+        return bytes(data)
+    raise ValueError(f'Unsupported compression for writing chunks ({compression})')
+
+
+def decompress_lz4(data):
+    """Decompress the LZ4 block stream that Minecraft writes since 1.20.5 (the format of lz4-java's
+    LZ4BlockOutputStream). The blocks are decompressed with the lz4 package if it is installed."""
+    try:
+        from lz4.block import decompress as decompress_block
+    except ImportError:
+        decompress_block = None
+
+    output = bytearray()
+    position, size = 0, len(data)
+    while position + len(_lz4_magic) + _lz4_header.size <= size:
+        if data[position:position + len(_lz4_magic)] != _lz4_magic:
+            raise ChunkDataError('Invalid LZ4 block header')
+        token, compressed_length, original_length, _ = _lz4_header.unpack_from(data, position + len(_lz4_magic))
+        position += len(_lz4_magic) + _lz4_header.size
+        if original_length == 0:
+            # end of the stream, another stream may follow
+            continue
+
+        block = data[position:position + compressed_length]
+        position += compressed_length
+        method = token & 0xF0
+        if method == _lz4_method_raw:
+            output += block
+        elif method == _lz4_method_lz4:
+            if decompress_block is not None:
+                output += decompress_block(block, uncompressed_size=original_length)
+            else:
+                output += _decompress_lz4_block(block, original_length)
+        else:
+            raise ChunkDataError(f'Unknown LZ4 block compression method ({method})')
+    return bytes(output)
+
+
+def _decompress_lz4_block(block, original_length):
+    output = bytearray()
+    position, size = 0, len(block)
+    while position < size:
+        token = block[position]
+        position += 1
+
+        literal_length = token >> 4
+        if literal_length == 15:
+            while True:
+                byte = block[position]
+                position += 1
+                literal_length += byte
+                if byte != 255:
+                    break
+        output += block[position:position + literal_length]
+        position += literal_length
+        if position >= size:
+            break
+
+        offset = block[position] | block[position + 1] << 8
+        position += 2
+        match_length = token & 15
+        if match_length == 15:
+            while True:
+                byte = block[position]
+                position += 1
+                match_length += byte
+                if byte != 255:
+                    break
+        match_length += 4
+
+        start = len(output) - offset
+        if offset <= 0 or start < 0:
+            raise ChunkDataError('Invalid LZ4 match offset')
+        if match_length <= offset:
+            output += output[start:start + match_length]
+        else:
+            # the match overlaps the output it copies, so the last bytes are repeated
+            output += (output[start:] * (match_length // offset + 1))[:match_length]
+
+    if len(output) != original_length:
+        raise ChunkDataError('LZ4 block has the wrong length')
+    return output
+
+
+def peek_data_version(data):
+    """Returns the DataVersion of decompressed chunk data without parsing it or None if it has none (before 1.9). If
+    there are multiple DataVersion tags, the lowest one is returned, so that it is never too high."""
+    data_version = None
+    position = data.find(_data_version_tag)
+    while position >= 0 and position + len(_data_version_tag) + 4 <= len(data):
+        value = _int.unpack_from(data, position + len(_data_version_tag))[0]
+        data_version = value if data_version is None else min(data_version, value)
+        position = data.find(_data_version_tag, position + 1)
+    return data_version
+
+
+class Region(RegionFile):
+    """A region file that reads chunks with every compression Minecraft uses, including LZ4 (1.20.5+) and oversized
+    chunks that are saved in external c.X.Z.mcc files next to the region file (1.15+).
+
+    Chunks that are too large for the region file are written to external files as well."""
+
+    def __init__(self, fileobj, folder=None):
+        self.folder = folder
+        super().__init__(fileobj=fileobj)
+
+    def _parse_chunk_headers(self):
+        super()._parse_chunk_headers()
+        for metadata in self.metadata.values():
+            # only the compression id is saved in the region file for external chunks
+            if metadata.status == STATUS_CHUNK_ZERO_LENGTH and metadata.length == 1 and \
+                    metadata.compression is not None and metadata.compression & EXTERNAL_FLAG:
+                metadata.status = STATUS_CHUNK_OK
+
+    def external_file(self, x, z):
+        if self.folder is None or self.loc.x is None or self.loc.z is None:
+            return None
+        return Path(self.folder, f'c.{self.loc.x * 32 + x}.{self.loc.z * 32 + z}.mcc')
+
+    def get_blockdata(self, x, z):
+        try:
+            compression, data = self.get_compressed_blockdata(x, z)
+            # the data of external chunks is counted as well, the header only contains their compression id
+            bytes_read = len(data) + 5
+            data = decompress(data, compression)
+        except Exception:
+            metrics.count(not_readable_chunks=1)
+            raise
+        metrics.count(chunks_decoded=1, bytes_read=bytes_read)
+        return data
+
+    def is_readable(self, x, z):
+        """Whether the header places a chunk at a valid place in the file, without reading it."""
+        return self.metadata[x, z].status in _readable_statuses
+
+    def get_compressed_blockdata(self, x, z):
+        """Returns the compression id and the data of a chunk without decompressing it, e.g. to compare chunks
+        cheaply. Raises a RegionFileFormatError if the chunk is not saved at a valid place."""
+        metadata = self.metadata[x, z]
+        if metadata.status not in _readable_statuses:
+            # raises the matching error
+            super().get_blockdata(x, z)
+            raise ChunkDataError(f'Chunk {x},{z} is partially outside the file')
+
+        compression = metadata.compression
+        if compression & EXTERNAL_FLAG:
+            external_file = self.external_file(x, z)
+            if external_file is None or not external_file.is_file():
+                raise ChunkDataError(f'The external file of chunk {x},{z} does not exist')
+            return compression & ~EXTERNAL_FLAG, external_file.read_bytes()
+
+        start = metadata.blockstart * SECTOR_LENGTH + 5
+        self.file.seek(start)
+        # the length includes the compression byte
+        return compression, self.file.read(min(metadata.length - 1, self.size - start))
+
+    def get_nbt_before(self, x, z, data_version):
+        """Returns a chunk like ``get_nbt`` or None without parsing it if its DataVersion is at least
+        ``data_version``."""
+        data = self.get_blockdata(x, z)
+        chunk_data_version = peek_data_version(data)
+        if chunk_data_version is not None and chunk_data_version >= data_version:
+            return None
+        try:
+            chunk = NBTFile(buffer=BytesIO(data))
+        except MalformedFileError as e:
+            raise ChunkDataError(str(e))
+        chunk.loc = Location(x=x + self.loc.x * 32 if self.loc.x is not None else x,
+                             z=z + self.loc.z * 32 if self.loc.z is not None else z)
+        return chunk
+
+    def write_blockdata(self, x, z, data, compression=COMPRESSION_ZLIB):
+        if compression == 0:
+            compression = COMPRESSION_NONE
+        data = compress(data, compression)
+        external_file = self.external_file(x, z)
+        try:
+            # the data is already compressed, the compression id is corrected afterwards
+            super().write_blockdata(x, z, data, 0)
+            length = len(data) + 1
+        except ChunkDataError:
+            if external_file is None:
+                raise
+            # too large for the region file
+            external_file.write_bytes(data)
+            super().write_blockdata(x, z, b'', 0)
+            compression |= EXTERNAL_FLAG
+            length = 1
+        else:
+            if external_file is not None and external_file.is_file():
+                external_file.unlink()
+
+        metadata = self.metadata[x, z]
+        self.file.seek(metadata.blockstart * SECTOR_LENGTH + 4)
+        self.file.write(struct.pack('>B', compression))
+        metrics.count(bytes_written=len(data) + 5)
+        metadata.length, metadata.compression, metadata.status = length, compression, STATUS_CHUNK_OK
+
+    def compact(self):
+        """Move the chunks to the start of the file without free sectors between them and truncate the file, so that
+        space freed by removed or shrunk chunks is returned. Nothing is moved if a chunk is saved at an invalid place.
+        Returns the number of freed bytes."""
+        chunks = [metadata for metadata in self.metadata.values() if metadata.status != STATUS_CHUNK_NOT_CREATED]
+        if any(metadata.status != STATUS_CHUNK_OK for metadata in chunks):
+            return 0
+
+        sector = 2
+        for metadata in sorted(chunks, key=lambda metadata: metadata.blockstart):
+            if metadata.blockstart != sector:
+                self.file.seek(metadata.blockstart * SECTOR_LENGTH)
+                data = self.file.read(metadata.blocklength * SECTOR_LENGTH)
+                self.file.seek(sector * SECTOR_LENGTH)
+                self.file.write(data)
+                self.file.seek(4 * (metadata.x + 32 * metadata.z))
+                self.file.write(struct.pack('>I', sector << 8 | metadata.blocklength))
+                metadata.blockstart = sector
+            sector += metadata.blocklength
+
+        freed = max(self.size - sector * SECTOR_LENGTH, 0)
+        if freed:
+            self.size = sector * SECTOR_LENGTH
+            self.file.truncate(self.size)
+        return freed
+
+    def unlink_chunk(self, x, z):
+        external_file = self.external_file(x, z)
+        super().unlink_chunk(x, z)
+        if external_file is not None and external_file.is_file():
+            external_file.unlink()
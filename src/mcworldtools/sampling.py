@@ -0,0 +1,140 @@
+"""Estimates of statistics over all chunks of a world from a stratified random sample of chunks.
+
+Every region file is a stratum: the chunks to read are drawn at random from the chunk slots in its header, and the
+totals are estimated per region file and summed up, so that large and small region files are weighted correctly.
+"""
+import math
+import random
+import struct
+
+from nbt.region import SECTOR_LENGTH
+
+# 95% confidence intervals
+z_value = 1.96
+# the least number of chunks read per region file, so that the variance within it can be estimated
+min_stratum_sample = 2
+
+
+def get_chunk_slots(region_file):
+    """Returns the (x, z, sectors) of the chunks in the header of a region file without reading the chunks."""
+    with region_file.open('rb') as file:
+        locations = file.read(SECTOR_LENGTH)
+    slots = []
+    for index in range(len(locations) // 4):
+        offset, sectors = struct.unpack_from('>I', locations, index * 4)[0] >> 8, locations[index * 4 + 3]
+        if offset and sectors:
+            slots.append((index % 32, index // 32, sectors))
+    return slots
+
+
+def allocate_sample(sizes, sample, rng=random):
+    """Split a sample size among strata, so that at most ``sample`` chunks are read. Every stratum gets
+    ``min_stratum_sample`` chunks and the rest is split proportionally to their sizes. If there are more strata than
+    that allows, only a random selection of strata is sampled as clusters and the others get 0 chunks (see
+    ``Estimator.add_strata``). Returns the number of chunks to read per stratum."""
+    selected = range(len(sizes))
+    max_strata = max(1, sample // min_stratum_sample)
+    if len(sizes) > max_strata:
+        selected = rng.sample(selected, max_strata)
+
+    counts = [0] * len(sizes)
+    for index in selected:
+        counts[index] = min(sizes[index], min_stratum_sample, sample)
+    remaining = sample - sum(counts)
+    total = sum(sizes[index] for index in selected)
+    if remaining > 0 and total:
+        for index in selected:
+            counts[index] += min(sizes[index] - counts[index], remaining * sizes[index] // total)
+    return counts
+
+
+def draw(slots, count, rng=random):
+    return rng.sample(slots, count) if count < len(slots) else list(slots)
+
+
+class Estimator:
+    """Estimates the totals of values of all chunks from the values of the sampled chunks of each stratum.
+
+    Values that a sampled chunk does not have count as 0. The variance of each total follows the formula of
+    stratified random sampling without replacement, the confidence interval is never below the observed sum."""
+
+    def __init__(self):
+        self.population = 0
+        self.sampled = 0
+        # name -> [estimate, variance, observed sum]
+        self.totals = {}
+
+    def add_stratum(self, size, samples):
+        """Add a stratum of ``size`` chunks with a list of dicts of the values of its sampled chunks. Strata without
+        any readable sampled chunk are not estimated."""
+        sample_size = len(samples)
+        self.population += size
+        if not sample_size:
+            return
+        self.sampled += sample_size
+        names = set(name for values in samples for name in values)
+        for name in names:
+            values = [sample.get(name, 0) for sample in samples]
+            mean = sum(values) / sample_size
+            variance = sum((value - mean) ** 2 for value in values) / (sample_size - 1) if sample_size > 1 else 0
+            total = self.totals.setdefault(name, [0, 0, 0])
+            total[0] += size * mean
+            total[1] += size * size * (1 - sample_size / size) * variance / sample_size
+            total[2] += sum(values)
+
+    def add_strata(self, strata):
+        """Add strata given as (size, list of dicts of the values of its sampled chunks). If some of them were not
+        sampled (None instead of the list), the sampled ones are a random selection of clusters of all of them and
+        the totals are estimated in two stages: from the chunks to their cluster and from the clusters to all."""
+        clusters = []
+        for size, samples in strata:
+            if samples is not None:
+                cluster = Estimator()
+                cluster.add_stratum(size, samples)
+                clusters.append(cluster)
+        if len(clusters) == len(strata):
+            for cluster in clusters:
+                self.add(cluster)
+            return
+
+        count, selected = len(strata), len(clusters)
+        self.population += sum(size for size, _ in strata)
+        self.sampled += sum(cluster.sampled for cluster in clusters)
+        names = set(name for cluster in clusters for name in cluster.totals)
+        for name in names:
+            values = [cluster.totals.get(name, (0, 0, 0)) for cluster in clusters]
+            mean = sum(estimate for estimate, _, _ in values) / selected
+            variance = sum((estimate - mean) ** 2 for estimate, _, _ in values) / (selected - 1) \
+                if selected > 1 else 0
+            total = self.totals.setdefault(name, [0, 0, 0])
+            total[0] += count * mean
+            total[1] += count * count * (1 - selected / count) * variance / selected + \
+                count / selected * sum(within for _, within, _ in values)
+            total[2] += sum(observed for _, _, observed in values)
+
+    def add(self, estimator):
+        """Add the strata of another Estimator, e.g. of another world."""
+        self.population += estimator.population
+        self.sampled += estimator.sampled
+        for name, (estimate, variance, observed) in estimator.totals.items():
+            total = self.totals.setdefault(name, [0, 0, 0])
+            total[0] += estimate
+            total[1] += variance
+            total[2] += observed
+
+    def get(self, name):
+        """Returns the estimated total of a value with the bounds of its confidence interval."""
+        estimate, variance, observed = self.totals.get(name, (0, 0, 0))
+        margin = z_value * math.sqrt(variance)
+        return {
+            'estimate': round(estimate),
+            'low': round(max(estimate - margin, observed)),
+            'high': round(estimate + margin)
+        }
+
+    def names(self):
+        return list(self.totals)
+
+
+def format_estimate(estimate, format_value=str):
+    return f'{format_value(estimate["estimate"])} ({format_value(estimate["low"])} - {format_value(estimate["high"])})'
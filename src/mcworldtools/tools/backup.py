@@ -0,0 +1,541 @@
+import hashlib
+import json
+import os
+import struct
+from datetime import datetime
+
+from nbt.region import *
+
+from .. import metrics
+from ..region import EXTERNAL_FLAG
+from ..util import *
+
+actions = ['Back up worlds', 'Restore a snapshot']
+objects_folder = 'objects'
+snapshots_folder = 'snapshots'
+# files that are not backed up, Minecraft creates them again
+ignored_files = ('session.lock',)
+external_file_pattern = re.compile(r'c\.(-?\d+)\.(-?\d+)\.mcc')
+_length = struct.Struct('>I')
+
+
+class ChunkStore:
+    """A content-addressed store of compressed chunks and other world files in a folder.
+
+    Every object is saved once in "objects/<first two characters of its hash>/<hash>", so chunks that did not change
+    between snapshots take no additional space. Snapshots are manifests in "snapshots/<name>.json" that list the
+    objects of every file of a world."""
+
+    def __init__(self, folder):
+        self.folder = Path(folder)
+        self.stored_objects = 0
+        self.stored_bytes = 0
+
+    def object_file(self, object_hash):
+        return Path(self.folder, objects_folder, object_hash[:2], object_hash)
+
+    def put(self, data):
+        """Save an object if it is not saved yet and return its hash."""
+        object_hash = hashlib.sha256(data).hexdigest()
+        file = self.object_file(object_hash)
+        if not file.is_file():
+            file.parent.mkdir(parents=True, exist_ok=True)
+            # the object is written to a temporary file first, so that an aborted backup leaves no broken object
+            temp_file = file.with_name(file.name + '.tmp')
+            temp_file.write_bytes(data)
+            temp_file.replace(file)
+            self.stored_objects += 1
+            self.stored_bytes += len(data)
+        return object_hash
+
+    def get(self, object_hash):
+        try:
+            return self.object_file(object_hash).read_bytes()
+        except FileNotFoundError:
+            raise InputError(f'The object "{object_hash}" is missing in the store "{self.folder}".')
+
+    def snapshot_file(self, name):
+        return Path(self.folder, snapshots_folder, f'{name}.json')
+
+    def get_snapshots(self):
+        """Returns the names of the snapshots, the newest first."""
+        files = Path(self.folder, snapshots_folder).glob('*.json')
+        return [file.stem for file in sorted(files, key=lambda file: file.stat().st_mtime, reverse=True)]
+
+    def load_snapshot(self, name):
+        file = self.snapshot_file(name)
+        if not file.is_file():
+            raise InputError(f'The snapshot "{name}" does not exist in the store "{self.folder}".')
+        with file.open('r') as manifest_file:
+            return json.load(manifest_file)
+
+    def save_snapshot(self, name, manifest):
+        file = self.snapshot_file(name)
+        file.parent.mkdir(parents=True, exist_ok=True)
+        temp_file = file.with_name(file.name + '.tmp')
+        with temp_file.open('w') as manifest_file:
+            json.dump(manifest, manifest_file, separators=(',', ':'))
+        temp_file.replace(file)
+
+    def get_latest_snapshot(self, world_folder):
+        """Returns the manifest of the newest snapshot of a world or None if there is none."""
+        world = str(Path(world_folder).resolve())
+        for name in self.get_snapshots():
+            manifest = self.load_snapshot(name)
+            if manifest.get('world') == world:
+                return manifest
+        return None
+
+
+def start(world_folders, output_file, output_format, input_data, confirm):
+    action_count = len(actions)
+    action = None
+    if input_data and 'action' in input_data:
+        print('\nLoading input file data...')
+        action = input_data['action']
+        if not isinstance(action, int):
+            raise InputError(f'"action" has to be a number but is {type(action).__name__}')
+        if action < 1 or action > action_count:
+            raise InputError(f'"action" has to be one of {", ".join(str(i) for i in range(1, len(actions) + 1))}')
+        print(f'Using action "{actions[action - 1]}"')
+
+    if not action:
+        print('\nChoose what you want to do.')
+        for i in range(action_count):
+            print(f'{i + 1}. {actions[i]}')
+
+        while True:
+            answer = input(f'Select an action (1-{action_count}): ')
+            if not answer.isnumeric():
+                print('Please state a number.')
+                continue
+
+            action = int(answer)
+            if action < 1 or action > action_count:
+                print(f'Please state a number between 1 and {action_count}.')
+                continue
+            break
+        print(f'Using action "{actions[action - 1]}"')
+
+    store = None
+    if input_data and 'store' in input_data:
+        store = input_data['store']
+        if not isinstance(store, str):
+            raise InputError(f'"store" has to be text but is {type(store).__name__}')
+        store = Path(store)
+        if store.exists() and not store.is_dir():
+            raise InputError(f'The store "{store}" is not a folder.')
+        print(f'Using store "{store}"')
+
+    if store is None:
+        print('\nState the folder of the backup store. It is created if it does not exist.')
+        while True:
+            answer = input('Store: ').strip()
+            if not answer:
+                continue
+            if Path(answer).exists() and not Path(answer).is_dir():
+                print('This is not a folder.')
+                continue
+            store = Path(answer)
+            break
+
+    if action == 1:
+        backup(world_folders, output_file, output_format, ChunkStore(store))
+    elif action == 2:
+        restore(output_file, output_format, input_data, ChunkStore(store))
+
+
+def backup(world_folders, output_file, output_format, store):
+    total_start_time = time.time()
+    total_chunks, total_unchanged_chunks, total_files = 0, 0, 0
+    worlds = {}
+    for world_folder in world_folders:
+        print(f'\nBacking up world "{world_folder}" to "{store.folder}"...')
+        start_time = time.time()
+        metrics.start_world(world_folder)
+        stored_objects, stored_bytes = store.stored_objects, store.stored_bytes
+        name, manifest, stats = backup_world(world_folder, store, progress=True)
+        stored_objects, stored_bytes = store.stored_objects - stored_objects, store.stored_bytes - stored_bytes
+
+        elapsed_time = int(round((time.time() - start_time) * 1000))
+        human_readable_elapsed_time = format_time(elapsed_time)
+        stored_space, stored_space_unit = format_freed_space(stored_bytes)
+        human_readable_stored_space = f'{stored_space:.2f}{stored_space_unit}'
+
+        print(f'Saved snapshot "{name}" of {stats["chunks"]} chunks and {stats["files"]} other files. '
+              f'{stats["unchanged_chunks"]} chunks were unchanged since the last snapshot and not read. '
+              f'(Elapsed time: {human_readable_elapsed_time})')
+        print(f'Stored {stored_objects} new objects ({human_readable_stored_space}).')
+
+        total_chunks += stats['chunks']
+        total_unchanged_chunks += stats['unchanged_chunks']
+        total_files += stats['files']
+
+        if output_file:
+            worlds[str(world_folder.resolve())] = {
+                'snapshot': name,
+                'previous_snapshot': manifest['previous'],
+                'chunks': stats['chunks'],
+                'unchanged_chunks': stats['unchanged_chunks'],
+                'files': stats['files'],
+                'stored_objects': stored_objects,
+                'stored_space': {
+                    'raw': stored_bytes,
+                    'human_readable': human_readable_stored_space
+                },
+                'elapsed_time': {
+                    'raw': elapsed_time,
+                    'human_readable': human_readable_elapsed_time
+                }
+            }
+
+    elapsed_time = int(round((time.time() - total_start_time) * 1000))
+    human_readable_elapsed_time = format_time(elapsed_time)
+    stored_space, stored_space_unit = format_freed_space(store.stored_bytes)
+    human_readable_stored_space = f'{stored_space:.2f}{stored_space_unit}'
+
+    if len(world_folders) > 1:
+        print(f'\nTotal stored objects: {store.stored_objects} ({human_readable_stored_space})'
+              f'\nTotal elapsed time: {human_readable_elapsed_time}')
+
+    if output_file:
+        data = {
+            'store': str(store.folder.resolve()),
+            'worlds': worlds,
+            'total': {
+                'chunks': total_chunks,
+                'unchanged_chunks': total_unchanged_chunks,
+                'files': total_files,
+                'stored_objects': store.stored_objects,
+                'stored_space': {
+                    'raw': store.stored_bytes,
+                    'human_readable': human_readable_stored_space
+                },
+                'elapsed_time': {
+                    'raw': elapsed_time,
+                    'human_readable': human_readable_elapsed_time
+                }
+            }
+        }
+
+        with Path(output_file).open('w') as file:
+            if output_format == 'plain':
+                file.write(f'--- MCWorldTools by Rapha149 ---'
+                           f'\n\u00B7\u00B7\u00B7 Back up worlds \u00B7\u00B7\u00B7'
+                           f'\n\nStore: {data["store"]}'
+                           f'\nTotal chunks: {total_chunks}'
+                           f'\nTotal unchanged chunks: {total_unchanged_chunks}'
+                           f'\nTotal other files: {total_files}'
+                           f'\nTotal stored objects: {store.stored_objects}'
+                           f'\nTotal stored space: {human_readable_stored_space}'
+                           f'\nTotal elapsed time: {human_readable_elapsed_time}'
+                           f'\n\n[ Worlds ]')
+                for world, info in worlds.items():
+                    file.write(f'\n{world}'
+                               f'\n    Snapshot: {info["snapshot"]}')
+                    if info['previous_snapshot']:
+                        file.write(f'\n    Previous snapshot: {info["previous_snapshot"]}')
+                    file.write(f'\n    Chunks: {info["chunks"]}'
+                               f'\n    Unchanged chunks: {info["unchanged_chunks"]}'
+                               f'\n    Other files: {info["files"]}'
+                               f'\n    Stored objects: {info["stored_objects"]}'
+                               f'\n    Stored space: {info["stored_space"]["human_readable"]}'
+                               f'\n    Elapsed time: {info["elapsed_time"]["human_readable"]}\n')
+            else:
+                dump_data(data, file, output_format)
+
+            print(f'\nSaved output to "{output_file}"')
+
+
+def restore(output_file, output_format, input_data, store):
+    snapshot, target = None, None
+    if input_data:
+        if 'snapshot' in input_data:
+            snapshot = input_data['snapshot']
+            if not isinstance(snapshot, str):
+                raise InputError(f'"snapshot" has to be text but is {type(snapshot).__name__}')
+            if not store.snapshot_file(snapshot).is_file():
+                raise InputError(f'The snapshot "{snapshot}" does not exist in the store "{store.folder}".')
+            print(f'Restoring snapshot "{snapshot}"')
+
+        if 'target' in input_data:
+            target = input_data['target']
+            if not isinstance(target, str):
+                raise InputError(f'"target" has to be text but is {type(target).__name__}')
+            target = Path(target)
+            print(f'Restoring to "{target}"')
+
+    if snapshot is None:
+        snapshots = store.get_snapshots()
+        if not snapshots:
+            raise InputError(f'The store "{store.folder}" contains no snapshots.')
+        print(f'\nChoose the snapshot to restore. The newest snapshots are "{", ".join(snapshots[:5])}"')
+        complete(snapshots)
+        while True:
+            answer = input('Snapshot: ').strip()
+            if answer not in snapshots:
+                print('Unknown snapshot.')
+                continue
+            snapshot = answer
+            break
+        complete([])
+
+    manifest = store.load_snapshot(snapshot)
+    if target is None:
+        print('\nState the folder to restore the world to. It must not exist yet or be empty.')
+        while True:
+            answer = input('Target folder: ').strip()
+            if not answer:
+                continue
+            target = Path(answer)
+            if any(_is_used(folder) for folder in get_restore_folders(manifest, target).values()):
+                print('This folder is not empty.')
+                continue
+            break
+
+    for folder in get_restore_folders(manifest, target).values():
+        if _is_used(folder):
+            raise InputError(f'The folder "{folder}" is not empty.')
+
+    print(f'\nRestoring snapshot "{snapshot}" of world "{manifest["world"]}" to "{target}"...')
+    start_time = time.time()
+    stats = restore_snapshot(store, manifest, target, progress=True)
+    elapsed_time = int(round((time.time() - start_time) * 1000))
+    human_readable_elapsed_time = format_time(elapsed_time)
+    print(f'Restored {stats["chunks"]} chunks in {stats["region_files"]} region files and {stats["files"]} other '
+          f'files. (Elapsed time: {human_readable_elapsed_time})')
+
+    if output_file:
+        data = {
+            'store': str(store.folder.resolve()),
+            'snapshot': snapshot,
+            'world': manifest['world'],
+            'target': str(target.resolve()),
+            'chunks': stats['chunks'],
+            'region_files': stats['region_files'],
+            'files': stats['files'],
+            'elapsed_time': {
+                'raw': elapsed_time,
+                'human_readable': human_readable_elapsed_time
+            }
+        }
+
+        with Path(output_file).open('w') as file:
+            if output_format == 'plain':
+                file.write(f'--- MCWorldTools by Rapha149 ---'
+                           f'\n\u00B7\u00B7\u00B7 Restore a snapshot \u00B7\u00B7\u00B7'
+                           f'\n\nStore: {data["store"]}'
+                           f'\nSnapshot: {snapshot}'
+                           f'\nWorld: {data["world"]}'
+                           f'\nTarget: {data["target"]}'
+                           f'\nChunks: {stats["chunks"]}'
+                           f'\nRegion files: {stats["region_files"]}'
+                           f'\nOther files: {stats["files"]}'
+                           f'\nElapsed time: {human_readable_elapsed_time}\n')
+            else:
+                dump_data(data, file, output_format)
+
+            print(f'\nSaved output to "{output_file}"')
+
+
+def _is_used(folder):
+    return folder.exists() and (not folder.is_dir() or any(folder.iterdir()))
+
+
+def get_world_roots(world_folder):
+    """Returns the folders of a world to back up, mapped by their suffix: the world folder with "" and the worlds of
+    the nether and the end of Bukkit based servers next to it with their suffix (e.g. "_nether")."""
+    world_path = Path(world_folder).resolve()
+    roots = {'': world_path}
+    for folder in get_dimension_folders(world_folder).values():
+        folder = folder.resolve()
+        if folder != world_path and world_path not in folder.parents:
+            # e.g. "world_nether/DIM-1"
+            roots[folder.parent.name[len(world_path.name):]] = folder.parent
+    return roots
+
+
+def get_restore_folders(manifest, target):
+    """Returns the folders a snapshot is restored to, mapped by the suffixes of ``get_world_roots``."""
+    target = Path(target)
+    return {suffix: Path(target.parent, target.name + suffix) for suffix in manifest['folders']}
+
+
+def _get_files(root, store_folder):
+    for file in sorted(root.rglob('*')):
+        if not file.is_file() or file.name in ignored_files or file.name.endswith('.tmp'):
+            continue
+        parts = file.relative_to(root).parts
+        if parts[0] == state_folder or file == store_folder or store_folder in file.parents:
+            continue
+        yield file
+
+
+def backup_world(world_folder, store, name=None, progress=False):
+    """Save a snapshot of a world in a ChunkStore. Returns the name of the snapshot, its manifest and statistics.
+
+    Region files are split into their compressed chunks, every other file is saved as a whole. Chunks whose timestamp
+    and length are the same as in the previous snapshot of the world are not read again, if they were saved before
+    that snapshot was taken."""
+    start_time = int(time.time())
+    previous = store.get_latest_snapshot(world_folder)
+    if name is None:
+        name = f'{Path(world_folder).resolve().name}-{datetime.fromtimestamp(start_time):%Y-%m-%d_%H-%M-%S}'
+        base_name, number = name, 1
+        while store.snapshot_file(name).is_file():
+            number += 1
+            name = f'{base_name}-{number}'
+
+    manifest = {
+        'world': str(Path(world_folder).resolve()),
+        'time': start_time,
+        'previous': previous['name'] if previous else None,
+        'name': name,
+        'folders': {}
+    }
+    stats = {'chunks': 0, 'unchanged_chunks': 0, 'files': 0}
+    store_folder = store.folder.resolve()
+    roots = get_world_roots(world_folder)
+    files = {suffix: list(_get_files(root, store_folder)) for suffix, root in roots.items()}
+    region_files = [file for root_files in files.values() for file in root_files
+                    if region_file_pattern.fullmatch(file.name)]
+
+    with Progress(region_files, show=progress) as pbar:
+        for suffix, root in roots.items():
+            folder = manifest['folders'][suffix] = {'files': {}, 'regions': {}}
+            previous_folder = previous['folders'].get(suffix, {}) if previous else {}
+            chunked = set()
+            for file in files[suffix]:
+                if not region_file_pattern.fullmatch(file.name):
+                    continue
+                key = file.relative_to(root).as_posix()
+                chunks = _backup_region(file, store, previous_folder.get('regions', {}).get(key),
+                                        previous['time'] if previous else None, stats, pbar)
+                if chunks is not None:
+                    folder['regions'][key] = chunks
+                    chunked.add(file)
+                pbar.file_done(file)
+
+            previous_files = previous_folder.get('files', {})
+            for file in files[suffix]:
+                if file in chunked or _is_external_chunk(file, chunked):
+                    continue
+                key = file.relative_to(root).as_posix()
+                stat = file.stat()
+                previous_file = previous_files.get(key)
+                if previous_file and previous_file[1] == stat.st_size and previous_file[2] == stat.st_mtime_ns:
+                    folder['files'][key] = previous_file
+                else:
+                    folder['files'][key] = [store.put(file.read_bytes()), stat.st_size, stat.st_mtime_ns]
+                stats['files'] += 1
+
+    # the manifest is saved last, so that an aborted backup leaves no snapshot
+    store.save_snapshot(name, manifest)
+    return name, manifest, stats
+
+
+def _is_external_chunk(file, chunked):
+    """Whether a file is an external chunk (c.X.Z.mcc) of a region file whose chunks are saved separately."""
+    match = external_file_pattern.fullmatch(file.name)
+    return match is not None and \
+        Path(file.parent, f'r.{int(match.group(1)) >> 5}.{int(match.group(2)) >> 5}.mca') in chunked
+
+
+def _backup_region(region_file, store, previous_chunks, previous_time, stats, pbar):
+    """Save the chunks of a region file in the store. Returns them as [index, timestamp, length, hash] lists or None
+    if the region file has to be saved as a whole because it contains chunks that can't be read."""
+    if region_file.stat().st_size < 2 * SECTOR_LENGTH:
+        return None
+    previous_chunks = {chunk[0]: chunk for chunk in previous_chunks} if previous_chunks else {}
+    chunks, unchanged_chunks = [], 0
+    with region_file.open('rb') as file:
+        try:
+            region = open_region(file, region_file)
+        except RegionFileFormatError:
+            return None
+
+        for metadata in region.get_metadata():
+            index = metadata.x + metadata.z * 32
+            previous_chunk = previous_chunks.get(index)
+            if previous_chunk and previous_chunk[1] == metadata.timestamp and previous_chunk[2] == metadata.length \
+                    and metadata.timestamp < previous_time:
+                chunks.append(previous_chunk)
+                unchanged_chunks += 1
+            else:
+                try:
+                    compression, data = region.get_compressed_blockdata(metadata.x, metadata.z)
+                except RegionFileFormatError:
+                    return None
+                chunks.append([index, metadata.timestamp, metadata.length,
+                               store.put(struct.pack('>B', compression) + data)])
+                metrics.count(bytes_read=len(data) + 5)
+            pbar.chunk(region, metadata.x, metadata.z)
+
+    # only counted if the region file is not saved as a whole
+    stats['chunks'] += len(chunks)
+    stats['unchanged_chunks'] += unchanged_chunks
+    metrics.count(chunks_skipped=unchanged_chunks)
+    return chunks
+
+
+def restore_snapshot(store, manifest, target, progress=False):
+    """Restore a snapshot of a ChunkStore to a folder. The nether and the end of Bukkit based servers are restored
+    next to it. Returns statistics."""
+    stats = {'chunks': 0, 'region_files': 0, 'files': 0}
+    folders = get_restore_folders(manifest, target)
+    pbar = None
+    if progress:
+        from tqdm import tqdm
+        pbar = tqdm(total=sum(len(chunks) for folder in manifest['folders'].values()
+                              for chunks in folder['regions'].values()) or 1, unit=' chunks',
+                    bar_format='{percentage:.2f}% |{bar}| [{n_fmt}/{total_fmt} chunks, {remaining} left]  ')
+    try:
+        for suffix, folder in manifest['folders'].items():
+            root = folders[suffix]
+            for key, (object_hash, _, mtime) in folder['files'].items():
+                file = Path(root, *key.split('/'))
+                file.parent.mkdir(parents=True, exist_ok=True)
+                file.write_bytes(store.get(object_hash))
+                os.utime(file, ns=(mtime, mtime))
+                stats['files'] += 1
+
+            for key, chunks in folder['regions'].items():
+                region_file = Path(root, *key.split('/'))
+                region_file.parent.mkdir(parents=True, exist_ok=True)
+                write_region(region_file, chunks, store)
+                stats['region_files'] += 1
+                stats['chunks'] += len(chunks)
+                if pbar is not None:
+                    pbar.update(len(chunks))
+    finally:
+        if pbar is not None:
+            pbar.close()
+    return stats
+
+
+def write_region(region_file, chunks, store):
+    """Write a region file with the chunks of a manifest without free sectors between them. Chunks that are too large
+    for the region file are written to external c.X.Z.mcc files like Minecraft does."""
+    match = region_file_pattern.fullmatch(region_file.name)
+    region_x, region_z = int(match.group(1)), int(match.group(2))
+    header = bytearray(2 * SECTOR_LENGTH)
+    sector = 2
+    with region_file.open('wb') as file:
+        file.write(header)
+        for index, timestamp, _, object_hash in chunks:
+            data = store.get(object_hash)
+            # the length includes the compression byte
+            data = _length.pack(len(data)) + data
+            if len(data) > 255 * SECTOR_LENGTH:
+                external_file = Path(region_file.parent,
+                                     f'c.{region_x * 32 + index % 32}.{region_z * 32 + index // 32}.mcc')
+                external_file.write_bytes(data[5:])
+                data = _length.pack(1) + struct.pack('>B', data[4] | EXTERNAL_FLAG)
+
+            sectors = -(-len(data) // SECTOR_LENGTH)
+            file.write(data + bytes(sectors * SECTOR_LENGTH - len(data)))
+            header[index * 4:index * 4 + 4] = _length.pack(sector << 8 | sectors)
+            header[SECTOR_LENGTH + index * 4:SECTOR_LENGTH + index * 4 + 4] = _length.pack(timestamp)
+            sector += sectors
+        file.seek(0)
+        file.write(header)
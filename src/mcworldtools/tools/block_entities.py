@@ -0,0 +1,335 @@
+import json
+import os
+import re
+
+from nbt.region import *
+
+from .. import metrics
+from ..query import compile_query
+from ..util import *
+
+
+def start(world_folders, output_file, output_format, input_data, confirm):
+    find(world_folders, output_file, output_format, input_data)
+
+
+def find(world_folders, output_file, output_format, input_data):
+    if not output_file:
+        print(f'\nFor this tool you have to state an output file as command argument (-o).')
+        exit(4)
+
+    block_entity_ids, limit_to_dimension, limit_dimension, include_nbt, nbt_keys = None, None, None, None, None
+    processes, query = None, None
+    if input_data:
+        print('\nLoading input file data...')
+        if 'ids' in input_data:
+            ids = input_data['ids']
+            if not isinstance(ids, list):
+                raise InputError(f'"ids" has to be a list but is {type(ids).__name__}')
+            if not ids:
+                raise InputError(f'"ids" has to contain at least one block entity id.')
+            for i in range(len(ids)):
+                if not isinstance(ids[i], str):
+                    raise InputError(f'{i + 1}. item in "ids" has to be text but is {type(ids[i]).__name__}')
+            block_entity_ids = set(normalize_block_entity_id(block_entity_id) for block_entity_id in ids)
+            print(f'Using block entity ids "{", ".join(sorted(block_entity_ids))}"')
+
+        if 'dimension' in input_data:
+            limit_dimension = input_data['dimension']
+            if limit_dimension is None:
+                limit_to_dimension = False
+                print(f'Not limiting to one dimension.')
+            else:
+                if not isinstance(limit_dimension, str):
+                    raise InputError(f'"dimension" has to be text but is {type(limit_dimension).__name__}')
+                limit_to_dimension = True
+                limit_dimension = limit_dimension.lower()
+                if not is_dimension(limit_dimension):
+                    raise InputError(f'Unknown dimension "{limit_dimension}"')
+                print(f'Limiting to dimension "{limit_dimension}"')
+
+        if 'nbt_keys' in input_data:
+            nbt_keys = input_data['nbt_keys']
+            if nbt_keys is None:
+                include_nbt = False
+                print(f'Not including NBT keys.')
+            else:
+                if not isinstance(nbt_keys, list):
+                    raise InputError(f'"nbt_keys" has to be a list but is {type(nbt_keys).__name__}')
+                include_nbt = True
+                print(f'Using {len(nbt_keys)} NBT keys.')
+
+        if 'query' in input_data:
+            query = input_data['query']
+            if query is not None:
+                compile_query(query)
+                print(f'Using query "{query}"')
+
+        if 'processes' in input_data:
+            processes = input_data['processes']
+            if processes is not None and (not isinstance(processes, int) or processes <= 0):
+                raise InputError(f'"processes" has to be a positive number.')
+
+    if block_entity_ids is None:
+        print('\nChoose the ids of the block entities to search for (e.g. "hopper", "spawner" or "command_block").'
+              ' Enter nothing once your finished.'
+              '\nYou don\'t have to prepend them with "minecraft:".')
+        block_entity_ids = set()
+        while True:
+            answer = input(f'{len(block_entity_ids) + 1}. Block entity id: ').strip()
+            if not answer:
+                if block_entity_ids:
+                    break
+                else:
+                    print('State at least 1 block entity id.')
+                    continue
+
+            block_entity_ids.add(normalize_block_entity_id(answer))
+        print(f'Using block entity ids "{", ".join(sorted(block_entity_ids))}"')
+
+    if limit_to_dimension is None:
+        world_dimensions = get_dimensions(world_folders)
+        dimensions_str = '"' + '", "'.join(world_dimensions) + '"'
+        print('\nChoose a dimension where block entities should be searched. Enter nothing for all dimensions.'
+              f'\nIt can be one of {dimensions_str}')
+        complete(world_dimensions, case_insensitive=True)
+        while True:
+            answer = input('Dimension: ')
+            if not answer:
+                limit_to_dimension = False
+                break
+            else:
+                answer = answer.strip().lower()
+                if not is_dimension(answer):
+                    print('Unknown dimension.')
+                    continue
+                limit_to_dimension = True
+                limit_dimension = answer
+                break
+        complete([])
+
+    if include_nbt is None:
+        print('\nChoose the NBT keys to be included in the output. Enter nothing once your finished.'
+              '\nFor all NBT keys, enter nothing directly. Enter "---" to not include any NBT keys.'
+              '\nPlease note that NBT keys are case sensitive.')
+        nbt_keys = []
+        while True:
+            answer = input(f'{len(nbt_keys) + 1}. NBT key: ').strip()
+            if not answer:
+                include_nbt = True
+                if nbt_keys:
+                    print(f'Using {len(nbt_keys)} nbt keys.')
+                else:
+                    nbt_keys = None
+                    print('Using all nbt keys.')
+                break
+
+            if answer == '---':
+                include_nbt = False
+                print('Not including any NBT keys.')
+                break
+
+            nbt_keys.append(answer)
+
+    processes = processes or os.cpu_count() or 1
+    total_start_time = time.time()
+    total_counts = dict.fromkeys(sorted(block_entity_ids), 0)
+    total_block_entities, total_not_readable_chunks = 0, 0
+    worlds = {}
+    for world_folder in world_folders:
+        region_folders = get_region_folders(world_folder)
+        if not region_folders:
+            print(f'\nNo region folder was found in world "{world_folder}"')
+            continue
+
+        start_time = time.time()
+        metrics.start_world(world_folder)
+        stats = ScanStats()
+        print(f'\nSearching for block entities in world "{world_folder}"...')
+        block_entities = list(scan(world_folder, block_entity_ids,
+                                   dimension=limit_dimension if limit_to_dimension else None,
+                                   nbt_keys=(nbt_keys or []) if include_nbt else None, stats=stats, progress=True,
+                                   processes=processes, query=query))
+        messages, not_readable_chunks = stats.messages, stats.not_readable_chunks
+
+        counts = dict.fromkeys(sorted(block_entity_ids), 0)
+        for block_entity in block_entities:
+            counts[normalize_block_entity_id(block_entity['id'])] += 1
+
+        elapsed_time = int(round((time.time() - start_time) * 1000))
+        human_readable_elapsed_time = format_time(elapsed_time)
+
+        block_entity_count = len(block_entities)
+        print(f'Found {block_entity_count} block entities in world "{world_folder}". (Elapsed time: '
+              f'{human_readable_elapsed_time})')
+
+        for message in messages:
+            print(message)
+
+        if not_readable_chunks:
+            print(f'{not_readable_chunks} chunks could not be read.')
+
+        total_block_entities += block_entity_count
+        total_not_readable_chunks += not_readable_chunks
+        for block_entity_id, count in counts.items():
+            total_counts[block_entity_id] += count
+
+        if output_file:
+            worlds[str(world_folder.resolve())] = {
+                'block_entities': block_entities,
+                'counts': counts,
+                'not_readable_chunks': not_readable_chunks,
+                'elapsed_time': {
+                    'raw': elapsed_time,
+                    'human_readable': human_readable_elapsed_time
+                }
+            }
+
+    elapsed_time = int(round((time.time() - total_start_time) * 1000))
+    human_readable_elapsed_time = format_time(elapsed_time)
+
+    if len(world_folders) > 1:
+        print(f'\nTotal found block entities: {total_block_entities}'
+              f'\nTotal elapsed time: {human_readable_elapsed_time}')
+
+    if output_file:
+        data = {
+            'worlds': worlds,
+            'total': {
+                'block_entities': total_block_entities,
+                'counts': total_counts,
+                'not_readable_chunks': total_not_readable_chunks,
+                'elapsed_time': {
+                    'raw': elapsed_time,
+                    'human_readable': human_readable_elapsed_time
+                }
+            }
+        }
+
+        with Path(output_file).open('w') as file:
+            if output_format == 'plain':
+                file.write(f'--- MCWorldTools by Rapha149 ---'
+                           f'\n\u00B7\u00B7\u00B7 Find block entities \u00B7\u00B7\u00B7'
+                           f'\n\nTotal found block entities: {total_block_entities}')
+                for block_entity_id, count in total_counts.items():
+                    file.write(f'\n    {block_entity_id}: {count}')
+                file.write(f'\nTotal elapsed time: {human_readable_elapsed_time}')
+                if total_not_readable_chunks:
+                    file.write(f'\nTotal not readable chunks: {total_not_readable_chunks}')
+
+                file.write(f'\n\n[ Worlds ]')
+                for world, info in worlds.items():
+                    block_entities = info['block_entities']
+                    block_entity_count = len(block_entities)
+                    file.write(f'\n{world}'
+                               f'\n    Block entities found: {block_entity_count}')
+                    for block_entity_id, count in info['counts'].items():
+                        file.write(f'\n        {block_entity_id}: {count}')
+                    file.write(f'\n    Elapsed time: {info["elapsed_time"]["human_readable"]}')
+                    if info['not_readable_chunks']:
+                        file.write(f'\n    Not readable chunks: {info["not_readable_chunks"]}')
+
+                    if block_entities:
+                        file.write('\n    Block entities:')
+                        for i in range(block_entity_count):
+                            if i > 0:
+                                file.write('\n        ------------------')
+
+                            block_entity = block_entities[i]
+                            loc, chunk = block_entity['loc'], block_entity['chunk']
+                            file.write(f'\n        ID: {block_entity["id"]}'
+                                       f'\n        Dimension: {loc["dimension"].capitalize()}'
+                                       f'\n        Location: {loc["x"]} {loc["y"]} {loc["z"]}'
+                                       f'\n        Chunk:'
+                                       f'\n            In region file: {chunk["in_region_file"]["x"]} '
+                                       f'{chunk["in_region_file"]["z"]}'
+                                       f'\n            In world: {chunk["in_world"]["x"]} {chunk["in_world"]["z"]}')
+                            if include_nbt:
+                                file.write(f'\n        NBT: {block_entity["nbt"]}')
+                    file.write('\n')
+
+            else:
+                dump_data(data, file, output_format)
+
+            print(f'\nSaved output to "{output_file}"')
+
+
+class IdIndex(dict):
+    """Maps raw block entity ids found in a world to their normalized id if it is searched for or to None otherwise,
+    so every distinct raw id is only normalized once."""
+
+    def __init__(self, block_entity_ids):
+        super().__init__()
+        self.block_entity_ids = block_entity_ids
+
+    def __missing__(self, raw_id):
+        block_entity_id = normalize_block_entity_id(raw_id)
+        self[raw_id] = block_entity_id = block_entity_id if block_entity_id in self.block_entity_ids else None
+        return block_entity_id
+
+
+class BlockEntityRecord(Record):
+    __slots__ = ('id', 'nbt')
+    keys = ('id', 'loc', 'chunk', 'nbt')
+
+
+def find_in_chunk(block_entities, dimension, x, z, world_x, world_z, id_index, nbt_keys=None, query=None):
+    """Yield the searched block entities of the block entity list of one chunk as BlockEntityRecords.
+
+    ``id_index`` is the IdIndex of the searched ids, ``nbt_keys`` works like in ``scan`` and ``query`` is the compiled
+    query."""
+    for block_entity in block_entities:
+        raw_id = block_entity['id'].value
+        if not id_index[raw_id]:
+            continue
+        if query and not query(block_entity):
+            continue
+        record = BlockEntityRecord()
+        record.id = sys.intern(raw_id)
+        record.set_location(dimension, block_entity['x'].value, block_entity['y'].value, block_entity['z'].value,
+                            x, z, world_x, world_z)
+        record.nbt = '{}' if nbt_keys is None else json.dumps(convert_nbt(block_entity, keys=nbt_keys))
+        yield record
+
+
+def scan(world_folder, block_entity_ids, dimension=None, nbt_keys=None, stats=None, progress=False, processes=1,
+         query=None):
+    """Yield the block entities with one of the given ids of a world as BlockEntityRecords.
+
+    The ids may be stated with or without "minecraft:" and old ids (e.g. "Control") are matched as well. The block
+    entities can be limited to a dimension and a query (see ``mcworldtools.query``), which is evaluated before the
+    block entities are converted. ``nbt_keys`` is a list of NBT keys that are included as json in "nbt", an
+    empty list includes all keys and None includes no NBT at all. Not readable chunks are counted in ``stats`` and a
+    progress bar is shown if ``progress`` is enabled. Without a dimension, the dimensions are scanned in up to
+    ``processes`` parallel processes. Raises an InputError if an argument is invalid.
+    """
+    if isinstance(block_entity_ids, str) or not block_entity_ids:
+        raise InputError('"ids" has to be a list containing at least one block entity id.')
+    id_index = IdIndex(set(normalize_block_entity_id(block_entity_id) for block_entity_id in block_entity_ids))
+    dimension = check_dimension(dimension)
+    if nbt_keys is not None and not isinstance(nbt_keys, (list, tuple, set)):
+        raise InputError(f'"nbt_keys" has to be a list but is {type(nbt_keys).__name__}')
+    compiled_query = compile_query(query, normalize_block_entity_id) if query is not None else None
+    stats = stats if stats is not None else ScanStats()
+
+    files = map_files(get_region_folders(world_folder))
+    if dimension is None and processes > 1 and len(files) > 1:
+        yield from scan_dimensions(scan, world_folder, files, processes, stats, progress,
+                                   block_entity_ids=block_entity_ids, nbt_keys=nbt_keys, query=query)
+        return
+
+    limit_dimensions = [dimension] if dimension else None
+    for dimension_, region_file, region, x, z, chunk in iter_chunks(files, stats, progress, limit_dimensions):
+        data = chunk['Level'] if 'Level' in chunk else chunk
+
+        if 'block_entities' in data:
+            block_entities = data['block_entities']
+        elif 'TileEntities' in data:
+            block_entities = data['TileEntities']
+        else:
+            stats.messages.append(f'Chunk {x} {z} (in world at {chunk.loc.x} {chunk.loc.z}) in the region file "'
+                                  f'{region_file}" could not be read.')
+            continue
+
+        yield from find_in_chunk(block_entities, dimension_, x, z, chunk.loc.x, chunk.loc.z, id_index, nbt_keys,
+                                 compiled_query)
@@ -1,28 +1,33 @@
-import json
+import os
 import re
 
-import yaml
 from nbt.region import *
-from tqdm import tqdm
 
+from .. import metrics
 from ..util import *
 
 actions = ['Find command blocks', 'Remove command blocks']
-types = ['minecraft:command_block', 'Control']
-
-
-def start(world_folders, output_file, output_format, input_data, confirm):
+types = {'minecraft:command_block', 'Control'}
+search_types = ['literal', 'regex']
+search_fields = {
+    'command': 'Command',
+    'custom_name': 'CustomName',
+    'last_output': 'LastOutput'
+}
+
+
+def start(world_folders, output_file, output_format, input_data, confirm, since=None):
+    if since is not None:
+        since = parse_since(since)
     action_count = len(actions)
     action = None
     if input_data and 'action' in input_data:
         print('\nLoading input file data...')
         action = input_data['action']
         if not isinstance(action, int):
-            eprint(f'"action" has to be a number but is {type(action).__name__}')
-            exit(3)
+            raise InputError(f'"action" has to be a number but is {type(action).__name__}')
         if action < 1 or action > action_count:
-            eprint(f'"action" has to be one of {", ".join(str(i) for i in range(1, len(actions) + 1))}')
-            exit(3)
+            raise InputError(f'"action" has to be one of {", ".join(str(i) for i in range(1, len(actions) + 1))}')
         print(f'Using action "{actions[action - 1]}"')
 
     if not action:
@@ -43,25 +48,60 @@ def start(world_folders, output_file, output_format, input_data, confirm):
             break
         print(f'Using action "{actions[action - 1]}"')
 
+    if since is not None and action != 1:
+        raise InputError('"--since" is only supported when finding command blocks.')
+
     if action == 1:
-        find(world_folders, output_file, output_format, input_data)
+        find(world_folders, output_file, output_format, input_data, since)
     elif action == 2:
         remove(world_folders, output_file, output_format, input_data, confirm)
 
 
-def find(world_folders, output_file, output_format, input_data):
+def find(world_folders, output_file, output_format, input_data, since=None):
     if not output_file:
         print(f'\nFor this action you have to state an output file as command argument (-o).')
         exit(4)
 
     limit_to_dimension, limit_dimension, only_executing = None, None, None
+    search, search_type, search_in, processes = None, None, None, None
     if input_data:
         print('\nLoading more input file data...')
+        if 'search' in input_data:
+            search = input_data['search']
+            if search is None:
+                search = []
+                print(f'Not filtering by command texts.')
+            else:
+                if not isinstance(search, list):
+                    raise InputError(f'"search" has to be a list but is {type(search).__name__}')
+                for i in range(len(search)):
+                    if not isinstance(search[i], str) or not search[i]:
+                        raise InputError(f'{i + 1}. item in "search" has to be non-empty text')
+                print(f'Using {len(search)} search text{"s" if len(search) != 1 else ""}.')
+
+        if 'search_type' in input_data:
+            search_type = input_data['search_type']
+            if not isinstance(search_type, str):
+                raise InputError(f'"search_type" has to be text but is {type(search_type).__name__}')
+            search_type = search_type.lower()
+            if search_type not in search_types:
+                raise InputError(f'"search_type" has to be one of "{", ".join(search_types)}"')
+
+        if 'search_in' in input_data:
+            search_in = input_data['search_in']
+            if not isinstance(search_in, list):
+                raise InputError(f'"search_in" has to be a list but is {type(search_in).__name__}')
+            if not search_in:
+                raise InputError(f'"search_in" has to contain at least one of "{", ".join(search_fields)}"')
+            for field in search_in:
+                if field not in search_fields:
+                    raise InputError(f'Unknown field "{field}" in "search_in". It has to be one of '
+                                     f'"{", ".join(search_fields)}"')
+
         if 'only_executing' in input_data:
             only_executing = input_data['only_executing']
             if not isinstance(only_executing, bool):
-                eprint(f'"only_executing" has to be bool (true/false) but is {type(only_executing).__name__}')
-                exit(3)
+                raise InputError(f'"only_executing" has to be bool (true/false) but is {type(only_executing).__name__}')
             print(f'The script will {"" if only_executing else "not"} only look for executing command blocks.')
 
         if 'dimension' in input_data:
@@ -71,25 +111,56 @@ def find(world_folders, output_file, output_format, input_data):
                 print(f'Not limiting to one dimension.')
             else:
                 if not isinstance(limit_dimension, str):
-                    eprint(f'"dimension" has to be text but is {type(limit_dimension).__name__}')
-                    exit(3)
+                    raise InputError(f'"dimension" has to be text but is {type(limit_dimension).__name__}')
                 limit_to_dimension = True
                 limit_dimension = limit_dimension.lower()
-                if limit_dimension not in dimensions:
-                    eprint(f'Unknown dimension "{limit_dimension}"')
-                    exit(3)
+                if not is_dimension(limit_dimension):
+                    raise InputError(f'Unknown dimension "{limit_dimension}"')
                 print(f'Limiting to dimension "{limit_dimension}"')
 
+        if 'processes' in input_data:
+            processes = input_data['processes']
+            if processes is not None and (not isinstance(processes, int) or processes <= 0):
+                raise InputError(f'"processes" has to be a positive number.')
+
     if only_executing is None:
         print('\nDo you want to only search for executing command blocks? (i.e. either powered or auto)'
               '\nOnly supported in 1.9+')
         only_executing = parse_yes_no(input('Only search for executing command blocks? (y/N): '), default=False)
 
+    # input files without "search" don't filter by texts, so that older input files still run unattended
+    if search is None and input_data:
+        search = []
+    elif search is None:
+        print('\nChoose texts to search for in the commands. Only command blocks containing at least one of them will '
+              'be found. Enter nothing once your finished.'
+              '\nFor all command blocks, enter nothing directly.')
+        search = []
+        while True:
+            answer = input(f'{len(search) + 1}. Search text: ')
+            if not answer:
+                break
+            search.append(answer)
+
+    if search and search_type is None:
+        search_type = 'regex' if not input_data and \
+            parse_yes_no(input('Are the search texts regular expressions? (y/N): '), default=False) else 'literal'
+    if search and search_in is None:
+        search_in = ['command', 'custom_name', 'last_output'] if not input_data and \
+            parse_yes_no(input('Search in custom names and last outputs as well? (y/N): '), default=False) \
+            else ['command']
+
+    if search:
+        compile_search(search, search_type, search_in)
+        print(f'Searching for {"regular expressions" if search_type == "regex" else "texts"} in '
+              f'"{", ".join(search_fields[field] for field in search_in)}"')
+
     if limit_to_dimension is None:
-        dimensions_str = '"' + '", "'.join(dimensions) + '"'
+        world_dimensions = get_dimensions(world_folders)
+        dimensions_str = '"' + '", "'.join(world_dimensions) + '"'
         print('\nChoose a dimension where entities should be searched. Enter nothing for all dimensions.'
               f'\nIt can be one of {dimensions_str}')
-        complete(dimensions, case_insensitive=True)
+        complete(world_dimensions, case_insensitive=True)
         while True:
             answer = input('Dimension: ')
             if not answer:
@@ -97,7 +168,7 @@ def find(world_folders, output_file, output_format, input_data):
                 break
             else:
                 answer = answer.strip().lower()
-                if answer not in dimensions:
+                if not is_dimension(answer):
                     print('Unknown dimension.')
                     continue
                 limit_to_dimension = True
@@ -105,6 +176,7 @@ def find(world_folders, output_file, output_format, input_data):
                 break
         complete([])
 
+    processes = processes or os.cpu_count() or 1
     total_start_time = time.time()
     total_command_blocks, total_not_readable_chunks = 0, 0
     worlds = {}
@@ -114,92 +186,29 @@ def find(world_folders, output_file, output_format, input_data):
             print(f'\nNo region folder was found in world "{world_folder}"')
             continue
 
-        files = map_files(region_folders)
-        file_count = len(get_all_files(files))
-
-        command_blocks = []
         start_time = time.time()
-        messages = []
-        not_readable_chunks = 0
+        metrics.start_world(world_folder)
+        stats = ScanStats()
+        state = None
+        if since is not None:
+            state = ScanState(world_folder, 'command_blocks', {
+                'dimension': limit_dimension if limit_to_dimension else None,
+                'only_executing': only_executing,
+                'search': search,
+                'search_type': search_type,
+                'search_in': search_in
+            }, since)
+            print_scan_state(state)
         print(f'\nSearching for command blocks in world "{world_folder}"...')
-        with tqdm(total=file_count * 32 * 32 if file_count > 0 else 1,
-                  unit_scale=1 / 32 / 32,
-                  bar_format='{percentage:.2f}% |{bar}| [{n:.0f}/{total:.0f} files]  ') as pbar:
-
-            if file_count <= 0:
-                pbar.update()
-
-            for dimension in dimensions:
-                if dimension not in files:
-                    continue
-
-                region_files = files[dimension]
-                if limit_to_dimension and dimension != limit_dimension:
-                    pbar.update(32 * 32 * len(region_files))
-                    continue
-
-                for region_file in region_files:
-                    with region_file.open('rb') as file:
-                        region = RegionFile(fileobj=file)
-                        match = re.match('r\\.(-?\\d+)\\.(-?\\d+)\\.mca', region_file.name)
-                        if match:
-                            region.loc = Location(x=int(match.group(1)), z=int(match.group(2)))
-
-                        pbar.update(32 * 32 - region.chunk_count())
-                        for coords in region.get_chunk_coords():
-                            x, z = coords['x'], coords['z']
-                            try:
-                                chunk = region.get_chunk(x, z)
-                            except ChunkDataError:
-                                not_readable_chunks += 1
-                                pbar.update()
-                                continue
-
-                            world_x, world_z = chunk.loc.x, chunk.loc.z
-                            data = chunk['Level'] if 'Level' in chunk else chunk
-
-                            if 'block_entities' in data:
-                                block_entities = data['block_entities']
-                            elif 'TileEntities' in data:
-                                block_entities = data['TileEntities']
-                            else:
-                                messages.append(f'Chunk {x} {z} (in world at {world_x} {world_z}) in the region file "'
-                                                f'{region_file}" could not be read.')
-                                continue
-
-                            for command_block in block_entities:
-                                if command_block['id'].value not in types:
-                                    continue
-                                powered = (True if command_block['powered'].value == 1 else False) \
-                                    if 'powered' in command_block else None
-                                auto = (True if command_block['auto'].value == 1 else False) \
-                                    if 'auto' in command_block else None
-                                if only_executing and not powered and not auto:
-                                    continue
-                                command_blocks.append({
-                                    'custom_name': command_block['CustomName'].value,
-                                    'loc': {
-                                        'dimension': dimension,
-                                        'x': command_block['x'].value,
-                                        'y': command_block['y'].value,
-                                        'z': command_block['z'].value
-                                    },
-                                    'chunk': {
-                                        'in_region_file': {
-                                            'x': coords['x'],
-                                            'z': coords['z']
-                                        },
-                                        'in_world': {
-                                            'x': world_x,
-                                            'z': world_z
-                                        }
-                                    },
-                                    'powered': powered,
-                                    'auto': auto,
-                                    'command': command_block['Command'].value
-                                })
-
-                            pbar.update()
+        command_blocks = list(scan(world_folder, dimension=limit_dimension if limit_to_dimension else None,
+                                   only_executing=only_executing, search=search, search_type=search_type,
+                                   search_in=search_in, stats=stats, progress=True, state=state,
+                                   processes=processes))
+        messages, not_readable_chunks = stats.messages, stats.not_readable_chunks
+        if state is not None:
+            print(f'{stats.unchanged_chunks} unchanged chunks were not read again.')
+            if state.complete:
+                state.save()
 
         elapsed_time = int(round((time.time() - start_time) * 1000))
         human_readable_elapsed_time = format_time(elapsed_time)
@@ -290,51 +299,142 @@ def find(world_folders, output_file, output_format, input_data):
                                        f'{("Yes" if auto else "No") if auto is not None else "Unknown"}')
                     file.write('\n')
 
-            elif output_format == 'json':
-                json.dump(data, file, indent=3)
-            elif output_format == 'yaml':
-                yaml.dump(data, file, indent=3)
+            else:
+                dump_data(data, file, output_format)
 
             print(f'\nSaved output to "{output_file}"')
 
 
+def compile_search(search, search_type='literal', search_in=('command',)):
+    """Return a function matching texts against the search texts and the NBT names of the fields to search in.
+    Raises an InputError if a search text is not a valid regular expression."""
+    if search_type not in search_types:
+        raise InputError(f'"search_type" has to be one of "{", ".join(search_types)}"')
+    for field in search_in:
+        if field not in search_fields:
+            raise InputError(f'Unknown field "{field}" in "search_in". It has to be one of '
+                             f'"{", ".join(search_fields)}"')
+    if search_type == 'regex':
+        for pattern in search:
+            try:
+                re.compile(pattern)
+            except re.error as e:
+                raise InputError(f'"{pattern}" is not a valid regular expression: {e}')
+    return compile_text_filter(search, literal=search_type == 'literal'), [search_fields[field] for field in search_in]
+
+
+class CommandBlockRecord(Record):
+    __slots__ = ('custom_name', 'powered', 'auto', 'command')
+    keys = ('custom_name', 'loc', 'chunk', 'powered', 'auto', 'command')
+
+
+def find_in_chunk(block_entities, dimension, x, z, world_x, world_z, only_executing=False, text_filter=None,
+                  search_in=()):
+    """Yield the command blocks of the block entity list of one chunk as CommandBlockRecords.
+    ``text_filter`` and ``search_in`` are the values returned by ``compile_search``."""
+    for command_block in block_entities:
+        if command_block['id'].value not in types:
+            continue
+        powered = (True if command_block['powered'].value == 1 else False) \
+            if 'powered' in command_block else None
+        auto = (True if command_block['auto'].value == 1 else False) \
+            if 'auto' in command_block else None
+        if only_executing and not powered and not auto:
+            continue
+        if text_filter and not any(field in command_block and text_filter(command_block[field].value)
+                                   for field in search_in):
+            continue
+        record = CommandBlockRecord()
+        record.custom_name = sys.intern(command_block['CustomName'].value)
+        record.set_location(dimension, command_block['x'].value, command_block['y'].value, command_block['z'].value,
+                            x, z, world_x, world_z)
+        record.powered, record.auto = powered, auto
+        record.command = command_block['Command'].value
+        yield record
+
+
+def scan(world_folder, dimension=None, only_executing=False, search=None, search_type='literal',
+         search_in=('command',), stats=None, progress=False, state=None, processes=1):
+    """Yield the command blocks of a world as CommandBlockRecords.
+
+    The command blocks can be limited to a dimension and to command blocks that are powered or in automatic mode.
+    If ``search`` is a list of texts (or regular expressions if ``search_type`` is "regex"), only command blocks
+    containing at least one of them in the fields ``search_in`` are yielded. Not readable chunks are counted in
+    ``stats`` and a progress bar is shown if ``progress`` is enabled. If a ScanState is given, only the chunks saved
+    since its time are read and the found command blocks are stored in it. Otherwise, without a dimension, the
+    dimensions are scanned in up to ``processes`` parallel processes. Raises an InputError if an argument is invalid.
+    """
+    dimension = check_dimension(dimension)
+    text_filter, nbt_fields = compile_search(search, search_type, search_in) if search else (None, ())
+    stats = stats if stats is not None else ScanStats()
+
+    files = map_files(get_region_folders(world_folder))
+    if dimension is None and state is None and processes > 1 and len(files) > 1:
+        yield from scan_dimensions(scan, world_folder, files, processes, stats, progress,
+                                   only_executing=only_executing, search=search, search_type=search_type,
+                                   search_in=search_in)
+        return
+
+    limit_dimensions = [dimension] if dimension else None
+    since = state.since if state is not None else None
+    for dimension_, region_file, region, x, z, chunk in iter_chunks(files, stats, progress, limit_dimensions,
+                                                                    since=since):
+        if chunk is None:
+            found = (CommandBlockRecord.from_dict(command_block)
+                     for command_block in state.previous.get(chunk_key(dimension_, region_file, x, z), ()))
+        else:
+            data = chunk['Level'] if 'Level' in chunk else chunk
+
+            if 'block_entities' in data:
+                block_entities = data['block_entities']
+            elif 'TileEntities' in data:
+                block_entities = data['TileEntities']
+            else:
+                stats.messages.append(f'Chunk {x} {z} (in world at {chunk.loc.x} {chunk.loc.z}) in the region file "'
+                                      f'{region_file}" could not be read.')
+                continue
+
+            found = find_in_chunk(block_entities, dimension_, x, z, chunk.loc.x, chunk.loc.z, only_executing,
+                                  text_filter, nbt_fields)
+
+        if state is not None:
+            found = list(found)
+            if found:
+                state.chunks[chunk_key(dimension_, region_file, x, z)] = found
+        yield from found
+
+
 def remove(world_folders, output_file, output_format, input_data, confirm):
     locations = None
     if input_data and 'locations' in input_data:
         print('\nLoading more input data...')
         loc_list = input_data['locations']
         if not isinstance(loc_list, list):
-            eprint(f'"locations" has to be a list but is {type(loc_list).__name__}')
-            exit(3)
+            raise InputError(f'"locations" has to be a list but is {type(loc_list).__name__}')
 
         locations = []
         for i in range(len(loc_list)):
             loc = loc_list[i]
             if not isinstance(loc, dict):
-                eprint(f'{i + 1}. item in "locations" has to contain keys but is {type(loc).__name__}')
-                exit(3)
+                raise InputError(f'{i + 1}. item in "locations" has to contain keys but is {type(loc).__name__}')
 
             for key in ('x', 'y', 'z'):
                 if key not in loc:
-                    eprint(f'"{key}" is not in {i + 1}. item of "locations"')
-                    exit(3)
+                    raise InputError(f'"{key}" is not in {i + 1}. item of "locations"')
                 value = loc[key]
                 if not isinstance(value, int):
-                    eprint(
+                    raise InputError(
                         f'"{key}" in {i + 1}. item of "locations" has to be a number but is '
                         f'{type(value).__name__}')
-                    exit(3)
             if 'dimension' not in loc:
-                eprint(f'"dimension" is not in {i + 1}. item of "locations"')
-                exit(3)
+                raise InputError(f'"dimension" is not in {i + 1}. item of "locations"')
             dimension = loc['dimension']
             if not isinstance(dimension, str):
-                eprint(f'"dimension" in {i + 1}. item of "locations" has to be text but is {type(dimension).__name__}')
-                exit(3)
+                raise InputError(f'"dimension" in {i + 1}. item of "locations" has to be text but is '
+                                 f'{type(dimension).__name__}')
             dimension = dimension.lower()
-            if dimension not in dimensions:
-                eprint(f'Unknown dimension "{dimension}" in {i + 1}. item of "locations"')
-                exit(3)
+            if not is_dimension(dimension):
+                raise InputError(f'Unknown dimension "{dimension}" in {i + 1}. item of "locations"')
 
             locations.append({
                 'dimension': dimension,
@@ -347,7 +447,7 @@ def remove(world_folders, output_file, output_format, input_data, confirm):
         print(f'Using {location_count} location{"s" if location_count != 1 else ""} to look for.')
 
     if not locations:
-        dimensions_str = '"' + '", "'.join(dimensions) + '"'
+        dimensions_str = '"' + '", "'.join(get_dimensions(world_folders)) + '"'
         print('\nChoose locations where command blocks should be removed. Enter nothing once your finished.'
               '\nUse the following format for locations: "DIMENSION: X Y Z" (e.g. "overworld: 12 71 8";'
               f' dimension can be one of {dimensions_str})')
@@ -362,13 +462,13 @@ def remove(world_folders, output_file, output_format, input_data, confirm):
                     print('State at least 1 location.')
                     continue
 
-            match = re.match('(\\w+): (-?\\d+) (-?\\d+) (-?\\d+)', answer)
+            match = re.match('([\\w.:/-]+): (-?\\d+) (-?\\d+) (-?\\d+)', answer)
             if not match:
                 print('Invalid location.')
                 continue
 
             dimension = match.group(1).lower()
-            if dimension not in dimensions:
+            if not is_dimension(dimension):
                 print('Unknown dimension.')
                 continue
 
@@ -403,79 +503,46 @@ def remove(world_folders, output_file, output_format, input_data, confirm):
             continue
 
         files = map_files(region_folders)
-        file_count = len(get_all_files(files))
 
         start_time = time.time()
+        metrics.start_world(world_folder)
         command_blocks = []
-        messages = []
-        not_readable_chunks = 0
+        stats = ScanStats()
         print(f'\nRemoving command blocks in world "{world_folder}"...')
-        with tqdm(total=file_count * 32 * 32 if file_count > 0 else 1,
-                  unit_scale=1 / 32 / 32,
-                  bar_format='{percentage:.2f}% |{bar}| [{n:.0f}/{total:.0f} files]  ') as pbar:
-
-            if file_count <= 0:
-                pbar.update()
+        for dimension, region_file, region, x, z, chunk in iter_chunks(files, stats, True, used_dimensions,
+                                                                       writable=True):
+            data = chunk['Level'] if 'Level' in chunk else chunk
+
+            if 'block_entities' in data:
+                block_entities = data['block_entities']
+            elif 'TileEntities' in data:
+                block_entities = data['TileEntities']
+            else:
+                stats.messages.append(f'Chunk {x} {z} (in world at {chunk.loc.x} {chunk.loc.z}) in the region file '
+                                      f'"{region_file}" could not be read.')
+                continue
 
-            for dimension, region_files in files.items():
-                if dimension not in used_dimensions:
-                    pbar.update(32 * 32 * len(region_files))
+            to_remove = []
+            for i in range(len(block_entities)):
+                command_block = block_entities[i]
+                if command_block['id'].value not in types:
                     continue
+                loc = {
+                    'dimension': dimension,
+                    'x': command_block['x'].value,
+                    'y': command_block['y'].value,
+                    'z': command_block['z'].value
+                }
 
-                for region_file in region_files:
-                    with region_file.open('r+b') as file:
-                        region = RegionFile(fileobj=file)
-                        match = re.match('r\\.(-?\\d+)\\.(-?\\d+)\\.mca', region_file.name)
-                        if match:
-                            region.loc = Location(x=int(match.group(1)), z=int(match.group(2)))
-
-                        pbar.update(32 * 32 - region.chunk_count())
-                        for coords in region.get_chunk_coords():
-                            x, z = coords['x'], coords['z']
-                            try:
-                                chunk = region.get_chunk(x, z)
-                            except ChunkDataError:
-                                not_readable_chunks += 1
-                                pbar.update()
-                                continue
-
-                            world_x, world_z = chunk.loc.x, chunk.loc.z
-                            data = chunk['Level'] if 'Level' in chunk else chunk
-
-                            if 'block_entities' in data:
-                                block_entities = data['block_entities']
-                            elif 'TileEntities' in data:
-                                block_entities = data['TileEntities']
-                            else:
-                                messages.append(f'Chunk {x} {z} (in world at {world_x} {world_z}) in the region file "'
-                                                f'{region_file}" could not be read.')
-                                continue
-
-                            to_remove = []
-                            for i in range(len(block_entities)):
-                                command_block = block_entities[i]
-                                if command_block['id'].value not in types:
-                                    continue
-                                block_x = command_block['x'].value
-                                block_y = command_block['y'].value
-                                block_z = command_block['z'].value
-                                loc = {
-                                    'dimension': dimension,
-                                    'x': block_x,
-                                    'y': block_y,
-                                    'z': block_z
-                                }
-
-                                if loc in locations:
-                                    command_blocks.append(loc)
-                                    to_remove.append(i)
-
-                            if to_remove:
-                                for i in reversed(to_remove):
-                                    del block_entities[i]
-                                region.write_chunk(x, z, chunk)
-
-                            pbar.update()
+                if loc in locations:
+                    command_blocks.append(loc)
+                    to_remove.append(i)
+
+            if to_remove:
+                for i in reversed(to_remove):
+                    del block_entities[i]
+                region.write_chunk(x, z, chunk)
+        messages, not_readable_chunks = stats.messages, stats.not_readable_chunks
 
         elapsed_time = int(round((time.time() - start_time) * 1000))
         human_readable_elapsed_time = format_time(elapsed_time)
@@ -561,9 +628,7 @@ def remove(world_folders, output_file, output_format, input_data, confirm):
                         file.write(f'\n    Not readable chunks: {info["not_readable_chunks"]}')
                     file.write('\n')
 
-            elif output_format == 'json':
-                json.dump(data, file, indent=3)
-            elif output_format == 'yaml':
-                yaml.dump(data, file, indent=3)
+            else:
+                dump_data(data, file, output_format)
 
             print(f'\nSaved output to "{output_file}"')
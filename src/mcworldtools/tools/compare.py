@@ -0,0 +1,453 @@
+import os
+import signal
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from io import BytesIO
+
+from nbt.region import *
+
+from .. import metrics
+from ..util import *
+
+change_types = ['added', 'removed', 'modified']
+
+
+def start(world_folders, output_file, output_format, input_data, confirm):
+    if not output_file:
+        print(f'\nFor this tool you have to state an output file as command argument (-o).')
+        exit(4)
+
+    compare_folder, limit_to_dimension, limit_dimension, compare_nbt, processes = None, None, None, None, None
+    if input_data:
+        print('\nLoading input file data...')
+        if 'compare_world' in input_data:
+            compare_folder = input_data['compare_world']
+            if not isinstance(compare_folder, str):
+                raise InputError(f'"compare_world" has to be text but is {type(compare_folder).__name__}')
+            compare_folder = Path(compare_folder)
+            if not Path(compare_folder, 'level.dat').is_file():
+                raise InputError(f'"{compare_folder}" is not a world folder.')
+            print(f'Comparing with world "{compare_folder}"')
+
+        if 'dimension' in input_data:
+            limit_dimension = input_data['dimension']
+            if limit_dimension is None:
+                limit_to_dimension = False
+                print(f'Not limiting to one dimension.')
+            else:
+                if not isinstance(limit_dimension, str):
+                    raise InputError(f'"dimension" has to be text but is {type(limit_dimension).__name__}')
+                limit_to_dimension = True
+                limit_dimension = limit_dimension.lower()
+                if not is_dimension(limit_dimension):
+                    raise InputError(f'Unknown dimension "{limit_dimension}"')
+                print(f'Limiting to dimension "{limit_dimension}"')
+
+        if 'compare_nbt' in input_data:
+            compare_nbt = input_data['compare_nbt']
+            if not isinstance(compare_nbt, bool):
+                raise InputError(f'"compare_nbt" has to be a boolean but is {type(compare_nbt).__name__}.')
+            print('Comparing the entities and block entities of modified chunks.' if compare_nbt else
+                  'Not comparing the entities and block entities of modified chunks.')
+
+        if 'processes' in input_data:
+            processes = input_data['processes']
+            if processes is not None and (not isinstance(processes, int) or processes <= 0):
+                raise InputError(f'"processes" has to be a positive number.')
+
+    if compare_folder is None:
+        print('\nState the folder of the world to compare with, e.g. a backup of the world.')
+        while True:
+            answer = input('World to compare with: ').strip()
+            if not Path(answer, 'level.dat').is_file():
+                print('This is not a world folder.')
+                continue
+            compare_folder = Path(answer)
+            break
+
+    for world_folder in world_folders:
+        if Path(world_folder).resolve() == compare_folder.resolve():
+            raise InputError(f'"{world_folder}" can\'t be compared with itself.')
+
+    if limit_to_dimension is None:
+        world_dimensions = get_dimensions(world_folders + [compare_folder])
+        dimensions_str = '"' + '", "'.join(world_dimensions) + '"'
+        print('\nChoose a dimension which should be compared. Enter nothing for all dimensions.'
+              f'\nIt can be one of {dimensions_str}')
+        complete(world_dimensions, case_insensitive=True)
+        while True:
+            answer = input('Dimension: ')
+            if not answer:
+                limit_to_dimension = False
+                break
+            else:
+                answer = answer.strip().lower()
+                if not is_dimension(answer):
+                    print('Unknown dimension.')
+                    continue
+                limit_to_dimension = True
+                limit_dimension = answer
+                break
+        complete([])
+
+    if compare_nbt is None:
+        print('\nDo you want to compare the entities and block entities of modified chunks? Only modified chunks are '
+              'decompressed for this.')
+        while compare_nbt is None:
+            compare_nbt = parse_yes_no(input('Compare entities and block entities? (Y/n): '), default=True)
+
+    processes = processes or os.cpu_count() or 1
+
+    total_start_time = time.time()
+    total_counts = dict.fromkeys(change_types + ['unchanged', 'not_readable'], 0)
+    worlds = {}
+    for world_folder in world_folders:
+        tasks = get_region_pairs(world_folder, compare_folder, limit_dimension if limit_to_dimension else None)
+        if not tasks:
+            print(f'\nNo region files were found in world "{world_folder}" and "{compare_folder}"')
+            continue
+
+        start_time = time.time()
+        metrics.start_world(world_folder)
+        results = [None] * len(tasks)
+        print(f'\nComparing world "{world_folder}" with "{compare_folder}" with {processes} processes...')
+        with Progress([file for task in tasks for file in task[2:] if file is not None]) as pbar, \
+                ProcessPoolExecutor(max_workers=processes, initializer=_init_worker) as executor:
+            # the largest region files are compared first, so that no large one is left until the end
+            order = sorted(range(len(tasks)), reverse=True,
+                           key=lambda index: get_size(file for file in tasks[index][2:] if file is not None))
+            futures = {executor.submit(compare_regions, *tasks[index], compare_nbt): index for index in order}
+            for future in as_completed(futures):
+                result = results[futures[future]] = future.result()
+                pbar.update(sum(pbar.sizes[file] for file in tasks[futures[future]][2:] if file is not None))
+                metrics.count(chunks_decoded=result['decoded_chunks'], chunks_skipped=result['skipped_chunks'],
+                              not_readable_chunks=result['counts']['not_readable'])
+
+        counts = dict.fromkeys(total_counts, 0)
+        for result in results:
+            for key, count in result['counts'].items():
+                counts[key] += count
+        changes = [change for result in results for change in result['changes']]
+        not_readable_files = [file for result in results for file in result['not_readable_files']]
+        compared_chunks = sum(result['compared_chunks'] for result in results)
+        decoded_chunks = sum(result['decoded_chunks'] for result in results)
+
+        elapsed_time = int(round((time.time() - start_time) * 1000))
+        human_readable_elapsed_time = format_time(elapsed_time)
+
+        print(f'Compared world "{world_folder}" with "{compare_folder}": {counts["added"]} chunks were added, '
+              f'{counts["removed"]} removed and {counts["modified"]} modified. {counts["unchanged"]} chunks are '
+              f'unchanged. (Elapsed time: {human_readable_elapsed_time})')
+        print(f'Compared the data of {compared_chunks} chunks and decompressed {decoded_chunks} chunks.')
+        if counts['not_readable']:
+            print(f'{counts["not_readable"]} chunks could not be read.')
+        for file in not_readable_files:
+            print(f'The region file {file} could not be read.')
+
+        for key, count in counts.items():
+            total_counts[key] += count
+
+        worlds[str(world_folder.resolve())] = {
+            'compared_with': str(compare_folder.resolve()),
+            'chunks': counts,
+            'compared_chunks': compared_chunks,
+            'decoded_chunks': decoded_chunks,
+            'not_readable_files': not_readable_files,
+            'changes': changes,
+            'elapsed_time': {
+                'raw': elapsed_time,
+                'human_readable': human_readable_elapsed_time
+            }
+        }
+
+    elapsed_time = int(round((time.time() - total_start_time) * 1000))
+    human_readable_elapsed_time = format_time(elapsed_time)
+
+    if len(world_folders) > 1:
+        print(f'\nTotal added chunks: {total_counts["added"]}'
+              f'\nTotal removed chunks: {total_counts["removed"]}'
+              f'\nTotal modified chunks: {total_counts["modified"]}'
+              f'\nTotal elapsed time: {human_readable_elapsed_time}')
+
+    data = {
+        'worlds': worlds,
+        'total': {
+            'chunks': total_counts,
+            'elapsed_time': {
+                'raw': elapsed_time,
+                'human_readable': human_readable_elapsed_time
+            }
+        }
+    }
+
+    with Path(output_file).open('w') as file:
+        if output_format == 'plain':
+            file.write(f'--- MCWorldTools by Rapha149 ---'
+                       f'\n\u00B7\u00B7\u00B7 Compare worlds \u00B7\u00B7\u00B7'
+                       f'\n\nTotal added chunks: {total_counts["added"]}'
+                       f'\nTotal removed chunks: {total_counts["removed"]}'
+                       f'\nTotal modified chunks: {total_counts["modified"]}'
+                       f'\nTotal unchanged chunks: {total_counts["unchanged"]}')
+            if total_counts['not_readable']:
+                file.write(f'\nTotal not readable chunks: {total_counts["not_readable"]}')
+            file.write(f'\nTotal elapsed time: {human_readable_elapsed_time}')
+
+            file.write(f'\n\n[ Worlds ]')
+            for world, info in worlds.items():
+                chunks = info['chunks']
+                file.write(f'\n{world}'
+                           f'\n    Compared with: {info["compared_with"]}'
+                           f'\n    Added chunks: {chunks["added"]}'
+                           f'\n    Removed chunks: {chunks["removed"]}'
+                           f'\n    Modified chunks: {chunks["modified"]}'
+                           f'\n    Unchanged chunks: {chunks["unchanged"]}')
+                if chunks['not_readable']:
+                    file.write(f'\n    Not readable chunks: {chunks["not_readable"]}')
+                for not_readable_file in info['not_readable_files']:
+                    file.write(f'\n    Not readable region file: {not_readable_file}')
+                file.write(f'\n    Elapsed time: {info["elapsed_time"]["human_readable"]}')
+
+                if info['changes']:
+                    file.write('\n    Changes:')
+                    for change in info['changes']:
+                        file.write(f'\n        {change["dimension"]} {change["type"]} chunk {change["x"]} '
+                                   f'{change["z"]}: {change["change"]}')
+                        if change.get('keys'):
+                            file.write(f' - changed keys: {", ".join(change["keys"])}')
+                        for name, key in (('Entity', 'entities'), ('Block entity', 'block_entities')):
+                            for change_type, objects in change.get(key, {}).items():
+                                for obj in objects:
+                                    file.write(f'\n            {name} {change_type}: {_describe(obj)}')
+                file.write('\n')
+
+        else:
+            dump_data(data, file, output_format)
+
+        print(f'\nSaved output to "{output_file}"')
+
+
+def _map_files(world_folder):
+    return {
+        'region': map_files(get_region_folders(world_folder)),
+        'entities': map_files({folder: dimension for folder, dimension in get_entity_folders(world_folder).items()
+                               if folder.name == 'entities'})
+    }
+
+
+def get_region_pairs(world_folder, compare_folder, dimension=None):
+    """Returns the region files of a world and the region files at the same place in the world to compare with as
+    (dimension, type, region_file, compare_file) tasks. "type" is "region" or "entities" and one of the files is None
+    if only one world contains it. The dimensions are matched by name, so that the nether and the end of Bukkit based
+    servers are found next to both worlds."""
+    files, other_files = _map_files(world_folder), _map_files(compare_folder)
+    tasks = []
+    for file_type in ('region', 'entities'):
+        world_files, compare_files = files[file_type], other_files[file_type]
+        for file_dimension in list(world_files) + [name for name in compare_files if name not in world_files]:
+            if dimension is not None and file_dimension != dimension:
+                continue
+            region_files = {file.name: file for file in world_files.get(file_dimension, [])}
+            compare_region_files = {file.name: file for file in compare_files.get(file_dimension, [])}
+            for name in sorted(set(region_files).union(compare_region_files)):
+                tasks.append((file_dimension, file_type, region_files.get(name), compare_region_files.get(name)))
+    return tasks
+
+
+def _init_worker():
+    # the main process handles aborting
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def _open(region_file, stack):
+    if region_file is None:
+        return None
+    return open_region(stack.enter_context(region_file.open('rb')), region_file)
+
+
+def _exists(region, x, z):
+    return region is not None and region.metadata[x, z].status != STATUS_CHUNK_NOT_CREATED
+
+
+def compare_regions(dimension, file_type, region_file, compare_file, compare_nbt=True):
+    """Compare the chunks of a region file with the chunks of the same region file of another world. Either file may
+    be None if it does not exist.
+
+    Chunks whose timestamp and place in both region headers are the same are unchanged without reading them. The
+    compressed data of the other chunks is compared and only chunks whose data differs are decompressed to compare
+    their entities and block entities if ``compare_nbt`` is enabled. Runs in a worker process, so only picklable values
+    are returned."""
+    from contextlib import ExitStack
+    result = {
+        'dimension': dimension,
+        'type': file_type,
+        'counts': dict.fromkeys(change_types + ['unchanged', 'not_readable'], 0),
+        'skipped_chunks': 0,
+        'compared_chunks': 0,
+        'decoded_chunks': 0,
+        'changes': [],
+        'not_readable_files': []
+    }
+    counts = result['counts']
+
+    with ExitStack() as stack:
+        regions = []
+        for file in (region_file, compare_file):
+            try:
+                regions.append(_open(file, stack))
+            except RegionFileFormatError as e:
+                result['not_readable_files'].append(f'{file}: {e}')
+                regions.append(None)
+        region, other = regions
+        if result['not_readable_files']:
+            # the chunks of a region file that can't be read are unknown, so they are neither added nor removed
+            counts['not_readable'] += sum(len(readable.get_metadata()) for readable in regions if readable is not None)
+            return result
+
+        loc = region.loc if region is not None else other.loc if other is not None else None
+        for z in range(32):
+            for x in range(32):
+                exists, existed = _exists(region, x, z), _exists(other, x, z)
+                if not exists and not existed:
+                    continue
+
+                change = None
+                if not existed or not exists:
+                    if not (region if exists else other).is_readable(x, z):
+                        counts['not_readable'] += 1
+                        continue
+                    change = 'added' if exists else 'removed'
+                else:
+                    metadata, other_metadata = region.metadata[x, z], other.metadata[x, z]
+                    if metadata.timestamp == other_metadata.timestamp and \
+                            metadata.blockstart == other_metadata.blockstart and \
+                            metadata.blocklength == other_metadata.blocklength and \
+                            metadata.length == other_metadata.length:
+                        counts['unchanged'] += 1
+                        result['skipped_chunks'] += 1
+                        continue
+
+                    result['compared_chunks'] += 1
+                    try:
+                        data = region.get_compressed_blockdata(x, z)
+                        other_data = other.get_compressed_blockdata(x, z)
+                    except RegionFileFormatError:
+                        counts['not_readable'] += 1
+                        continue
+                    if data == other_data:
+                        counts['unchanged'] += 1
+                        continue
+                    change = 'modified'
+
+                counts[change] += 1
+                chunk_change = {
+                    'dimension': dimension,
+                    'type': file_type,
+                    'x': loc.x * 32 + x if loc.x is not None else x,
+                    'z': loc.z * 32 + z if loc.z is not None else z,
+                    'change': change
+                }
+                result['changes'].append(chunk_change)
+                if change != 'modified' or not compare_nbt:
+                    continue
+
+                try:
+                    chunk = region.get_nbt(x, z)
+                    other_chunk = other.get_nbt(x, z)
+                except RegionFileFormatError:
+                    counts['not_readable'] += 1
+                    continue
+                result['decoded_chunks'] += 2
+                chunk_change.update(compare_chunks(chunk, other_chunk))
+    return result
+
+
+def _tag_bytes(tag):
+    buffer = BytesIO()
+    tag._render_buffer(buffer)
+    return buffer.getvalue()
+
+
+def _changed_keys(compound, other_compound, ignore=()):
+    """Returns the names of the tags that differ between two compound tags."""
+    names = [tag.name for tag in compound.tags if tag.name not in ignore]
+    names += [tag.name for tag in other_compound.tags if tag.name not in ignore and tag.name not in compound]
+    return [name for name in names if name not in compound or name not in other_compound or
+            _tag_bytes(compound[name]) != _tag_bytes(other_compound[name])]
+
+
+def _get_lists(chunk):
+    data = chunk['Level'] if 'Level' in chunk else chunk
+    entities = data['Entities'] if 'Entities' in data else []
+    block_entities = data['block_entities'] if 'block_entities' in data else \
+        data['TileEntities'] if 'TileEntities' in data else []
+    return data, entities, block_entities
+
+
+def _entity_key(entity, index):
+    if 'UUID' in entity:
+        return convert_ints_to_uuid(convert_nbt(entity['UUID']))
+    if 'UUIDLeast' in entity and 'UUIDMost' in entity:
+        return convert_least_and_most_to_uuid(entity['UUIDLeast'].value, entity['UUIDMost'].value)
+    return index
+
+
+def _entity_info(entity, uuid):
+    return {
+        'id': entity['id'].value if 'id' in entity else None,
+        'uuid': uuid if isinstance(uuid, str) else None,
+        'pos': [tag.value for tag in entity['Pos']] if 'Pos' in entity else None
+    }
+
+
+def _block_entity_key(block_entity, index):
+    if 'x' in block_entity and 'y' in block_entity and 'z' in block_entity:
+        return block_entity['x'].value, block_entity['y'].value, block_entity['z'].value
+    return index
+
+
+def _block_entity_info(block_entity, key):
+    return {
+        'id': block_entity['id'].value if 'id' in block_entity else None,
+        'pos': list(key) if isinstance(key, tuple) else None
+    }
+
+
+def _compare_lists(tags, other_tags, get_key, get_info):
+    current = {get_key(tag, index): tag for index, tag in enumerate(tags)}
+    previous = {get_key(tag, index): tag for index, tag in enumerate(other_tags)}
+    changes = {
+        'added': [get_info(tag, key) for key, tag in current.items() if key not in previous],
+        'removed': [get_info(tag, key) for key, tag in previous.items() if key not in current],
+        'changed': []
+    }
+    for key, tag in current.items():
+        if key in previous:
+            keys = _changed_keys(tag, previous[key])
+            if keys:
+                changes['changed'].append(dict(get_info(tag, key), keys=keys))
+    return changes
+
+
+def compare_chunks(chunk, other_chunk):
+    """Compare two versions of a chunk. Returns the names of the changed tags of the chunk data, the added, removed and
+    changed entities (matched by uuid) and the added, removed and changed block entities (matched by position)."""
+    data, entities, block_entities = _get_lists(chunk)
+    other_data, other_entities, other_block_entities = _get_lists(other_chunk)
+    keys = _changed_keys(data, other_data, ignore=('Level',))
+    if data is not chunk:
+        keys = _changed_keys(chunk, other_chunk, ignore=('Level',)) + keys
+    return {
+        'keys': keys,
+        'entities': _compare_lists(entities, other_entities, _entity_key, _entity_info),
+        'block_entities': _compare_lists(block_entities, other_block_entities, _block_entity_key, _block_entity_info)
+    }
+
+
+def _describe(obj):
+    text = str(obj['id'])
+    if obj.get('uuid'):
+        text += f' ({obj["uuid"]})'
+    if obj['pos']:
+        text += ' at ' + ' '.join(str(round(value, 2)) for value in obj['pos'])
+    if obj.get('keys'):
+        text += f' - changed keys: {", ".join(obj["keys"])}'
+    return text
@@ -1,29 +1,36 @@
 import json
+import math
+import os
+import random
 import re
+import struct
+import tempfile
+from collections import Counter
 
-import yaml
 from nbt.region import *
-from tqdm import tqdm
 
+from .. import metrics
+from ..query import compile_query
+from ..sampling import *
 from ..util import *
 
 uuid_pattern = '^[0-9A-Fa-f]{8}-[0-9A-Fa-f]{4}-[0-9A-Fa-f]{4}-[0-9A-Fa-f]{4}-[0-9A-Fa-f]{12}$'
-actions = ['Find entities', 'Remove entities']
+actions = ['Find entities', 'Remove entities', 'Find duplicate uuids', 'Move entities']
 remove_by_possibilites = ['id', 'uuid', 'all']
 
 
-def start(world_folders, output_file, output_format, input_data, confirm):
+def start(world_folders, output_file, output_format, input_data, confirm, since=None):
+    if since is not None:
+        since = parse_since(since)
     action_count = len(actions)
     action = None
     if input_data and 'action' in input_data:
         print('\nLoading input file data...')
         action = input_data['action']
         if not isinstance(action, int):
-            eprint(f'"action" has to be a number but is {type(action).__name__}')
-            exit(3)
+            raise InputError(f'"action" has to be a number but is {type(action).__name__}')
         if action < 1 or action > action_count:
-            eprint(f'"action" has to be one of {", ".join(str(i) for i in range(1, len(actions) + 1))}')
-            exit(3)
+            raise InputError(f'"action" has to be one of {", ".join(str(i) for i in range(1, len(actions) + 1))}')
         print(f'Using action "{actions[action - 1]}"')
 
     if not action:
@@ -44,19 +51,27 @@ def start(world_folders, output_file, output_format, input_data, confirm):
             break
         print(f'Using action "{actions[action - 1]}"')
 
+    if since is not None and action != 1:
+        raise InputError('"--since" is only supported when finding entities.')
+
     if action == 1:
-        find(world_folders, output_file, output_format, input_data)
+        find(world_folders, output_file, output_format, input_data, since)
     elif action == 2:
         remove(world_folders, output_file, output_format, input_data, confirm)
+    elif action == 3:
+        find_duplicates(world_folders, output_file, output_format, input_data)
+    elif action == 4:
+        move(world_folders, output_file, output_format, input_data, confirm)
 
 
-def find(world_folders, output_file, output_format, input_data):
+def find(world_folders, output_file, output_format, input_data, since=None):
     if not output_file:
         print(f'\nFor this action you have to state an output file as command argument (-o).')
         exit(4)
 
     use_entity_id, entity_id, limit_to_dimension, limit_dimension, include_nbt, nbt_keys = None, None, None, None, \
                                                                                            None, None
+    processes, sample, query = None, None, None
     if input_data:
         print('\nLoading more input file data...')
         if 'id' in input_data:
@@ -66,8 +81,7 @@ def find(world_folders, output_file, output_format, input_data):
                 print(f'Not filtering by entity id.')
             else:
                 if not isinstance(entity_id, str):
-                    eprint(f'"id" has to be a number but is {type(entity_id).__name__}')
-                    exit(3)
+                    raise InputError(f'"id" has to be a number but is {type(entity_id).__name__}')
                 use_entity_id = True
                 entity_id = strip_id(entity_id.lower())
                 print(f'Using entity id "{entity_id}"')
@@ -79,13 +93,11 @@ def find(world_folders, output_file, output_format, input_data):
                 print(f'Not limiting to one dimension.')
             else:
                 if not isinstance(limit_dimension, str):
-                    eprint(f'"dimension" has to be text but is {type(limit_dimension).__name__}')
-                    exit(3)
+                    raise InputError(f'"dimension" has to be text but is {type(limit_dimension).__name__}')
                 limit_to_dimension = True
                 limit_dimension = limit_dimension.lower()
-                if limit_dimension not in dimensions:
-                    eprint(f'Unknown dimension "{limit_dimension}"')
-                    exit(3)
+                if not is_dimension(limit_dimension):
+                    raise InputError(f'Unknown dimension "{limit_dimension}"')
                 print(f'Limiting to dimension "{limit_dimension}"')
 
         if 'nbt_keys' in input_data:
@@ -95,11 +107,30 @@ def find(world_folders, output_file, output_format, input_data):
                 print(f'Not including NBT keys.')
             else:
                 if not isinstance(nbt_keys, list):
-                    eprint(f'"nbt_keys" has to be a list but is {type(nbt_keys).__name__}')
-                    exit(3)
+                    raise InputError(f'"nbt_keys" has to be a list but is {type(nbt_keys).__name__}')
                 include_nbt = True
                 print(f'Using {len(nbt_keys)} NBT keys.')
 
+        if 'query' in input_data:
+            query = input_data['query']
+            if query is not None:
+                compile_query(query)
+                print(f'Using query "{query}"')
+
+        if 'processes' in input_data:
+            processes = input_data['processes']
+            if processes is not None and (not isinstance(processes, int) or processes <= 0):
+                raise InputError(f'"processes" has to be a positive number.')
+
+        if 'sample' in input_data:
+            sample = input_data['sample']
+            if sample is not None and (not isinstance(sample, int) or sample <= 0):
+                raise InputError(f'"sample" has to be a positive number.')
+            if sample and since is not None:
+                raise InputError('"sample" can\'t be used together with "--since".')
+            if sample:
+                print(f'Estimating the entity counts from a sample of {sample} chunks per world.')
+
     if use_entity_id is None:
         print('\nChoose an entity id to filter entities. Enter nothing for all entities.')
         answer = input('Entity id: ')
@@ -111,10 +142,11 @@ def find(world_folders, output_file, output_format, input_data):
             print(f'Using entity id "{entity_id}"')
 
     if limit_to_dimension is None:
-        dimensions_str = '"' + '", "'.join(dimensions) + '"'
+        world_dimensions = get_dimensions(world_folders)
+        dimensions_str = '"' + '", "'.join(world_dimensions) + '"'
         print('\nChoose a dimension where entities should be searched. Enter nothing for all dimensions.'
               f'\nIt can be one of {dimensions_str}')
-        complete(dimensions, case_insensitive=True)
+        complete(world_dimensions, case_insensitive=True)
         while True:
             answer = input('Dimension: ')
             if not answer:
@@ -122,7 +154,7 @@ def find(world_folders, output_file, output_format, input_data):
                 break
             else:
                 answer = answer.strip().lower()
-                if answer not in dimensions:
+                if not is_dimension(answer):
                     print('Unknown dimension.')
                     continue
                 limit_to_dimension = True
@@ -130,6 +162,11 @@ def find(world_folders, output_file, output_format, input_data):
                 break
         complete([])
 
+    if sample:
+        estimate_entities(world_folders, output_file, output_format, entity_id if use_entity_id else None,
+                          limit_dimension if limit_to_dimension else None, sample, query)
+        return
+
     if include_nbt is None:
         print('\nChoose the NBT keys to be included in the output. Enter nothing once your finished.'
               '\nFor all NBT keys, enter nothing directly. Enter "---" to not include any NBT keys.'
@@ -153,91 +190,37 @@ def find(world_folders, output_file, output_format, input_data):
 
             nbt_keys.append(answer)
 
+    processes = processes or os.cpu_count() or 1
     total_start_time = time.time()
     total_entities, total_not_readable_chunks = 0, 0
     worlds = {}
     for world_folder in world_folders:
-        entity_folders = get_entity_folders(world_folder)
-        if not entity_folders:
+        if not get_entity_folders(world_folder):
             print(f'\nNo entity folder was found in world "{world_folder}"')
             continue
 
-        files = map_files(entity_folders)
-        file_count = len(get_all_files(files))
-
-        entities = []
         start_time = time.time()
-        messages = []
-        not_readable_chunks = 0
+        metrics.start_world(world_folder)
+        stats = ScanStats()
+        state = None
+        if since is not None:
+            state = ScanState(world_folder, 'entities', {
+                'id': entity_id if use_entity_id else None,
+                'dimension': limit_dimension if limit_to_dimension else None,
+                'nbt_keys': (nbt_keys or []) if include_nbt else None,
+                'query': query
+            }, since)
+            print_scan_state(state)
         print(f'\nSearching for entities in world "{world_folder}"...')
-        with tqdm(total=file_count * 32 * 32 if file_count > 0 else 1,
-                  unit_scale=1 / 32 / 32,
-                  bar_format='{percentage:.2f}% |{bar}| [{n:.0f}/{total:.0f} files]  ') as pbar:
-
-            if file_count <= 0:
-                pbar.update()
-
-            for dimension in dimensions:
-                if dimension not in files:
-                    continue
-
-                region_files = files[dimension]
-                if limit_to_dimension and dimension != limit_dimension:
-                    pbar.update(32 * 32 * len(region_files))
-                    continue
-
-                for region_file in region_files:
-                    with region_file.open('rb') as file:
-                        region = RegionFile(fileobj=file)
-                        match = re.match('r\\.(-?\\d+)\\.(-?\\d+)\\.mca', region_file.name)
-                        if match:
-                            region.loc = Location(x=int(match.group(1)), z=int(match.group(2)))
-
-                        pbar.update(32 * 32 - region.chunk_count())
-                        for coords in region.get_chunk_coords():
-                            x, z = coords['x'], coords['z']
-                            try:
-                                chunk = region.get_chunk(x, z)
-                            except ChunkDataError:
-                                not_readable_chunks += 1
-                                pbar.update()
-                                continue
-
-                            world_x, world_z = chunk.loc.x, chunk.loc.z
-                            data = chunk['Level'] if 'Level' in chunk else chunk
-
-                            if 'Entities' not in data:
-                                messages.append(f'Chunk {x} {z} (in world at {world_x} {world_z}) in the region file "'
-                                                f'{region_file}" could not be read.')
-                                continue
-
-                            for entity in data['Entities']:
-                                if use_entity_id and strip_id(entity['id'].value.lower()) != entity_id:
-                                    continue
-                                entities.append({
-                                    'id': entity['id'].value,
-                                    'uuid': convert_ints_to_uuid(convert_nbt(entity['UUID'])) if 'UUID' in entity else
-                                    convert_least_and_most_to_uuid(entity['UUIDLeast'].value, entity['UUIDMost'].value),
-                                    'loc': {
-                                        'dimension': dimension,
-                                        'x': entity['Pos'][0].value,
-                                        'y': entity['Pos'][1].value,
-                                        'z': entity['Pos'][2].value
-                                    },
-                                    'chunk': {
-                                        'in_region_file': {
-                                            'x': coords['x'],
-                                            'z': coords['z']
-                                        },
-                                        'in_world': {
-                                            'x': world_x,
-                                            'z': world_z
-                                        }
-                                    },
-                                    'nbt': '{}' if not include_nbt else json.dumps(convert_nbt(entity, keys=nbt_keys))
-                                })
-
-                            pbar.update()
+        entities = list(scan(world_folder, entity_id=entity_id if use_entity_id else None,
+                             dimension=limit_dimension if limit_to_dimension else None,
+                             nbt_keys=(nbt_keys or []) if include_nbt else None, stats=stats, progress=True,
+                             state=state, processes=processes, query=query))
+        messages, not_readable_chunks = stats.messages, stats.not_readable_chunks
+        if state is not None:
+            print(f'{stats.unchanged_chunks} unchanged chunks were not read again.')
+            if state.complete:
+                state.save()
 
         elapsed_time = int(round((time.time() - start_time) * 1000))
         human_readable_elapsed_time = format_time(elapsed_time)
@@ -324,14 +307,507 @@ def find(world_folders, output_file, output_format, input_data):
                                 file.write(f'\n        NBT: {entity["nbt"]}')
                     file.write('\n')
 
-            elif output_format == 'json':
-                json.dump(data, file, indent=3)
-            elif output_format == 'yaml':
-                yaml.dump(data, file, indent=3)
+            else:
+                dump_data(data, file, output_format)
+
+            print(f'\nSaved output to "{output_file}"')
+
+
+def estimate_entities(world_folders, output_file, output_format, entity_id, dimension, sample, query=None):
+    total_start_time = time.time()
+    total_estimator = Estimator()
+    total_chunks, total_sampled = 0, 0
+    worlds = {}
+    for world_folder in world_folders:
+        if not get_entity_folders(world_folder):
+            print(f'\nNo entity folder was found in world "{world_folder}"')
+            continue
+
+        start_time = time.time()
+        print(f'\nEstimating the entities of world "{world_folder}" from a sample of {sample} chunks...')
+        result, estimator = estimate(world_folder, entity_id, dimension, sample, query=query)
+        elapsed_time = int(round((time.time() - start_time) * 1000))
+        human_readable_elapsed_time = format_time(elapsed_time)
+        result['elapsed_time'] = {
+            'raw': elapsed_time,
+            'human_readable': human_readable_elapsed_time
+        }
+
+        print(f'Read {result["chunks"]["sampled"]} of {result["chunks"]["total"]} chunks of world "{world_folder}". '
+              f'(Elapsed time: {human_readable_elapsed_time})')
+        print(f'Estimated entities: {format_estimate(result["entities"])}'
+              f'\nEstimated time of a full search: {result["estimated_time"]["human_readable"]}')
+        for entity_type, type_estimate in result['entities_by_id'].items():
+            print(f'    {entity_type}: {format_estimate(type_estimate)}')
+        if result['chunks']['not_readable_sampled']:
+            print(f'{result["chunks"]["not_readable_sampled"]} sampled chunks could not be read.')
+
+        total_estimator.add(estimator)
+        total_chunks += result['chunks']['total']
+        total_sampled += result['chunks']['sampled']
+        worlds[str(world_folder.resolve())] = result
+
+    elapsed_time = int(round((time.time() - total_start_time) * 1000))
+    human_readable_elapsed_time = format_time(elapsed_time)
+    entities = total_estimator.get(None)
+
+    if len(world_folders) > 1:
+        print(f'\nTotal estimated entities: {format_estimate(entities)}'
+              f'\nTotal elapsed time: {human_readable_elapsed_time}')
+
+    if output_file:
+        data = {
+            'worlds': worlds,
+            'total': {
+                'chunks': {
+                    'total': total_chunks,
+                    'sampled': total_sampled
+                },
+                'entities': entities,
+                'entities_by_id': _get_estimates_by_id(total_estimator),
+                'elapsed_time': {
+                    'raw': elapsed_time,
+                    'human_readable': human_readable_elapsed_time
+                }
+            }
+        }
+
+        with Path(output_file).open('w') as file:
+            if output_format == 'plain':
+                file.write(f'--- MCWorldTools by Rapha149 ---'
+                           f'\n\u00B7\u00B7\u00B7 Find entities (estimate) \u00B7\u00B7\u00B7'
+                           f'\n\nEstimates with 95% confidence intervals.'
+                           f'\n\nTotal estimated entities: {format_estimate(entities)}'
+                           f'\nTotal elapsed time: {human_readable_elapsed_time}')
+                for entity_type, type_estimate in data['total']['entities_by_id'].items():
+                    file.write(f'\n    {entity_type}: {format_estimate(type_estimate)}')
+
+                file.write(f'\n\n[ Worlds ]')
+                for world, info in worlds.items():
+                    file.write(f'\n{world}'
+                               f'\n    Estimated entities: {format_estimate(info["entities"])}')
+                    for entity_type, type_estimate in info['entities_by_id'].items():
+                        file.write(f'\n        {entity_type}: {format_estimate(type_estimate)}')
+                    file.write(f'\n    Chunks: {info["chunks"]["total"]}'
+                               f'\n    Sampled chunks: {info["chunks"]["sampled"]}')
+                    if info['chunks']['not_readable_sampled']:
+                        file.write(f'\n    Not readable sampled chunks: {info["chunks"]["not_readable_sampled"]}')
+                    file.write(f'\n    Elapsed time: {info["elapsed_time"]["human_readable"]}'
+                               f'\n    Estimated time of a full search: {info["estimated_time"]["human_readable"]}'
+                               f'\n')
+
+            else:
+                dump_data(data, file, output_format)
+
+            print(f'\nSaved output to "{output_file}"')
+
+
+def estimate(world_folder, entity_id=None, dimension=None, sample=1000, rng=random, query=None):
+    """Estimate the number of entities of a world per entity id from a stratified random sample of about ``sample``
+    chunks. The entities can be limited to an entity id, a dimension and a query like in ``scan``.
+
+    Returns the results like in the output file and the Estimator, in which the total number of entities is saved
+    under None, e.g. to combine the estimates of multiple worlds."""
+    if entity_id is not None:
+        if not isinstance(entity_id, str):
+            raise InputError(f'"id" has to be text but is {type(entity_id).__name__}')
+        entity_id = strip_id(entity_id.lower())
+    dimension = check_dimension(dimension)
+    query = compile_query(query, normalize_entity_id) if query is not None else None
+
+    strata = []
+    for dimension_, region_files in get_entity_files(world_folder).items():
+        if dimension is None or dimension_ == dimension:
+            strata += [(region_file, slots) for region_file in region_files
+                       for slots in [get_chunk_slots(region_file)] if slots]
+
+    estimator = Estimator()
+    not_readable = 0
+    start_time = time.time()
+    sampled_strata = []
+    for (region_file, slots), count in zip(strata, allocate_sample([len(slots) for _, slots in strata], sample, rng)):
+        if not count:
+            sampled_strata.append((len(slots), None))
+            continue
+        samples = []
+        with region_file.open('rb') as file:
+            region = open_region(file, region_file)
+            for x, z, _ in draw(slots, count, rng):
+                try:
+                    # chunks of region folders that were upgraded to 1.17 save their entities in the entity folder
+                    chunk = region.get_nbt_before(x, z, entities_data_version) \
+                        if region_file.parent.name == 'region' else region.get_chunk(x, z)
+                except (ChunkDataError, UnicodeDecodeError):
+                    not_readable += 1
+                    continue
+
+                data = chunk['Level'] if chunk is not None and 'Level' in chunk else chunk
+                counts = Counter(entity['id'].value for entity in data['Entities']
+                                 if (not entity_id or strip_id(entity['id'].value.lower()) == entity_id)
+                                 and (not query or query(entity))) \
+                    if data is not None and 'Entities' in data else Counter()
+                counts[None] = sum(counts.values())
+                samples.append(counts)
+        sampled_strata.append((len(slots), samples))
+    estimator.add_strata(sampled_strata)
+    read_time = time.time() - start_time
+
+    # the time per read chunk of the sample applies to a full search as well
+    estimated_time = int(round(read_time / estimator.sampled * estimator.population * 1000)) \
+        if estimator.sampled else 0
+    return {
+        'chunks': {
+            'total': estimator.population,
+            'sampled': estimator.sampled,
+            'not_readable_sampled': not_readable
+        },
+        'entities': estimator.get(None),
+        'entities_by_id': _get_estimates_by_id(estimator),
+        'estimated_time': {
+            'raw': estimated_time,
+            'human_readable': format_time(estimated_time)
+        }
+    }, estimator
+
+
+def _get_estimates_by_id(estimator):
+    estimates = {name: estimator.get(name) for name in estimator.names() if name is not None}
+    return dict(sorted(estimates.items(), key=lambda item: item[1]['estimate'], reverse=True))
+
+
+class EntityRecord(Record):
+    __slots__ = ('id', 'uuid', 'nbt')
+    keys = ('id', 'uuid', 'loc', 'chunk', 'nbt')
+
+
+def normalize_entity_id(entity_id):
+    return strip_id(entity_id.lower())
+
+
+def find_in_chunk(entities, dimension, x, z, world_x, world_z, entity_id=None, nbt_keys=None, query=None):
+    """Yield the entities of the entity list of one chunk as EntityRecords. The arguments work like in ``scan``, except
+    that ``query`` is the compiled query."""
+    for entity in entities:
+        if entity_id and strip_id(entity['id'].value.lower()) != entity_id:
+            continue
+        if query and not query(entity):
+            continue
+        record = EntityRecord()
+        record.id = sys.intern(entity['id'].value)
+        record.uuid = convert_ints_to_uuid(convert_nbt(entity['UUID'])) if 'UUID' in entity else \
+            convert_least_and_most_to_uuid(entity['UUIDLeast'].value, entity['UUIDMost'].value)
+        pos = entity['Pos']
+        record.set_location(dimension, pos[0].value, pos[1].value, pos[2].value, x, z, world_x, world_z)
+        record.nbt = '{}' if nbt_keys is None else json.dumps(convert_nbt(entity, keys=nbt_keys))
+        yield record
+
+
+def scan(world_folder, entity_id=None, dimension=None, nbt_keys=None, stats=None, progress=False, state=None,
+         processes=1, query=None):
+    """Yield the entities of a world as EntityRecords.
+
+    The entities can be limited to an entity id (with or without "minecraft:"), a dimension and a query (see
+    ``mcworldtools.query``), which is evaluated before the entities are converted.
+    ``nbt_keys`` is a list of NBT keys that are included as json in "nbt", an empty list includes all keys and None
+    includes no NBT at all. Not readable chunks are counted in ``stats`` and a progress bar is shown if ``progress``
+    is enabled. If a ScanState is given, only the chunks saved since its time are read and the found entities are
+    stored in it. Otherwise, without a dimension, the dimensions are scanned in up to ``processes`` parallel processes.
+    Raises an InputError if an argument is invalid.
+    """
+    if entity_id is not None:
+        if not isinstance(entity_id, str):
+            raise InputError(f'"id" has to be text but is {type(entity_id).__name__}')
+        entity_id = strip_id(entity_id.lower())
+    dimension = check_dimension(dimension)
+    if nbt_keys is not None and not isinstance(nbt_keys, (list, tuple, set)):
+        raise InputError(f'"nbt_keys" has to be a list but is {type(nbt_keys).__name__}')
+    compiled_query = compile_query(query, normalize_entity_id) if query is not None else None
+    stats = stats if stats is not None else ScanStats()
+
+    files = get_entity_files(world_folder)
+    if dimension is None and state is None and processes > 1 and len(files) > 1:
+        yield from scan_dimensions(scan, world_folder, files, processes, stats, progress, entity_id=entity_id,
+                                   nbt_keys=nbt_keys, query=query)
+        return
+
+    limit_dimensions = [dimension] if dimension else None
+    since = state.since if state is not None else None
+    for dimension_, region_file, region, x, z, chunk in iter_chunks(files, stats, progress, limit_dimensions,
+                                                                    since=since,
+                                                                    skip_data_version=entities_data_version):
+        if chunk is None:
+            found = (EntityRecord.from_dict(entity)
+                     for entity in state.previous.get(chunk_key(dimension_, region_file, x, z), ()))
+        else:
+            data = chunk['Level'] if 'Level' in chunk else chunk
+
+            if 'Entities' not in data:
+                stats.messages.append(f'Chunk {x} {z} (in world at {chunk.loc.x} {chunk.loc.z}) in the region file "'
+                                      f'{region_file}" could not be read.')
+                continue
+
+            found = find_in_chunk(data['Entities'], dimension_, x, z, chunk.loc.x, chunk.loc.z, entity_id, nbt_keys,
+                                  compiled_query)
+
+        if state is not None:
+            found = list(found)
+            if found:
+                state.chunks[chunk_key(dimension_, region_file, x, z)] = found
+        yield from found
+
+
+def find_duplicates(world_folders, output_file, output_format, input_data):
+    if not output_file:
+        print(f'\nFor this action you have to state an output file as command argument (-o).')
+        exit(4)
+
+    memory_limit = default_memory_limit
+    if input_data and 'memory_limit' in input_data:
+        print('\nLoading more input file data...')
+        memory_limit = input_data['memory_limit']
+        if not isinstance(memory_limit, int) or memory_limit <= 0:
+            raise InputError(f'"memory_limit" has to be a positive number.')
+        print(f'Using a memory limit of {memory_limit} MB.')
+
+    total_start_time = time.time()
+    total_duplicates, total_entities, total_not_readable_chunks = 0, 0, 0
+    worlds = {}
+    for world_folder in world_folders:
+        if not get_entity_folders(world_folder):
+            print(f'\nNo entity folder was found in world "{world_folder}"')
+            continue
+
+        start_time = time.time()
+        metrics.start_world(world_folder)
+        stats = ScanStats()
+        print(f'\nSearching for duplicate entity uuids in world "{world_folder}"...')
+        duplicates = list(scan_duplicates(world_folder, memory_limit, stats=stats, progress=True))
+        messages, not_readable_chunks = stats.messages, stats.not_readable_chunks
+
+        elapsed_time = int(round((time.time() - start_time) * 1000))
+        human_readable_elapsed_time = format_time(elapsed_time)
+
+        entity_count = sum(duplicate['count'] for duplicate in duplicates)
+        print(f'Found {len(duplicates)} duplicate uuids used by {entity_count} entities in world "{world_folder}". '
+              f'(Elapsed time: {human_readable_elapsed_time})')
+
+        for message in messages:
+            print(message)
+
+        if not_readable_chunks:
+            print(f'{not_readable_chunks} chunks could not be read.')
+
+        total_duplicates += len(duplicates)
+        total_entities += entity_count
+        total_not_readable_chunks += not_readable_chunks
+
+        if output_file:
+            worlds[str(world_folder.resolve())] = {
+                'duplicates': duplicates,
+                'entities': entity_count,
+                'not_readable_chunks': not_readable_chunks,
+                'elapsed_time': {
+                    'raw': elapsed_time,
+                    'human_readable': human_readable_elapsed_time
+                }
+            }
+
+    elapsed_time = int(round((time.time() - total_start_time) * 1000))
+    human_readable_elapsed_time = format_time(elapsed_time)
+
+    if len(world_folders) > 1:
+        print(f'\nTotal found duplicate uuids: {total_duplicates}'
+              f'\nTotal elapsed time: {human_readable_elapsed_time}')
+
+    if output_file:
+        data = {
+            'worlds': worlds,
+            'total': {
+                'duplicates': total_duplicates,
+                'entities': total_entities,
+                'not_readable_chunks': total_not_readable_chunks,
+                'elapsed_time': {
+                    'raw': elapsed_time,
+                    'human_readable': human_readable_elapsed_time
+                }
+            }
+        }
+
+        with Path(output_file).open('w') as file:
+            if output_format == 'plain':
+                file.write(f'--- MCWorldTools by Rapha149 ---'
+                           f'\n\u00B7\u00B7\u00B7 Find duplicate uuids \u00B7\u00B7\u00B7'
+                           f'\n\nTotal found duplicate uuids: {total_duplicates}'
+                           f'\nTotal entities with duplicate uuids: {total_entities}'
+                           f'\nTotal elapsed time: {human_readable_elapsed_time}')
+                if total_not_readable_chunks:
+                    file.write(f'\nTotal not readable chunks: {total_not_readable_chunks}')
+
+                file.write(f'\n\n[ Worlds ]')
+                for world, info in worlds.items():
+                    duplicates = info['duplicates']
+                    file.write(f'\n{world}'
+                               f'\n    Duplicate uuids found: {len(duplicates)}'
+                               f'\n    Entities with duplicate uuids: {info["entities"]}'
+                               f'\n    Elapsed time: {info["elapsed_time"]["human_readable"]}')
+                    if info['not_readable_chunks']:
+                        file.write(f'\n    Not readable chunks: {info["not_readable_chunks"]}')
+
+                    if duplicates:
+                        file.write('\n    Duplicates:')
+                        for i in range(len(duplicates)):
+                            if i > 0:
+                                file.write('\n        ------------------')
+
+                            duplicate = duplicates[i]
+                            file.write(f'\n        UUID: {duplicate["uuid"]}'
+                                       f'\n        Entities: {duplicate["count"]}')
+                            for entity in duplicate['entities']:
+                                loc, chunk = entity['loc'], entity['chunk']
+                                file.write(f'\n            ID: {entity["id"]}'
+                                           f'\n                Dimension: {loc["dimension"].capitalize()}'
+                                           f'\n                Location: {loc["x"]} {loc["y"]} {loc["z"]}'
+                                           f'\n                Chunk:'
+                                           f'\n                    In region file: {chunk["in_region_file"]["x"]} '
+                                           f'{chunk["in_region_file"]["z"]}'
+                                           f'\n                    In world: {chunk["in_world"]["x"]} '
+                                           f'{chunk["in_world"]["z"]}')
+                    file.write('\n')
+
+            else:
+                dump_data(data, file, output_format)
 
             print(f'\nSaved output to "{output_file}"')
 
 
+# in MB
+default_memory_limit = 256
+# packed uuid, uuid format (0 = UUID int array, 1 = UUIDMost and UUIDLeast), dimension index, chunk x and z in the
+# world, position and index of the entity id
+_uuid_record = struct.Struct('>16sBBiidddI')
+
+
+class _UuidBuckets:
+    """Spreads packed entity records over 256 buckets by the first byte of their uuid.
+
+    The buckets are kept in memory until more than ``memory_limit`` bytes are buffered. Then all buffers are appended
+    to temporary files, so only one bucket at a time has to fit into memory when searching for duplicates."""
+
+    def __init__(self, memory_limit):
+        self.memory_limit = memory_limit
+        self.buffers = [bytearray() for _ in range(256)]
+        self.buffered = 0
+        self.temp_dir = None
+
+    def add(self, record):
+        self.buffers[record[0]] += record
+        self.buffered += len(record)
+        if self.buffered > self.memory_limit:
+            self.spill()
+
+    def spill(self):
+        if self.temp_dir is None:
+            self.temp_dir = tempfile.TemporaryDirectory(prefix='mcworldtools-')
+        for i, buffer in enumerate(self.buffers):
+            if buffer:
+                with Path(self.temp_dir.name, str(i)).open('ab') as file:
+                    file.write(buffer)
+                self.buffers[i] = bytearray()
+        self.buffered = 0
+
+    def __iter__(self):
+        for i, buffer in enumerate(self.buffers):
+            if self.temp_dir is not None:
+                bucket_file = Path(self.temp_dir.name, str(i))
+                if bucket_file.is_file():
+                    buffer = bucket_file.read_bytes() + buffer
+            self.buffers[i] = None
+            yield bytes(buffer)
+
+    def close(self):
+        if self.temp_dir is not None:
+            self.temp_dir.cleanup()
+
+
+def scan_duplicates(world_folder, memory_limit=default_memory_limit, stats=None, progress=False):
+    """Yield every uuid that is used by more than one entity of a world, across all dimensions, as dict with the
+    locations of all entities using it.
+
+    Uuids are packed into fixed size records together with the location of their entity. Once the records exceed
+    ``memory_limit`` MB they are written to temporary files, so the memory usage stays bounded on large worlds."""
+    stats = stats if stats is not None else ScanStats()
+    entity_ids = {}
+    buckets = _UuidBuckets(memory_limit * 1000 * 1000)
+    try:
+        files = get_entity_files(world_folder)
+        # the records store the index of the dimension in this list
+        dimension_names = list(files)
+        for dimension, region_file, region, x, z, chunk in iter_chunks(files, stats, progress,
+                                                                       skip_data_version=entities_data_version):
+            data = chunk['Level'] if 'Level' in chunk else chunk
+
+            if 'Entities' not in data:
+                stats.messages.append(f'Chunk {x} {z} (in world at {chunk.loc.x} {chunk.loc.z}) in the region file "'
+                                      f'{region_file}" could not be read.')
+                continue
+
+            dimension_index = dimension_names.index(dimension)
+            for entity in data['Entities']:
+                if 'UUID' in entity:
+                    uuid_format, uuid = 0, struct.pack('>4i', *entity['UUID'].value)
+                elif 'UUIDMost' in entity and 'UUIDLeast' in entity:
+                    uuid_format, uuid = 1, struct.pack('>qq', entity['UUIDMost'].value, entity['UUIDLeast'].value)
+                else:
+                    continue
+
+                entity_id = entity['id'].value
+                id_index = entity_ids.setdefault(entity_id, len(entity_ids))
+                pos = entity['Pos']
+                buckets.add(_uuid_record.pack(uuid, uuid_format, dimension_index, chunk.loc.x, chunk.loc.z,
+                                              pos[0].value, pos[1].value, pos[2].value, id_index))
+
+        entity_ids = list(entity_ids)
+        size = _uuid_record.size
+        for bucket in buckets:
+            counts = Counter(bucket[i:i + 16] for i in range(0, len(bucket), size))
+            duplicates = {uuid: [] for uuid, count in sorted(counts.items()) if count > 1}
+            del counts
+            if not duplicates:
+                continue
+
+            for i in range(0, len(bucket), size):
+                if bucket[i:i + 16] in duplicates:
+                    duplicates[bucket[i:i + 16]].append(_uuid_record.unpack_from(bucket, i))
+
+            for uuid, records in duplicates.items():
+                yield {
+                    'uuid': convert_ints_to_uuid(struct.unpack('>4i', uuid)) if records[0][1] == 0 else
+                    convert_least_and_most_to_uuid(*reversed(struct.unpack('>qq', uuid))),
+                    'count': len(records),
+                    'entities': [{
+                        'id': entity_ids[id_index],
+                        'loc': {
+                            'dimension': dimension_names[dimension_index],
+                            'x': pos_x,
+                            'y': pos_y,
+                            'z': pos_z
+                        },
+                        'chunk': {
+                            'in_region_file': {
+                                'x': chunk_x & 31,
+                                'z': chunk_z & 31
+                            },
+                            'in_world': {
+                                'x': chunk_x,
+                                'z': chunk_z
+                            }
+                        }
+                    } for _, _, dimension_index, chunk_x, chunk_z, pos_x, pos_y, pos_z, id_index in records]
+                }
+    finally:
+        buckets.close()
+
+
 def remove(world_folders, output_file, output_format, input_data, confirm):
     possibilities_str = '"' + '", "'.join(remove_by_possibilites) + '"'
     remove_by, entity_id, uuid, uuid_ints, uuid_least, uuid_most = None, None, None, None, None, None
@@ -339,12 +815,10 @@ def remove(world_folders, output_file, output_format, input_data, confirm):
         print('\nLoading more input data...')
         remove_by = input_data['remove_by']
         if not isinstance(remove_by, str):
-            eprint(f'"remove_by" has to be text but is {type(remove_by).__name__}')
-            exit(3)
+            raise InputError(f'"remove_by" has to be text but is {type(remove_by).__name__}')
         remove_by = remove_by.lower()
         if remove_by not in remove_by_possibilites:
-            eprint(f'"remove_by" has to be one of {possibilities_str}')
-            exit(3)
+            raise InputError(f'"remove_by" has to be one of {possibilities_str}')
         print(f'Removing {"by " if remove_by != "all" else ""}{remove_by}')
 
     if not remove_by:
@@ -367,8 +841,7 @@ def remove(world_folders, output_file, output_format, input_data, confirm):
 
             entity_id = input_data['id']
             if not isinstance(entity_id, str):
-                eprint(f'"id" has to be a number but is {type(entity_id).__name__}')
-                exit(3)
+                raise InputError(f'"id" has to be a number but is {type(entity_id).__name__}')
             entity_id = strip_id(entity_id.lower())
             print(f'Using entity id "{entity_id}"')
 
@@ -378,11 +851,9 @@ def remove(world_folders, output_file, output_format, input_data, confirm):
 
             uuid = input_data['uuid']
             if not isinstance(uuid, str):
-                eprint(f'"uuid" has to be a number but is {type(uuid).__name__}')
-                exit(3)
+                raise InputError(f'"uuid" has to be a number but is {type(uuid).__name__}')
             if not re.match(uuid_pattern, uuid):
-                eprint(f'"uuid" is not a valid uuid.')
-                exit(3)
+                raise InputError(f'"uuid" is not a valid uuid.')
             print(f'Using uuid "{uuid}"')
 
     if remove_by == 'id' and not entity_id:
@@ -437,77 +908,50 @@ def remove(world_folders, output_file, output_format, input_data, confirm):
     total_entities, total_not_readable_chunks = 0, 0
     worlds = {}
     for world_folder in world_folders:
-        entity_folders = get_entity_folders(world_folder)
-        if not entity_folders:
+        if not get_entity_folders(world_folder):
             print(f'\nNo entity folder was found in world "{world_folder}"')
             continue
 
-        files = map_files(entity_folders)
-        file_count = len(get_all_files(files))
+        files = get_entity_files(world_folder)
 
         start_time = time.time()
-        entity_count, not_readable_chunks = 0, 0
-        messages = []
+        metrics.start_world(world_folder)
+        entity_count = 0
+        stats = ScanStats()
         print(f'\nRemoving entities in world "{world_folder}"...')
-        with tqdm(total=file_count * 32 * 32 if file_count > 0 else 1,
-                  unit_scale=1 / 32 / 32,
-                  bar_format='{percentage:.2f}% |{bar}| [{n:.0f}/{total:.0f} files]  ') as pbar:
-
-            if file_count <= 0:
-                pbar.update()
-
-            for dimension, region_files in files.items():
-                for region_file in region_files:
-                    with region_file.open('r+b') as file:
-                        region = RegionFile(fileobj=file)
-                        match = re.match('r\\.(-?\\d+)\\.(-?\\d+)\\.mca', region_file.name)
-                        if match:
-                            region.loc = Location(x=int(match.group(1)), z=int(match.group(2)))
-
-                        pbar.update(32 * 32 - region.chunk_count())
-                        for coords in region.get_chunk_coords():
-                            x, z = coords['x'], coords['z']
-                            try:
-                                chunk = region.get_chunk(x, z)
-                            except ChunkDataError:
-                                not_readable_chunks += 1
-                                pbar.update()
-                                continue
-
-                            world_x, world_z = chunk.loc.x, chunk.loc.z
-                            data = chunk['Level'] if 'Level' in chunk else chunk
-
-                            if 'Entities' not in data:
-                                messages.append(f'Chunk {x} {z} (in world at {world_x} {world_z}) in the region file "'
-                                                f'{region_file}" could not be read.')
-                                continue
-
-                            to_remove = []
-                            entities = data['Entities']
-                            for i in range(len(entities)):
-                                entity = entities[i]
-                                if remove_by == 'id':
-                                    if strip_id(entity['id'].value.lower()) != entity_id:
-                                        continue
-                                elif remove_by == 'uuid':
-                                    if 'UUID' in entity:
-                                        if uuid_ints != convert_nbt(entity['UUID']):
-                                            continue
-                                    else:
-                                        if uuid_least != entity['UUIDLeast'].value or \
-                                                uuid_most != entity['UUIDMost'].value:
-                                            continue
-                                elif remove_by != 'all':
-                                    continue
-                                to_remove.append(i)
-
-                            if to_remove:
-                                entity_count += len(to_remove)
-                                for i in reversed(to_remove):
-                                    del entities[i]
-                                region.write_chunk(x, z, chunk)
-
-                            pbar.update()
+        for dimension, region_file, region, x, z, chunk in iter_chunks(files, stats, True, writable=True,
+                                                                       skip_data_version=entities_data_version):
+            data = chunk['Level'] if 'Level' in chunk else chunk
+
+            if 'Entities' not in data:
+                stats.messages.append(f'Chunk {x} {z} (in world at {chunk.loc.x} {chunk.loc.z}) in the region file '
+                                      f'"{region_file}" could not be read.')
+                continue
+
+            to_remove = []
+            entities = data['Entities']
+            for i in range(len(entities)):
+                entity = entities[i]
+                if remove_by == 'id':
+                    if strip_id(entity['id'].value.lower()) != entity_id:
+                        continue
+                elif remove_by == 'uuid':
+                    if 'UUID' in entity:
+                        if uuid_ints != convert_nbt(entity['UUID']):
+                            continue
+                    else:
+                        if uuid_least != entity['UUIDLeast'].value or uuid_most != entity['UUIDMost'].value:
+                            continue
+                elif remove_by != 'all':
+                    continue
+                to_remove.append(i)
+
+            if to_remove:
+                entity_count += len(to_remove)
+                for i in reversed(to_remove):
+                    del entities[i]
+                region.write_chunk(x, z, chunk)
+        messages, not_readable_chunks = stats.messages, stats.not_readable_chunks
 
         elapsed_time = int(round((time.time() - start_time) * 1000))
         human_readable_elapsed_time = format_time(elapsed_time)
@@ -572,9 +1016,405 @@ def remove(world_folders, output_file, output_format, input_data, confirm):
                         file.write(f'\n    Not readable chunks: {info["not_readable_chunks"]}')
                     file.write('\n')
 
-            elif output_format == 'json':
-                json.dump(data, file, indent=3)
-            elif output_format == 'yaml':
-                yaml.dump(data, file, indent=3)
+            else:
+                dump_data(data, file, output_format)
 
             print(f'\nSaved output to "{output_file}"')
+
+
+def move(world_folders, output_file, output_format, input_data, confirm):
+    moves = None
+    if input_data and 'moves' in input_data:
+        print('\nLoading more input data...')
+        moves = input_data['moves']
+        if not isinstance(moves, list):
+            raise InputError(f'"moves" has to be a list but is {type(moves).__name__}')
+        if not moves:
+            raise InputError(f'"moves" has to contain at least one move.')
+        moves = [EntityMove(moves[i], i + 1) for i in range(len(moves))]
+        print(f'Using {len(moves)} move{"s" if len(moves) != 1 else ""}.')
+
+    if moves is None:
+        print('\nChoose the entities to move. Enter nothing once your finished.'
+              '\nState an entity id or a uuid, optionally a dimension and an area as "X1 Z1 X2 Z2" in block coordinates'
+              ' and the destination as "X Y Z" or as "~X ~Y ~Z" to move the entities by an offset.')
+        moves = []
+        while True:
+            answer = input(f'{len(moves) + 1}. Entity id or uuid: ').strip()
+            if not answer:
+                if moves:
+                    break
+                else:
+                    print('State at least 1 move.')
+                    continue
+            move_data = {'uuid' if re.match(uuid_pattern, answer) else 'id': answer}
+
+            while True:
+                answer = input('   Dimension (nothing for all dimensions): ').strip().lower()
+                if answer and not is_dimension(answer):
+                    print('Unknown dimension.')
+                    continue
+                move_data['dimension'] = answer or None
+                break
+
+            while True:
+                answer = input('   Area (nothing for everywhere): ').split()
+                if answer and (len(answer) != 4 or not all(re.match(r'^-?\d+$', value) for value in answer)):
+                    print('Please state four numbers.')
+                    continue
+                if answer:
+                    move_data['area'] = {'from': [int(answer[0]), int(answer[1])],
+                                         'to': [int(answer[2]), int(answer[3])]}
+                break
+
+            while True:
+                answer = input('   Destination: ').split()
+                relative = [value.startswith('~') for value in answer]
+                values = [value[1:] or '0' if value.startswith('~') else value for value in answer]
+                if len(answer) != 3 or any(relative) != all(relative) or \
+                        not all(re.match(r'^-?\d+(\.\d+)?$', value) for value in values):
+                    print('Please state three numbers, either all or none of them prepended with "~".')
+                    continue
+                move_data['offset' if relative[0] else 'to'] = [float(value) for value in values]
+                break
+
+            moves.append(EntityMove(move_data, len(moves) + 1))
+
+    if not confirm:
+        print('\nWarning: This operation will move the selected entities permanently.'
+              '\nIt is recommended to make a backup of your world beforehand.'
+              '\nNo further confirmation requests will be made before entities are moved.')
+        while True:
+            answer = parse_yes_no(input('Do you want to continue? (y/N): '), default=False)
+            if answer is not None:
+                if not answer:
+                    exit()
+                break
+
+    total_start_time = time.time()
+    total_moved, total_not_moved, total_not_readable_chunks = 0, 0, 0
+    worlds = {}
+    for world_folder in world_folders:
+        if not get_entity_folders(world_folder):
+            print(f'\nNo entity folder was found in world "{world_folder}"')
+            continue
+
+        start_time = time.time()
+        metrics.start_world(world_folder)
+        stats = ScanStats()
+        print(f'\nSearching for entities to move in world "{world_folder}"...')
+        changes, moved, not_moved = plan_moves(world_folder, moves, stats, progress=True)
+        if changes:
+            print(f'Writing {sum(len(chunks) for chunks in changes.values())} chunks in {len(changes)} region '
+                  f'files...')
+            write_moves(world_folder, changes, stats, progress=True)
+        messages, not_readable_chunks = stats.messages, stats.not_readable_chunks
+
+        elapsed_time = int(round((time.time() - start_time) * 1000))
+        human_readable_elapsed_time = format_time(elapsed_time)
+
+        print(f'Moved {moved} entities in world "{world_folder}". (Elapsed time: {human_readable_elapsed_time})')
+        if not_moved:
+            print(f'{not_moved} entities were not moved because their destination chunk does not exist or could not be '
+                  f'read.')
+
+        for message in messages:
+            print(message)
+
+        if not_readable_chunks:
+            print(f'{not_readable_chunks} chunks could not be read.')
+
+        total_moved += moved
+        total_not_moved += not_moved
+        total_not_readable_chunks += not_readable_chunks
+
+        if output_file:
+            worlds[str(world_folder.resolve())] = {
+                'moved_entities': moved,
+                'not_moved_entities': not_moved,
+                'changed_chunks': sum(len(chunks) for chunks in changes.values()),
+                'not_readable_chunks': not_readable_chunks,
+                'elapsed_time': {
+                    'raw': elapsed_time,
+                    'human_readable': human_readable_elapsed_time
+                }
+            }
+
+    elapsed_time = int(round((time.time() - total_start_time) * 1000))
+    human_readable_elapsed_time = format_time(elapsed_time)
+
+    if len(world_folders) > 1:
+        print(f'\nTotal moved entities: {total_moved}'
+              f'\nTotal elapsed time: {human_readable_elapsed_time}')
+
+    if output_file:
+        data = {
+            'worlds': worlds,
+            'total': {
+                'moved_entities': total_moved,
+                'not_moved_entities': total_not_moved,
+                'not_readable_chunks': total_not_readable_chunks,
+                'elapsed_time': {
+                    'raw': elapsed_time,
+                    'human_readable': human_readable_elapsed_time
+                }
+            }
+        }
+
+        with Path(output_file).open('w') as file:
+            if output_format == 'plain':
+                file.write(f'--- MCWorldTools by Rapha149 ---'
+                           f'\n\u00B7\u00B7\u00B7 Move entities \u00B7\u00B7\u00B7'
+                           f'\n\nTotal moved entities: {total_moved}')
+                if total_not_moved:
+                    file.write(f'\nTotal not moved entities: {total_not_moved}')
+                file.write(f'\nTotal elapsed time: {human_readable_elapsed_time}')
+                if total_not_readable_chunks:
+                    file.write(f'\nTotal not readable chunks: {total_not_readable_chunks}')
+
+                file.write(f'\n\n[ Worlds ]')
+                for world, info in worlds.items():
+                    file.write(f'\n{world}'
+                               f'\n    Moved entities: {info["moved_entities"]}')
+                    if info['not_moved_entities']:
+                        file.write(f'\n    Not moved entities: {info["not_moved_entities"]}')
+                    file.write(f'\n    Changed chunks: {info["changed_chunks"]}'
+                               f'\n    Elapsed time: {info["elapsed_time"]["human_readable"]}')
+                    if info['not_readable_chunks']:
+                        file.write(f'\n    Not readable chunks: {info["not_readable_chunks"]}')
+                    file.write('\n')
+
+            else:
+                dump_data(data, file, output_format)
+
+            print(f'\nSaved output to "{output_file}"')
+
+
+class EntityMove:
+    """One item of "moves": the entities it selects by id, uuid, dimension and area and where they are moved to,
+    either a position ("to") or an offset ("offset")."""
+
+    def __init__(self, move, number=1):
+        if not isinstance(move, dict):
+            raise InputError(f'{number}. move has to be an object but is {type(move).__name__}.')
+        self.entity_id, self.uuid_ints, self.uuid_least_and_most, self.area = None, None, None, None
+        if move.get('id') is not None:
+            if not isinstance(move['id'], str):
+                raise InputError(f'"id" of the {number}. move has to be text but is {type(move["id"]).__name__}')
+            self.entity_id = strip_id(move['id'].lower())
+        if move.get('uuid') is not None:
+            if not isinstance(move['uuid'], str) or not re.match(uuid_pattern, move['uuid']):
+                raise InputError(f'"uuid" of the {number}. move is not a valid uuid.')
+            self.uuid_ints = convert_uuid_to_ints(move['uuid'].lower())
+            self.uuid_least_and_most = convert_uuid_to_least_and_most(move['uuid'].lower())
+        if move.get('area') is not None:
+            area = move['area']
+            if not isinstance(area, dict) or not self._is_numbers(area.get('from'), 2, int) or \
+                    not self._is_numbers(area.get('to'), 2, int):
+                raise InputError(f'"area" of the {number}. move needs "from" and "to" as block coordinates.')
+            (x1, x2), (z1, z2) = sorted((area['from'][0], area['to'][0])), sorted((area['from'][1], area['to'][1]))
+            self.area = x1, z1, x2, z2
+        if self.entity_id is None and self.uuid_ints is None and self.area is None:
+            raise InputError(f'The {number}. move needs at least one of "id", "uuid" and "area".')
+        self.dimension = check_dimension(move.get('dimension'))
+
+        if ('to' in move) == ('offset' in move):
+            raise InputError(f'The {number}. move needs either "to" or "offset".')
+        self.relative = 'offset' in move
+        self.position = move['offset'] if self.relative else move['to']
+        if not self._is_numbers(self.position, 3, (int, float)):
+            raise InputError(f'"{"offset" if self.relative else "to"}" of the {number}. move has to be a list of three '
+                             f'numbers.')
+
+    @staticmethod
+    def _is_numbers(value, count, types):
+        return isinstance(value, list) and len(value) == count and \
+            all(isinstance(number, types) and not isinstance(number, bool) for number in value)
+
+    def matches(self, dimension, entity):
+        if self.dimension is not None and dimension != self.dimension:
+            return False
+        if self.entity_id is not None and strip_id(entity['id'].value.lower()) != self.entity_id:
+            return False
+        if self.uuid_ints is not None:
+            if 'UUID' in entity:
+                if convert_nbt(entity['UUID']) != self.uuid_ints:
+                    return False
+            elif 'UUIDLeast' not in entity or (entity['UUIDLeast'].value, entity['UUIDMost'].value) != \
+                    self.uuid_least_and_most:
+                return False
+        if self.area is not None:
+            x, z = math.floor(entity['Pos'][0].value), math.floor(entity['Pos'][2].value)
+            x1, z1, x2, z2 = self.area
+            if not x1 <= x <= x2 or not z1 <= z <= z2:
+                return False
+        return True
+
+    def get_position(self, position):
+        if self.relative:
+            return [value + offset for value, offset in zip(position, self.position)]
+        return [float(value) for value in self.position]
+
+
+def set_entity_position(entity, position):
+    """Set the position of an entity and move the block position of hanging entities (e.g. item frames) and the
+    passengers along with it."""
+    old_position = [tag.value for tag in entity['Pos']]
+    for tag, value in zip(entity['Pos'], position):
+        tag.value = value
+    blocks = [math.floor(new) - math.floor(old) for new, old in zip(position, old_position)]
+    for key, block in zip(('TileX', 'TileY', 'TileZ'), blocks):
+        if key in entity:
+            entity[key].value += block
+    if 'block_pos' in entity and len(entity['block_pos'].value) == 3:
+        entity['block_pos'].value = [value + block for value, block in zip(entity['block_pos'].value, blocks)]
+    if 'Passengers' in entity:
+        for passenger in entity['Passengers']:
+            set_entity_position(passenger, [value + new - old for value, new, old in
+                                            zip((tag.value for tag in passenger['Pos']), position, old_position)])
+
+
+class _ChunkChanges:
+    """The entities to remove from and to add to one chunk."""
+    __slots__ = ('removed', 'added')
+
+    def __init__(self):
+        self.removed = []
+        self.added = []
+
+
+class _Destinations:
+    """Finds the chunk that the entities at a chunk position have to be saved in, in the same files that
+    ``get_entity_files`` reads."""
+
+    def __init__(self, world_folder):
+        self.split = get_storage_layout(world_folder) == 'split'
+        self.dimension_folders = get_dimension_folders(world_folder)
+        self.cache = {}
+
+    def get(self, dimension, chunk_x, chunk_z):
+        """Returns (region_file, x, z) or None if the entities can't be saved there."""
+        key = dimension, chunk_x, chunk_z
+        if key not in self.cache:
+            self.cache[key] = self._find(dimension, chunk_x, chunk_z)
+        return self.cache[key]
+
+    def _find(self, dimension, chunk_x, chunk_z):
+        folder = self.dimension_folders[dimension]
+        name = f'r.{chunk_x >> 5}.{chunk_z >> 5}.mca'
+        x, z = chunk_x & 31, chunk_z & 31
+        entity_file, region_file = Path(folder, 'entities', name), Path(folder, 'region', name)
+        if self.split and entity_file.is_file():
+            return (entity_file, x, z) if self._read_chunk(entity_file, x, z) is not False else None
+        if region_file.is_file():
+            chunk = self._read_chunk(region_file, x, z)
+            readable = chunk is not None and chunk is not False
+            if not self.split:
+                return (region_file, x, z) if readable else None
+            # chunks that were not loaded since the world was upgraded to 1.17 still contain their entities
+            if readable and ('DataVersion' not in chunk or chunk['DataVersion'].value < entities_data_version):
+                return region_file, x, z
+        return (entity_file, x, z) if self.split else None
+
+    @staticmethod
+    def _read_chunk(region_file, x, z):
+        """Returns a chunk, None if it does not exist or False if it is not readable."""
+        with region_file.open('rb') as file:
+            region = open_region(file, region_file)
+            if region.metadata[x, z].status == STATUS_CHUNK_NOT_CREATED:
+                return None
+            try:
+                return region.get_chunk(x, z)
+            except ChunkDataError:
+                return False
+
+
+def plan_moves(world_folder, moves, stats=None, progress=False):
+    """Find the entities of a world that are selected by one of the EntityMoves (the first one that matches) and set
+    their new positions. Nothing is written yet.
+
+    Returns the changes per chunk of every region file to be passed to ``write_moves``, the number of moved entities
+    and the number of entities that can't be moved because their destination chunk does not exist (only 1.17+ entity
+    chunks can be created) or is not readable. Entities stay in their dimension."""
+    stats = stats if stats is not None else ScanStats()
+    destinations = _Destinations(world_folder)
+    changes = {}
+    moved, not_moved = 0, 0
+    files = get_entity_files(world_folder)
+    for dimension, region_file, region, x, z, chunk in iter_chunks(files, stats, progress,
+                                                                   skip_data_version=entities_data_version):
+        data = chunk['Level'] if 'Level' in chunk else chunk
+
+        if 'Entities' not in data:
+            stats.messages.append(f'Chunk {x} {z} (in world at {chunk.loc.x} {chunk.loc.z}) in the region file "'
+                                  f'{region_file}" could not be read.')
+            continue
+
+        entities = data['Entities']
+        for i in range(len(entities)):
+            entity = entities[i]
+            entity_move = next((entity_move for entity_move in moves if entity_move.matches(dimension, entity)), None)
+            if entity_move is None:
+                continue
+
+            position = entity_move.get_position([tag.value for tag in entity['Pos']])
+            destination = destinations.get(dimension, math.floor(position[0]) >> 4, math.floor(position[2]) >> 4)
+            if destination is None:
+                not_moved += 1
+                continue
+
+            set_entity_position(entity, position)
+            changes.setdefault(region_file, {}).setdefault((x, z), _ChunkChanges()).removed.append(i)
+            destination_file, destination_x, destination_z = destination
+            changes.setdefault(destination_file, {}).setdefault((destination_x, destination_z),
+                                                                _ChunkChanges()).added.append(entity)
+            moved += 1
+    return changes, moved, not_moved
+
+
+def write_moves(world_folder, changes, stats=None, progress=False):
+    """Write the changes of ``plan_moves``. Every region file is opened once and every changed chunk is read and
+    written once, no matter how many entities are moved out of or into it. Missing entity chunks and region files are
+    created."""
+    stats = stats if stats is not None else ScanStats()
+    data_version = get_data_version(world_folder)
+    with Progress([region_file for region_file in changes if region_file.is_file()], show=progress) as pbar:
+        for region_file, chunks in changes.items():
+            region_file.parent.mkdir(parents=True, exist_ok=True)
+            with region_file.open('r+b' if region_file.is_file() else 'w+b') as file:
+                region = open_region(file, region_file)
+                for (x, z), chunk_changes in sorted(chunks.items()):
+                    if region.metadata[x, z].status == STATUS_CHUNK_NOT_CREATED:
+                        chunk = NBTFile()
+                        chunk.name = ''
+                        if data_version is not None:
+                            chunk.tags.append(TAG_Int(name='DataVersion', value=data_version))
+                    else:
+                        try:
+                            chunk = region.get_chunk(x, z)
+                        except ChunkDataError:
+                            stats.not_readable_chunks += 1
+                            stats.messages.append(f'Chunk {x} {z} in the region file "{region_file}" could not be '
+                                                  f'read again, {len(chunk_changes.added)} entities were not moved '
+                                                  f'into it.')
+                            continue
+
+                    data = chunk['Level'] if 'Level' in chunk else chunk
+                    if 'Entities' not in data:
+                        data.tags.append(TAG_List(name='Entities', type=TAG_Compound))
+                    entities = data['Entities']
+                    for i in sorted(chunk_changes.removed, reverse=True):
+                        del entities[i]
+                    if chunk_changes.added:
+                        # empty lists may be saved with another item type
+                        entities.tagID = TAG_COMPOUND
+                        entities.extend(chunk_changes.added)
+
+                    if region_file.parent.name == 'entities':
+                        # the position of 1.17+ entity chunks, in chunk coordinates
+                        if 'Position' not in chunk:
+                            chunk.tags.append(TAG_Int_Array(name='Position'))
+                        chunk['Position'].value = [region.loc.x * 32 + x, region.loc.z * 32 + z]
+                    region.write_chunk(x, z, chunk)
+            pbar.file_done(region_file)
+    return stats
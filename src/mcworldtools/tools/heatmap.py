@@ -0,0 +1,402 @@
+import math
+import struct
+import zlib
+from array import array
+
+from nbt.region import *
+
+from .command_blocks import types as command_block_types
+from .. import metrics
+from ..util import *
+
+counters = ['entities', 'block_entities', 'command_blocks']
+heatmap_formats = ['png', 'array']
+heatmap_extensions = {
+    'png': 'png',
+    'array': 'npy'
+}
+
+
+def start(world_folders, output_file, output_format, input_data, confirm):
+    if not output_file:
+        print(f'\nFor this tool you have to state an output file as command argument (-o).')
+        exit(4)
+
+    limit_to_dimension, limit_dimension, heatmap_format, top = None, None, None, None
+    if input_data:
+        print('\nLoading input file data...')
+        if 'dimension' in input_data:
+            limit_dimension = input_data['dimension']
+            if limit_dimension is None:
+                limit_to_dimension = False
+                print(f'Not limiting to one dimension.')
+            else:
+                if not isinstance(limit_dimension, str):
+                    raise InputError(f'"dimension" has to be text but is {type(limit_dimension).__name__}')
+                limit_to_dimension = True
+                limit_dimension = limit_dimension.lower()
+                if not is_dimension(limit_dimension):
+                    raise InputError(f'Unknown dimension "{limit_dimension}"')
+                print(f'Limiting to dimension "{limit_dimension}"')
+
+        if 'heatmap_format' in input_data:
+            heatmap_format = input_data['heatmap_format']
+            if not isinstance(heatmap_format, str):
+                raise InputError(f'"heatmap_format" has to be text but is {type(heatmap_format).__name__}')
+            heatmap_format = heatmap_format.lower()
+            if heatmap_format not in heatmap_formats:
+                raise InputError(f'"heatmap_format" has to be one of "{", ".join(heatmap_formats)}"')
+            print(f'Using heatmap format "{heatmap_format}"')
+
+        if 'top' in input_data:
+            top = input_data['top']
+            if not isinstance(top, int):
+                raise InputError(f'"top" has to be a number but is {type(top).__name__}')
+            if top < 0:
+                raise InputError(f'"top" has to be a positive number.')
+            print(f'Listing the {top} most crowded chunks per dimension.')
+
+    if limit_to_dimension is None:
+        world_dimensions = get_dimensions(world_folders)
+        dimensions_str = '"' + '", "'.join(world_dimensions) + '"'
+        print('\nChoose a dimension for which a heatmap should be created. Enter nothing for all dimensions.'
+              f'\nIt can be one of {dimensions_str}')
+        complete(world_dimensions, case_insensitive=True)
+        while True:
+            answer = input('Dimension: ')
+            if not answer:
+                limit_to_dimension = False
+                break
+            else:
+                answer = answer.strip().lower()
+                if not is_dimension(answer):
+                    print('Unknown dimension.')
+                    continue
+                limit_to_dimension = True
+                limit_dimension = answer
+                break
+        complete([])
+
+    if heatmap_format is None:
+        formats_str = '"' + '", "'.join(heatmap_formats) + '"'
+        print('\nChoose the format of the heatmap files. Enter nothing for "png".'
+              f'\nIt can be one of {formats_str} ("array" creates NumPy .npy files)')
+        complete(heatmap_formats, case_insensitive=True)
+        while True:
+            answer = input('Heatmap format: ').strip().lower()
+            if not answer:
+                heatmap_format = 'png'
+                break
+            if answer not in heatmap_formats:
+                print('Unknown format.')
+                continue
+            heatmap_format = answer
+            break
+        complete([])
+
+    if top is None:
+        print('\nChoose how many of the most crowded chunks should be listed per dimension. (Leave empty for 10)')
+        while True:
+            answer = input('Chunks to list: ')
+            if not answer:
+                top = 10
+                break
+            if not answer.isnumeric():
+                print('Please state a number.')
+                continue
+            top = int(answer)
+            break
+
+    output_file = Path(output_file)
+    total_start_time = time.time()
+    total_counts = dict.fromkeys(counters, 0)
+    total_not_readable_chunks = 0
+    worlds = {}
+    for world_folder in world_folders:
+        region_folders = get_region_folders(world_folder)
+        if not region_folders:
+            print(f'\nNo region folder was found in world "{world_folder}"')
+            continue
+
+        # In worlds before 1.17 the entity folders are the region folders, so both are counted in one pass.
+        tasks = {}
+        for files, file_counters in ((map_files(region_folders), ('block_entities', 'command_blocks')),
+                                     (get_entity_files(world_folder), ('entities',))):
+            for dimension, region_files in files.items():
+                if limit_to_dimension and dimension != limit_dimension:
+                    continue
+                for region_file in region_files:
+                    tasks.setdefault(dimension, {}).setdefault(region_file, set()).update(file_counters)
+        metrics.start_world(world_folder)
+
+        grids = {}
+        start_time = time.time()
+        messages = []
+        not_readable_chunks = 0
+        print(f'\nCounting entities and block entities in world "{world_folder}"...')
+        with Progress([region_file for dimension_tasks in tasks.values() for region_file in dimension_tasks]) as pbar:
+            for dimension in tasks:
+                dimension_grids = grids[dimension] = {counter: {} for counter in counters}
+                for region_file, file_counters in tasks[dimension].items():
+                    match = region_file_pattern.match(region_file.name)
+                    if not match:
+                        pbar.file_done(region_file)
+                        continue
+                    region_x, region_z = int(match.group(1)), int(match.group(2))
+
+                    with region_file.open('rb') as file:
+                        region = open_region(file, region_file)
+
+                        counts = {counter: dimension_grids[counter].setdefault((region_x, region_z),
+                                                                               array('I', bytes(4 * 32 * 32)))
+                                  for counter in file_counters}
+
+                        for coords in region.get_chunk_coords():
+                            x, z = coords['x'], coords['z']
+                            try:
+                                chunk = region.get_chunk(x, z)
+                            except ChunkDataError:
+                                not_readable_chunks += 1
+                                pbar.chunk(region, x, z)
+                                continue
+
+                            data = chunk['Level'] if 'Level' in chunk else chunk
+                            index = z * 32 + x
+
+                            if 'entities' in counts:
+                                if 'Entities' in data:
+                                    counts['entities'][index] += len(data['Entities'])
+                                elif 'block_entities' not in counts:
+                                    messages.append(f'Chunk {x} {z} (in world at {chunk.loc.x} {chunk.loc.z}) in '
+                                                    f'the region file "{region_file}" could not be read.')
+
+                            if 'block_entities' in counts:
+                                if 'block_entities' in data:
+                                    block_entities = data['block_entities']
+                                elif 'TileEntities' in data:
+                                    block_entities = data['TileEntities']
+                                else:
+                                    messages.append(f'Chunk {x} {z} (in world at {chunk.loc.x} {chunk.loc.z}) in '
+                                                    f'the region file "{region_file}" could not be read.')
+                                    pbar.chunk(region, x, z)
+                                    continue
+
+                                counts['block_entities'][index] += len(block_entities)
+                                counts['command_blocks'][index] += sum(1 for block_entity in block_entities
+                                                                       if block_entity['id'].value in
+                                                                       command_block_types)
+
+                            pbar.chunk(region, x, z)
+                    pbar.file_done(region_file)
+
+        world_counts = dict.fromkeys(counters, 0)
+        world_dimensions = {}
+        world_name = world_folder.resolve().name
+        for dimension, dimension_grids in grids.items():
+            region_coords = set(chain.from_iterable(dimension_grids[counter].keys() for counter in counters))
+            if not region_coords:
+                continue
+
+            min_region_x = min(coords[0] for coords in region_coords)
+            min_region_z = min(coords[1] for coords in region_coords)
+            width = (max(coords[0] for coords in region_coords) - min_region_x + 1) * 32
+            height = (max(coords[1] for coords in region_coords) - min_region_z + 1) * 32
+
+            heatmaps = {}
+            dimension_counts = {}
+            for counter in counters:
+                grid = dimension_grids[counter]
+                dimension_counts[counter] = sum(sum(counts) for counts in grid.values())
+                # namespaced dimensions contain characters that are not allowed in file names
+                heatmap_file = output_file.with_name(f'{output_file.stem}-{world_name}-'
+                                                     f'{dimension.replace(":", "_").replace("/", "_")}-{counter}.'
+                                                     f'{heatmap_extensions[heatmap_format]}')
+                rows = _grid_rows(grid, min_region_x, min_region_z, width, height)
+                if heatmap_format == 'png':
+                    _write_png(heatmap_file, width, height, rows,
+                               max((max(counts) for counts in grid.values()), default=0))
+                else:
+                    _write_npy(heatmap_file, width, height, rows)
+                heatmaps[counter] = str(heatmap_file)
+
+            hotspots = []
+            for region_coords_ in sorted(region_coords):
+                region_x, region_z = region_coords_
+                region_counts = {counter: dimension_grids[counter].get(region_coords_) for counter in counters}
+                for index in range(32 * 32):
+                    chunk_counts = {counter: counts[index] if counts else 0 for counter, counts in
+                                    region_counts.items()}
+                    crowd = chunk_counts['entities'] + chunk_counts['block_entities']
+                    if crowd:
+                        hotspots.append((crowd, region_x * 32 + index % 32, region_z * 32 + index // 32,
+                                         chunk_counts))
+            hotspots.sort(key=lambda hotspot: hotspot[0], reverse=True)
+
+            for counter in counters:
+                world_counts[counter] += dimension_counts[counter]
+            world_dimensions[dimension] = {
+                'counts': dimension_counts,
+                'origin': {
+                    'x': min_region_x * 32,
+                    'z': min_region_z * 32
+                },
+                'size': {
+                    'width': width,
+                    'height': height
+                },
+                'heatmaps': heatmaps,
+                'hotspots': [{
+                    'chunk': {
+                        'x': chunk_x,
+                        'z': chunk_z
+                    },
+                    'counts': chunk_counts
+                } for _, chunk_x, chunk_z, chunk_counts in hotspots[:top]]
+            }
+
+        elapsed_time = int(round((time.time() - start_time) * 1000))
+        human_readable_elapsed_time = format_time(elapsed_time)
+
+        print(f'Counted {world_counts["entities"]} entities and {world_counts["block_entities"]} block entities '
+              f'({world_counts["command_blocks"]} command blocks) in world "{world_folder}". '
+              f'(Elapsed time: {human_readable_elapsed_time})')
+
+        for message in messages:
+            print(message)
+
+        if not_readable_chunks:
+            print(f'{not_readable_chunks} chunks could not be read.')
+
+        for counter in counters:
+            total_counts[counter] += world_counts[counter]
+        total_not_readable_chunks += not_readable_chunks
+
+        worlds[str(world_folder.resolve())] = {
+            'dimensions': world_dimensions,
+            'counts': world_counts,
+            'not_readable_chunks': not_readable_chunks,
+            'elapsed_time': {
+                'raw': elapsed_time,
+                'human_readable': human_readable_elapsed_time
+            }
+        }
+
+    elapsed_time = int(round((time.time() - total_start_time) * 1000))
+    human_readable_elapsed_time = format_time(elapsed_time)
+
+    if len(world_folders) > 1:
+        print(f'\nTotal counted entities: {total_counts["entities"]}'
+              f'\nTotal counted block entities: {total_counts["block_entities"]}'
+              f'\nTotal elapsed time: {human_readable_elapsed_time}')
+
+    data = {
+        'worlds': worlds,
+        'total': {
+            'counts': total_counts,
+            'not_readable_chunks': total_not_readable_chunks,
+            'elapsed_time': {
+                'raw': elapsed_time,
+                'human_readable': human_readable_elapsed_time
+            }
+        }
+    }
+
+    with output_file.open('w') as file:
+        if output_format == 'plain':
+            file.write(f'--- MCWorldTools by Rapha149 ---'
+                       f'\n\u00B7\u00B7\u00B7 Chunk density heatmap \u00B7\u00B7\u00B7'
+                       f'\n\nTotal counted entities: {total_counts["entities"]}'
+                       f'\nTotal counted block entities: {total_counts["block_entities"]}'
+                       f'\nTotal counted command blocks: {total_counts["command_blocks"]}'
+                       f'\nTotal elapsed time: {human_readable_elapsed_time}')
+            if total_not_readable_chunks:
+                file.write(f'\nTotal not readable chunks: {total_not_readable_chunks}')
+
+            file.write(f'\n\n[ Worlds ]')
+            for world, info in worlds.items():
+                file.write(f'\n{world}'
+                           f'\n    Elapsed time: {info["elapsed_time"]["human_readable"]}')
+                if info['not_readable_chunks']:
+                    file.write(f'\n    Not readable chunks: {info["not_readable_chunks"]}')
+
+                for dimension, dimension_info in info['dimensions'].items():
+                    counts, origin, size = dimension_info['counts'], dimension_info['origin'], dimension_info['size']
+                    file.write(f'\n    {dimension.capitalize()}'
+                               f'\n        Entities: {counts["entities"]}'
+                               f'\n        Block entities: {counts["block_entities"]}'
+                               f'\n        Command blocks: {counts["command_blocks"]}'
+                               f'\n        Heatmap origin chunk: {origin["x"]} {origin["z"]}'
+                               f'\n        Heatmap size: {size["width"]}x{size["height"]} chunks'
+                               f'\n        Heatmaps:')
+                    for counter, heatmap_file in dimension_info['heatmaps'].items():
+                        file.write(f'\n            {counter.replace("_", " ").capitalize()}: {heatmap_file}')
+
+                    hotspots = dimension_info['hotspots']
+                    if hotspots:
+                        file.write('\n        Most crowded chunks:')
+                        for i in range(len(hotspots)):
+                            if i > 0:
+                                file.write('\n            ------------------')
+
+                            hotspot = hotspots[i]
+                            chunk, counts = hotspot['chunk'], hotspot['counts']
+                            file.write(f'\n            Chunk: {chunk["x"]} {chunk["z"]}'
+                                       f'\n            Entities: {counts["entities"]}'
+                                       f'\n            Block entities: {counts["block_entities"]}'
+                                       f'\n            Command blocks: {counts["command_blocks"]}')
+                file.write('\n')
+
+        else:
+            dump_data(data, file, output_format)
+
+        print(f'\nSaved output to "{output_file}"')
+
+
+def _grid_rows(grid, min_region_x, min_region_z, width, height):
+    empty = array('I', bytes(4 * 32))
+    for row in range(height):
+        region_z, z = divmod(row, 32)
+        region_z += min_region_z
+        row_counts = array('I')
+        for region_x in range(min_region_x, min_region_x + width // 32):
+            counts = grid.get((region_x, region_z))
+            row_counts.extend(counts[z * 32:z * 32 + 32] if counts else empty)
+        yield row_counts
+
+
+def _write_png(path, width, height, rows, max_count):
+    # Palette based "hot" color map on a logarithmic scale, index 0 (no entities) is black.
+    palette = bytearray()
+    for i in range(256):
+        t = i / 255 * 3
+        palette.extend((min(255, int(t * 255)), max(0, min(255, int((t - 1) * 255))),
+                        max(0, min(255, int((t - 2) * 255)))))
+    scale = 255 / math.log1p(max_count) if max_count else 0
+
+    def chunk(chunk_type, chunk_data):
+        return struct.pack('>I', len(chunk_data)) + chunk_type + chunk_data + \
+               struct.pack('>I', zlib.crc32(chunk_type + chunk_data) & 0xFFFFFFFF)
+
+    with Path(path).open('wb') as file:
+        file.write(b'\x89PNG\r\n\x1a\n')
+        file.write(chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 3, 0, 0, 0)))
+        file.write(chunk(b'PLTE', bytes(palette)))
+        compressor = zlib.compressobj()
+        compressed = bytearray()
+        for row in rows:
+            compressed += compressor.compress(b'\x00' + bytes(min(255, int(math.ceil(math.log1p(count) * scale)))
+                                                              for count in row))
+        compressed += compressor.flush()
+        file.write(chunk(b'IDAT', bytes(compressed)))
+        file.write(chunk(b'IEND', b''))
+
+
+def _write_npy(path, width, height, rows):
+    header = f"{{'descr': '<u4', 'fortran_order': False, 'shape': ({height}, {width}), }}"
+    header += ' ' * (63 - (10 + len(header)) % 64) + '\n'
+    with Path(path).open('wb') as file:
+        file.write(b'\x93NUMPY\x01\x00' + struct.pack('<H', len(header)) + header.encode('latin1'))
+        for row in rows:
+            if sys.byteorder != 'little':
+                row.byteswap()
+            row.tofile(file)
@@ -1,22 +1,97 @@
-import json
+import random
 import re
 
-import yaml
 from nbt.region import *
-from tqdm import tqdm
 
+from .. import metrics
+from ..sampling import *
 from ..util import *
 
 
 def start(world_folders, output_file, output_format, input_data, confirm):
-    inhabited_time = None
-    if input_data and 'inhabited_time' in input_data:
+    inhabited_time, keep_block_entities, keep_blocks, spawn_radius, remove_incomplete = None, None, None, None, None
+    protected_areas, trim, sample = None, None, None
+    if input_data:
         print('\nLoading input file data...')
-        inhabited_time = input_data['inhabited_time']
-        if not isinstance(inhabited_time, int):
-            eprint(f'"inhabited_time" has to be a number but is {type(inhabited_time).__name__}.')
-            exit(3)
-        print(f'Using {inhabited_time} seconds as inhabited time.')
+        if 'inhabited_time' in input_data:
+            inhabited_time = input_data['inhabited_time']
+            if not isinstance(inhabited_time, int):
+                raise InputError(f'"inhabited_time" has to be a number but is {type(inhabited_time).__name__}.')
+            print(f'Using {inhabited_time} seconds as inhabited time.')
+
+        if 'keep_block_entities' in input_data:
+            keep_block_entities = input_data['keep_block_entities']
+            if not isinstance(keep_block_entities, bool):
+                raise InputError(f'"keep_block_entities" has to be a boolean but is '
+                                 f'{type(keep_block_entities).__name__}.')
+            print('Keeping chunks with block entities.' if keep_block_entities else
+                  'Not keeping chunks with block entities.')
+        else:
+            # criteria that are missing in the input file are disabled, so that older input files run unattended
+            keep_block_entities = False
+
+        if 'keep_blocks' in input_data:
+            keep_blocks = input_data['keep_blocks']
+            if keep_blocks is None:
+                keep_blocks = []
+            if not isinstance(keep_blocks, list):
+                raise InputError(f'"keep_blocks" has to be a list but is {type(keep_blocks).__name__}.')
+            for i in range(len(keep_blocks)):
+                if not isinstance(keep_blocks[i], str):
+                    raise InputError(f'{i + 1}. item in "keep_blocks" has to be text but is '
+                                     f'{type(keep_blocks[i]).__name__}.')
+            print(f'Keeping chunks containing {len(keep_blocks)} blocks.' if keep_blocks else
+                  'Not keeping chunks because of their blocks.')
+        else:
+            keep_blocks = []
+
+        if 'spawn_radius' in input_data:
+            spawn_radius = input_data['spawn_radius']
+            if not isinstance(spawn_radius, int):
+                raise InputError(f'"spawn_radius" has to be a number but is {type(spawn_radius).__name__}.')
+            if spawn_radius < 0:
+                raise InputError('"spawn_radius" has to be a positive number.')
+            print(f'Keeping chunks within {spawn_radius} blocks around the spawn.')
+        else:
+            spawn_radius = 0
+
+        if 'remove_incomplete' in input_data:
+            remove_incomplete = input_data['remove_incomplete']
+            if not isinstance(remove_incomplete, bool):
+                raise InputError(f'"remove_incomplete" has to be a boolean but is '
+                                 f'{type(remove_incomplete).__name__}.')
+            print('Removing chunks that are not fully generated.' if remove_incomplete else
+                  'Not removing chunks because of their generation status.')
+        else:
+            remove_incomplete = False
+
+        if 'trim' in input_data:
+            trim = input_data['trim']
+            if not isinstance(trim, bool):
+                raise InputError(f'"trim" has to be a boolean but is {type(trim).__name__}.')
+            print('Trimming the kept chunks.' if trim else 'Not trimming the kept chunks.')
+        else:
+            trim = False
+
+        if 'protected_areas' in input_data:
+            areas = input_data['protected_areas']
+            if areas is None:
+                areas = []
+            if not isinstance(areas, list):
+                raise InputError(f'"protected_areas" has to be a list but is {type(areas).__name__}.')
+            protected_areas = ProtectedAreas()
+            for i in range(len(areas)):
+                protected_areas.add(areas[i], i + 1)
+            print(f'Using {len(areas)} protected areas.')
+        else:
+            protected_areas = ProtectedAreas()
+
+        if 'sample' in input_data:
+            sample = input_data['sample']
+            if sample is not None and (not isinstance(sample, int) or sample <= 0):
+                raise InputError(f'"sample" has to be a positive number.')
+            if sample:
+                print(f'Estimating the results from a sample of {sample} chunks per world without removing chunks.')
 
     if inhabited_time is None:
         print(
@@ -34,10 +109,83 @@ def start(world_folders, output_file, output_format, input_data, confirm):
                     print('Please state a positive number.')
             else:
                 print('Please state a number.')
-    inhabited_time = inhabited_time * 20 if inhabited_time else 0
+    inhabited_time = inhabited_time or 0
+
+    if keep_block_entities is None:
+        print('\nDo you want to keep chunks containing block entities? (e.g. chests, furnaces or signs)')
+        while keep_block_entities is None:
+            keep_block_entities = parse_yes_no(input('Keep chunks with block entities? (y/N): '), default=False)
+
+    if keep_blocks is None:
+        print('\nChoose blocks that chunks containing them should be kept for (e.g. "oak_planks" or "torch").'
+              ' Enter nothing once your finished.'
+              '\nYou don\'t have to prepend them with "minecraft:". Only supported in 1.13+')
+        keep_blocks = []
+        while True:
+            answer = input(f'{len(keep_blocks) + 1}. Block id: ').strip()
+            if not answer:
+                break
+            keep_blocks.append(answer)
+
+    if spawn_radius is None:
+        print('\nSelect the radius around the spawn in blocks in which chunks should always be kept. '
+              '(Leave empty for 0)')
+        while True:
+            answer = input('Spawn radius: ')
+            if not answer:
+                spawn_radius = 0
+                break
+
+            if answer.isnumeric():
+                spawn_radius = int(answer)
+                break
+            else:
+                print('Please state a positive number.')
+
+    if remove_incomplete is None:
+        print('\nDo you want to remove chunks that are not fully generated regardless of the other criteria?'
+              '\nThey do not contain any changes by players and are generated again when needed.')
+        while remove_incomplete is None:
+            remove_incomplete = parse_yes_no(input('Remove not fully generated chunks? (y/N): '), default=False)
+
+    if trim is None:
+        print('\nDo you want to trim the kept chunks? Data that the game generates again (heightmaps, lighting and '
+              'sections containing only air) is removed from them and chunks that are not fully generated are removed.'
+              '\nOnly supported in 1.14+')
+        while trim is None:
+            trim = parse_yes_no(input('Trim the kept chunks? (y/N): '), default=False)
+
+    if protected_areas is None:
+        print('\nChoose areas in which chunks should always be kept. Enter nothing once your finished.'
+              '\nState each area as two corners in block coordinates: "x1 z1 x2 z2", optionally followed by the '
+              'dimension (defaults to "overworld").')
+        protected_areas = ProtectedAreas()
+        i = 1
+        while True:
+            answer = input(f'{i}. Protected area: ').split()
+            if not answer:
+                break
+
+            if len(answer) not in (4, 5) or not all(re.fullmatch(r'-?\d+', value) for value in answer[:4]):
+                print('Please state four numbers and optionally a dimension.')
+                continue
+            try:
+                protected_areas.add({'from': [int(answer[0]), int(answer[1])], 'to': [int(answer[2]), int(answer[3])],
+                                     'dimension': answer[4] if len(answer) > 4 else 'overworld'}, i)
+            except InputError as e:
+                print(e)
+                continue
+            i += 1
+
+    criteria = compile_criteria(inhabited_time, keep_block_entities, keep_blocks, remove_incomplete or trim)
+
+    if sample:
+        estimate_removal(world_folders, output_file, output_format, criteria, protected_areas, spawn_radius, sample)
+        return
 
     if not confirm:
-        print('\nWarning: This operation will remove all chunks in which no player was present for the given time.'
+        print('\nWarning: This operation will remove all chunks in which no player was present for the given time '
+              'and which are not kept by one of the other selected criteria.'
               '\nTherefore, chunks with changed blocks may be removed since players can change blocks even if they '
               'are not in the chunk.'
               '\nIt is recommended to make a backup of your world beforehand.'
@@ -50,7 +198,9 @@ def start(world_folders, output_file, output_format, input_data, confirm):
                 break
 
     total_start_time = time.time()
-    total_removed, total_chunks, total_not_readable_chunks, total_freed_space = 0, 0, 0, 0
+    total_removed, total_trimmed, total_chunks, total_not_readable_chunks, total_freed_space = 0, 0, 0, 0, 0
+    total_skipped_files = 0
+    total_kept = {}
     worlds = {}
     for world_folder in world_folders:
         region_folders = get_region_folders(world_folder)
@@ -60,41 +210,57 @@ def start(world_folders, output_file, output_format, input_data, confirm):
 
         files = map_files(region_folders)
         all_files = get_all_files(files)
-        file_count = len(all_files)
         size = get_size(all_files)
+        metrics.start_world(world_folder)
+
+        spawn_area = get_spawn_area(world_folder, spawn_radius) if spawn_radius else None
 
-        count, total, not_readable_chunks = 0, 0, 0
+        count, trimmed, total, not_readable_chunks, skipped_files = 0, 0, 0, 0, 0
+        kept = dict.fromkeys((['protected'] if protected_areas else []) + (['spawn'] if spawn_area else []) +
+                             [name for name, check in criteria if name != 'incomplete'], 0)
         start_time = time.time()
         messages = []
         print(f'\nRemoving unused chunks of world "{world_folder}"...')
-        with tqdm(total=file_count * 32 * 32 * 2 if file_count > 0 else 1,
-                  unit_scale=1 / 32 / 32 / 2,
-                  bar_format='{percentage:.2f}% |{bar}| [{n:.0f}/{total:.0f} files]  ') as pbar:
-
-            if file_count <= 0:
-                pbar.update(1)
-
+        # every chunk is counted once when it is read and once when it is removed or kept
+        with Progress(all_files, passes=2) as pbar:
             for dimension, region_files in files.items():
                 for region_file in region_files:
-                    with region_file.open('r+b') as file:
-                        region = RegionFile(fileobj=file)
-                        match = re.match('r\\.(-?\\d+)\\.(-?\\d+)\\.mca', region_file.name)
-                        if match:
-                            region.loc = Location(x=int(match.group(1)), z=int(match.group(2)))
+                    match = region_file_pattern.match(region_file.name)
+                    if match and protected_areas.is_region_protected(dimension, int(match.group(1)),
+                                                                     int(match.group(2))):
+                        skipped_files += 1
+                        pbar.file_done(region_file)
+                        continue
 
+                    with region_file.open('r+b') as file:
+                        region = open_region(file, region_file)
+                        protected = protected_areas.get_region(dimension, region.loc.x, region.loc.z)
                         chunk_count = region.chunk_count()
 
                         total += chunk_count
-                        pbar.update(32 * 32 * 2 - chunk_count * 2)
 
                         delete = []
+                        file_trimmed = 0
                         for coords in region.get_chunk_coords():
                             x, z, = coords['x'], coords['z']
+                            if protected >> (z * 32 + x) & 1:
+                                kept['protected'] += 1
+                                metrics.count(chunks_skipped=1)
+                                pbar.chunk(region, x, z, 2)
+                                continue
+
+                            if dimension == 'overworld' and spawn_area and \
+                                    spawn_area(region.loc.x * 32 + x, region.loc.z * 32 + z):
+                                kept['spawn'] += 1
+                                metrics.count(chunks_skipped=1)
+                                pbar.chunk(region, x, z, 2)
+                                continue
+
                             try:
                                 chunk = region.get_chunk(x, z)
                             except (ChunkDataError, UnicodeDecodeError):
                                 not_readable_chunks += 1
-                                pbar.update(2)
+                                pbar.chunk(region, x, z, 2)
                                 continue
 
                             data = chunk['Level'] if 'Level' in chunk else chunk
@@ -105,22 +271,31 @@ def start(world_folders, output_file, output_format, input_data, confirm):
                                     f'{region_file}" could not be read.')
                                 continue
 
-                            if data['InhabitedTime'].value <= inhabited_time:
+                            reason = check_chunk(data, criteria)
+                            if reason is None:
                                 delete.append((x, z))
-                                pbar.update()
+                                pbar.chunk(region, x, z)
                             else:
-                                pbar.update(2)
+                                kept[reason] += 1
+                                pbar.chunk(region, x, z, 2)
+                                # the kept chunk is trimmed while it is decoded anyway
+                                if trim and trim_chunk(chunk):
+                                    region.write_chunk(x, z, chunk)
+                                    file_trimmed += 1
 
                         delete_count = len(delete)
                         if delete_count < chunk_count:
                             for chunk in delete:
+                                pbar.chunk(region, chunk[0], chunk[1])
                                 region.unlink_chunk(chunk[0], chunk[1])
-                                pbar.update()
+                            if trim and (delete_count or file_trimmed):
+                                region.compact()
+                        trimmed += file_trimmed
 
                     count += delete_count
                     if delete_count >= chunk_count:
                         region_file.unlink()
-                        pbar.update(delete_count)
+                    pbar.file_done(region_file)
 
         elapsed_time = int(round((time.time() - start_time) * 1000))
         human_readable_elapsed_time = format_time(elapsed_time)
@@ -140,18 +315,34 @@ def start(world_folders, output_file, output_format, input_data, confirm):
         if not_readable_chunks:
             print(f'{not_readable_chunks} chunks could not be read.')
 
+        if skipped_files:
+            print(f'Skipped {skipped_files} fully protected region files.')
+
+        if trim:
+            print(f'Trimmed {trimmed} kept chunks.')
+
+        print('Kept chunks by criterion: ' + ', '.join(f'{reason}: {kept_count}'
+                                                       for reason, kept_count in kept.items()))
+
         total_removed += count
+        total_trimmed += trimmed
         total_chunks += total
         total_not_readable_chunks += not_readable_chunks
+        total_skipped_files += skipped_files
         total_freed_space += raw_freed_space
+        for reason, kept_count in kept.items():
+            total_kept[reason] = total_kept.get(reason, 0) + kept_count
 
         if output_file:
             worlds[str(world_folder.resolve())] = {
                 'chunks': {
                     'removed': count,
+                    'trimmed': trimmed,
                     'total': total,
-                    'not_readable': not_readable_chunks
+                    'not_readable': not_readable_chunks,
+                    'kept': kept
                 },
+                'skipped_region_files': skipped_files,
                 'elapsed_time': {
                     'raw': elapsed_time,
                     'human_readable': human_readable_elapsed_time
@@ -177,9 +368,12 @@ def start(world_folders, output_file, output_format, input_data, confirm):
             'total': {
                 'chunks': {
                     'removed': total_removed,
+                    'trimmed': total_trimmed,
                     'total': total_chunks,
-                    'not_readable': total_not_readable_chunks
+                    'not_readable': total_not_readable_chunks,
+                    'kept': total_kept
                 },
+                'skipped_region_files': total_skipped_files,
                 'elapsed_time': {
                     'raw': elapsed_time,
                     'human_readable': human_readable_elapsed_time
@@ -198,26 +392,414 @@ def start(world_folders, output_file, output_format, input_data, confirm):
                            f'\n\nTotal elapsed time: {human_readable_elapsed_time}'
                            f'\nTotal freed space: {human_readable_freed_space}'
                            f'\nChunks'
-                           f'\n    Removed: {total_removed}'
-                           f'\n    Total: {total_chunks}')
+                           f'\n    Removed: {total_removed}')
+                if trim:
+                    file.write(f'\n    Trimmed: {total_trimmed}')
+                file.write(f'\n    Total: {total_chunks}')
                 if total_not_readable_chunks:
                     file.write(f'\n    Not readable: {total_not_readable_chunks}')
+                file.write(f'\n    Kept')
+                for reason, kept_count in total_kept.items():
+                    file.write(f'\n        {reason}: {kept_count}')
+                if total_skipped_files:
+                    file.write(f'\nSkipped region files: {total_skipped_files}')
 
                 file.write(f'\n\n[ Worlds ]')
                 for world, info in worlds.items():
                     file.write(f'\n{world}'
                                f'\n    Chunks'
-                               f'\n        Removed: {info["chunks"]["removed"]}'
-                               f'\n        Total: {info["chunks"]["total"]}')
+                               f'\n        Removed: {info["chunks"]["removed"]}')
+                    if trim:
+                        file.write(f'\n        Trimmed: {info["chunks"]["trimmed"]}')
+                    file.write(f'\n        Total: {info["chunks"]["total"]}')
                     if info['chunks']['not_readable']:
                         file.write(f'\n        Not readable: {info["chunks"]["not_readable"]}')
+                    file.write(f'\n        Kept')
+                    for reason, kept_count in info['chunks']['kept'].items():
+                        file.write(f'\n            {reason}: {kept_count}')
+                    if info['skipped_region_files']:
+                        file.write(f'\n    Skipped region files: {info["skipped_region_files"]}')
                     file.write(f'\n    Elapsed time: {info["elapsed_time"]["human_readable"]}'
                                f'\n    Freed space: {info["freed_space"]["human_readable"]}'
                                f'\n')
 
-            elif output_format == 'json':
-                json.dump(data, file, indent=3)
-            elif output_format == 'yaml':
-                yaml.dump(data, file, indent=3)
+            else:
+                dump_data(data, file, output_format)
+
+            print(f'\nSaved output to "{output_file}"')
+
+
+def estimate_removal(world_folders, output_file, output_format, criteria, protected_areas, spawn_radius, sample):
+    total_start_time = time.time()
+    total_estimator = Estimator()
+    total_chunks, total_sampled = 0, 0
+    worlds = {}
+    for world_folder in world_folders:
+        if not get_region_folders(world_folder):
+            print(f'\nNo region folder was found in world "{world_folder}"')
+            continue
+
+        start_time = time.time()
+        print(f'\nEstimating the unused chunks of world "{world_folder}" from a sample of {sample} chunks...')
+        spawn_area = get_spawn_area(world_folder, spawn_radius) if spawn_radius else None
+        result, estimator = estimate(world_folder, criteria, protected_areas, spawn_area, sample)
+        chunks = result['chunks']
+
+        elapsed_time = int(round((time.time() - start_time) * 1000))
+        human_readable_elapsed_time = format_time(elapsed_time)
+        result['elapsed_time'] = {
+            'raw': elapsed_time,
+            'human_readable': human_readable_elapsed_time
+        }
+
+        share = chunks['removed']['estimate'] / chunks['total'] * 100 if chunks['total'] else 0
+        print(f'Read {chunks["sampled"]} of {chunks["total"]} chunks of world "{world_folder}". '
+              f'(Elapsed time: {human_readable_elapsed_time})')
+        print(f'Estimated removed chunks: {format_estimate(chunks["removed"])} ({share:0.2f}%)'
+              f'\nEstimated space of the removed chunks: {result["removed_space"]["human_readable"]}'
+              f'\nEstimated kept chunks by criterion: ' +
+              ', '.join(f'{reason}: {format_estimate(kept)}' for reason, kept in chunks['kept'].items()) +
+              f'\nEstimated time of a full run: {result["estimated_time"]["human_readable"]}')
+        if chunks['not_readable_sampled']:
+            print(f'{chunks["not_readable_sampled"]} sampled chunks could not be read.')
+
+        total_estimator.add(estimator)
+        total_chunks += chunks['total']
+        total_sampled += chunks['sampled']
+        worlds[str(world_folder.resolve())] = result
+
+    elapsed_time = int(round((time.time() - total_start_time) * 1000))
+    human_readable_elapsed_time = format_time(elapsed_time)
+    removed, removed_space = total_estimator.get('removed'), _space_estimate(total_estimator.get('removed_space'))
+
+    if len(world_folders) > 1:
+        print(f'\nTotal estimated removed chunks: {format_estimate(removed)}'
+              f'\nTotal estimated space of the removed chunks: {removed_space["human_readable"]}'
+              f'\nTotal elapsed time: {human_readable_elapsed_time}')
+
+    if output_file:
+        data = {
+            'worlds': worlds,
+            'total': {
+                'chunks': {
+                    'total': total_chunks,
+                    'sampled': total_sampled,
+                    'removed': removed
+                },
+                'removed_space': removed_space,
+                'elapsed_time': {
+                    'raw': elapsed_time,
+                    'human_readable': human_readable_elapsed_time
+                }
+            }
+        }
+
+        with Path(output_file).open('w') as file:
+            if output_format == 'plain':
+                file.write(f'--- MCWorldTools by Rapha149 ---'
+                           f'\n\u00B7\u00B7\u00B7 Remove unused chunks (estimate) \u00B7\u00B7\u00B7'
+                           f'\n\nEstimates with 95% confidence intervals.'
+                           f'\n\nTotal elapsed time: {human_readable_elapsed_time}'
+                           f'\nTotal estimated space of the removed chunks: {removed_space["human_readable"]}'
+                           f'\nChunks'
+                           f'\n    Estimated removed: {format_estimate(removed)}'
+                           f'\n    Total: {total_chunks}'
+                           f'\n    Sampled: {total_sampled}')
+
+                file.write(f'\n\n[ Worlds ]')
+                for world, info in worlds.items():
+                    chunks = info['chunks']
+                    file.write(f'\n{world}'
+                               f'\n    Chunks'
+                               f'\n        Estimated removed: {format_estimate(chunks["removed"])}'
+                               f'\n        Total: {chunks["total"]}'
+                               f'\n        Sampled: {chunks["sampled"]}')
+                    if chunks['not_readable_sampled']:
+                        file.write(f'\n        Not readable sampled: {chunks["not_readable_sampled"]}')
+                    file.write(f'\n        Estimated kept')
+                    for reason in ('protected', 'spawn'):
+                        if reason in chunks:
+                            file.write(f'\n            {reason}: {chunks[reason]}')
+                    for reason, kept in chunks['kept'].items():
+                        file.write(f'\n            {reason}: {format_estimate(kept)}')
+                    file.write(f'\n    Elapsed time: {info["elapsed_time"]["human_readable"]}'
+                               f'\n    Estimated space of the removed chunks: {info["removed_space"]["human_readable"]}'
+                               f'\n    Estimated time of a full run: {info["estimated_time"]["human_readable"]}'
+                               f'\n')
+
+            else:
+                dump_data(data, file, output_format)
 
             print(f'\nSaved output to "{output_file}"')
+
+
+def estimate(world_folder, criteria, protected_areas=None, spawn_area=None, sample=1000, rng=random):
+    """Estimate how many chunks of a world would be removed and kept by each criterion and how much space the removed
+    chunks take from a stratified random sample of about ``sample`` chunks without changing the world. Chunks in
+    protected areas and the spawn area are counted exactly without reading them.
+
+    Returns the results like in the output file and the Estimator, e.g. to combine the estimates of multiple worlds."""
+    files = map_files(get_region_folders(world_folder))
+    kept_exactly = dict.fromkeys((['protected'] if protected_areas else []) + (['spawn'] if spawn_area else []), 0)
+    total, strata = 0, []
+    for dimension, region_files in files.items():
+        for region_file in region_files:
+            match = region_file_pattern.match(region_file.name)
+            region_x, region_z = (int(match.group(1)), int(match.group(2))) if match else (0, 0)
+            protected = protected_areas.get_region(dimension, region_x, region_z) if protected_areas and match else 0
+            slots = []
+            for x, z, sectors in get_chunk_slots(region_file):
+                total += 1
+                if protected >> (z * 32 + x) & 1:
+                    kept_exactly['protected'] += 1
+                elif dimension == 'overworld' and spawn_area and match and \
+                        spawn_area(region_x * 32 + x, region_z * 32 + z):
+                    kept_exactly['spawn'] += 1
+                else:
+                    slots.append((x, z, sectors))
+            if slots:
+                strata.append((region_file, slots))
+
+    estimator = Estimator()
+    not_readable = 0
+    start_time = time.time()
+    sampled_strata = []
+    for (region_file, slots), count in zip(strata, allocate_sample([len(slots) for _, slots in strata], sample, rng)):
+        if not count:
+            sampled_strata.append((len(slots), None))
+            continue
+        samples = []
+        with region_file.open('rb') as file:
+            region = open_region(file, region_file)
+            for x, z, sectors in draw(slots, count, rng):
+                try:
+                    chunk = region.get_chunk(x, z)
+                except (ChunkDataError, UnicodeDecodeError):
+                    not_readable += 1
+                    continue
+
+                data = chunk['Level'] if 'Level' in chunk else chunk
+                # chunks without inhabited time are neither removed nor kept by a criterion
+                reason = check_chunk(data, criteria) if 'InhabitedTime' in data else ''
+                samples.append({'removed': 1, 'removed_space': sectors * SECTOR_LENGTH} if reason is None else
+                               {reason: 1} if reason else {})
+        sampled_strata.append((len(slots), samples))
+    estimator.add_strata(sampled_strata)
+    read_time = time.time() - start_time
+
+    # the time per read chunk of the sample applies to a full run as well
+    estimated_time = int(round(read_time / estimator.sampled * estimator.population * 1000)) \
+        if estimator.sampled else 0
+    chunks = {
+        'total': total,
+        'sampled': estimator.sampled,
+        'not_readable_sampled': not_readable
+    }
+    chunks.update(kept_exactly)
+    chunks['removed'] = estimator.get('removed')
+    chunks['kept'] = {name: estimator.get(name) for name, check in criteria if name != 'incomplete'}
+    return {
+        'chunks': chunks,
+        'removed_space': _space_estimate(estimator.get('removed_space')),
+        'estimated_time': {
+            'raw': estimated_time,
+            'human_readable': format_time(estimated_time)
+        }
+    }, estimator
+
+
+def _space_estimate(estimate):
+    def format_space(raw_space):
+        space, space_unit = format_freed_space(raw_space)
+        return f'{space:.2f}{space_unit}'
+
+    return dict(estimate, human_readable=format_estimate(estimate, format_space))
+
+
+# generation statuses of chunks that are fully generated, chunks without status are treated as fully generated
+full_statuses = {'full', 'minecraft:full', 'fullchunk', 'postprocessed'}
+
+
+# blocks that sections may only contain to be removed when trimming chunks
+air_ids = {'minecraft:air', 'minecraft:cave_air', 'minecraft:void_air'}
+# the first DataVersion (1.14) in which the game calculates the light and the heightmaps of loaded chunks again if they
+# are missing
+trim_data_version = 1952
+
+
+def compile_criteria(inhabited_time=0, keep_block_entities=False, keep_blocks=None, remove_incomplete=False):
+    """Compile the selected criteria into a list of (name, check) tuples, ordered from the cheapest to the most
+    expensive check so that ``check_chunk`` can stop at the first deciding one.
+
+    Every check takes the chunk data and returns True if the chunk has to be kept, False if it has to be removed
+    regardless of the following checks and None if it does not decide."""
+    criteria = []
+    if remove_incomplete:
+        criteria.append(('incomplete', lambda data: False if 'Status' in data and
+                                                             data['Status'].value not in full_statuses else None))
+
+    inhabited_ticks = inhabited_time * 20
+    criteria.append(('inhabited_time', lambda data: True if data['InhabitedTime'].value > inhabited_ticks else None))
+
+    if keep_block_entities:
+        criteria.append(('block_entities', _has_block_entities))
+
+    if keep_blocks:
+        block_ids = set('minecraft:' + strip_id(block_id.strip().lower()) for block_id in keep_blocks)
+        criteria.append(('blocks', lambda data: _has_blocks(data, block_ids)))
+    return criteria
+
+
+def check_chunk(data, criteria):
+    """Returns the name of the criterion the chunk is kept for or None if it can be removed."""
+    for name, check in criteria:
+        result = check(data)
+        if result is not None:
+            return name if result else None
+    return None
+
+
+def _has_block_entities(data):
+    for key in ('block_entities', 'TileEntities'):
+        if key in data and len(data[key]) > 0:
+            return True
+    return None
+
+
+def _has_blocks(data, block_ids):
+    # only the palettes are checked, so chunks older than 1.13 without palettes are never kept for their blocks
+    sections = data['sections'] if 'sections' in data else data['Sections'] if 'Sections' in data else []
+    for section in sections:
+        if 'block_states' in section:
+            if 'palette' not in section['block_states']:
+                continue
+            palette = section['block_states']['palette']
+        elif 'Palette' in section:
+            palette = section['Palette']
+        else:
+            continue
+
+        for block in palette:
+            if block['Name'].value in block_ids:
+                return True
+    return None
+
+
+class ProtectedAreas:
+    """A grid hash of protected chunks keyed by dimension and region.
+
+    Every region is mapped to a bit mask of its 32 x 32 chunks, so checking a chunk takes constant time no matter how
+    many areas are protected. Areas are either rectangles in block coordinates ({"from": [x, z], "to": [x, z]}) or
+    lists of chunk coordinates ({"chunks": [[x, z], ...]}), optionally with a "dimension" (defaults to "overworld").
+    """
+
+    full_region = (1 << 32 * 32) - 1
+
+    def __init__(self):
+        self.regions = {}
+
+    def __bool__(self):
+        return bool(self.regions)
+
+    def add(self, area, number=1):
+        if not isinstance(area, dict):
+            raise InputError(f'{number}. protected area has to be an object but is {type(area).__name__}.')
+        dimension = check_dimension(area.get('dimension', 'overworld'))
+        if 'chunks' in area:
+            chunks = area['chunks']
+            if not isinstance(chunks, list) or not all(self._is_coordinates(chunk) for chunk in chunks):
+                raise InputError(f'"chunks" of the {number}. protected area has to be a list of chunk coordinates.')
+            for chunk_x, chunk_z in chunks:
+                key = dimension, chunk_x >> 5, chunk_z >> 5
+                self.regions[key] = self.regions.get(key, 0) | 1 << ((chunk_z & 31) * 32 + (chunk_x & 31))
+            return
+
+        if not self._is_coordinates(area.get('from')) or not self._is_coordinates(area.get('to')):
+            raise InputError(f'The {number}. protected area needs either "chunks" or "from" and "to" as block '
+                             f'coordinates.')
+        # block coordinates to chunk coordinates
+        x1, x2 = sorted((area['from'][0] >> 4, area['to'][0] >> 4))
+        z1, z2 = sorted((area['from'][1] >> 4, area['to'][1] >> 4))
+        for region_x in range(x1 >> 5, (x2 >> 5) + 1):
+            from_x, to_x = max(x1 - region_x * 32, 0), min(x2 - region_x * 32, 31)
+            row = ((1 << (to_x - from_x + 1)) - 1) << from_x
+            for region_z in range(z1 >> 5, (z2 >> 5) + 1):
+                from_z, to_z = max(z1 - region_z * 32, 0), min(z2 - region_z * 32, 31)
+                if row == 0xFFFFFFFF and from_z == 0 and to_z == 31:
+                    mask = self.full_region
+                else:
+                    mask = 0
+                    for z in range(from_z, to_z + 1):
+                        mask |= row << (z * 32)
+                key = dimension, region_x, region_z
+                self.regions[key] = self.regions.get(key, 0) | mask
+
+    def get_region(self, dimension, region_x, region_z):
+        """Returns the bit mask of the protected chunks of a region. The bit of a chunk is at z * 32 + x."""
+        return self.regions.get((dimension, region_x, region_z), 0)
+
+    def is_region_protected(self, dimension, region_x, region_z):
+        return self.regions.get((dimension, region_x, region_z), 0) == self.full_region
+
+    @staticmethod
+    def _is_coordinates(value):
+        return isinstance(value, list) and len(value) == 2 and all(isinstance(i, int) for i in value)
+
+
+def get_spawn_area(world_folder, radius):
+    """Returns a function that takes the world coordinates of an overworld chunk and returns whether any part of it is
+    within the given radius in blocks around the world spawn."""
+    with Path(world_folder, 'level.dat').open('rb') as file:
+        data = NBTFile(fileobj=file)['Data']
+    spawn_x = data['SpawnX'].value if 'SpawnX' in data else 0
+    spawn_z = data['SpawnZ'].value if 'SpawnZ' in data else 0
+    radius_squared = radius * radius
+
+    def in_spawn_area(chunk_x, chunk_z):
+        distance_x = max(chunk_x * 16 - spawn_x, 0, spawn_x - chunk_x * 16 - 15)
+        distance_z = max(chunk_z * 16 - spawn_z, 0, spawn_z - chunk_z * 16 - 15)
+        return distance_x * distance_x + distance_z * distance_z <= radius_squared
+
+    return in_spawn_area
+
+
+def trim_chunk(chunk):
+    """Remove the data of a chunk that the game generates again when the chunk is loaded: the heightmaps, the lighting
+    and the sections that only contain air. Returns whether anything was removed.
+
+    Chunks before 1.14 are not changed. Since 1.18 sections contain the biomes as well, so sections with only air are
+    kept and only lose their lighting."""
+    if 'DataVersion' not in chunk or chunk['DataVersion'].value < trim_data_version:
+        return False
+    data = chunk['Level'] if 'Level' in chunk else chunk
+    changed = False
+    if 'Heightmaps' in data:
+        del data['Heightmaps']
+        changed = True
+
+    sections = data['sections'] if 'sections' in data else data['Sections'] if 'Sections' in data else []
+    for i in reversed(range(len(sections))):
+        section = sections[i]
+        if 'biomes' not in section and _is_air(section):
+            del sections[i]
+            changed = True
+            continue
+        for key in ('BlockLight', 'SkyLight'):
+            if key in section:
+                del section[key]
+                changed = True
+
+    # the light of the chunk is calculated again
+    if 'isLightOn' in data and data['isLightOn'].value:
+        data['isLightOn'].value = 0
+        changed = True
+    return changed
+
+
+def _is_air(section):
+    if 'block_states' in section:
+        palette = section['block_states']['palette'] if 'palette' in section['block_states'] else []
+    else:
+        # sections without blocks only contain lighting
+        palette = section['Palette'] if 'Palette' in section else []
+    return all(block['Name'].value in air_ids for block in palette)
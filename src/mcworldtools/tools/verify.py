@@ -0,0 +1,393 @@
+import os
+import signal
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from io import BytesIO
+
+from nbt.region import *
+
+from .. import metrics
+from ..util import *
+
+repair_modes = ['remove', 'salvage']
+header_problems = {
+    STATUS_CHUNK_ZERO_LENGTH: 'zero_length',
+    STATUS_CHUNK_IN_HEADER: 'in_header',
+    STATUS_CHUNK_OUT_OF_FILE: 'out_of_file',
+    STATUS_CHUNK_OVERLAPPING: 'overlapping',
+    STATUS_CHUNK_MISMATCHED_LENGTHS: 'mismatched_lengths'
+}
+
+
+def start(world_folders, output_file, output_format, input_data, confirm):
+    repair, backup_folder, processes = None, None, None
+    if input_data:
+        print('\nLoading input file data...')
+        if 'repair' in input_data:
+            repair = input_data['repair']
+            if repair is None:
+                repair = False
+                print('Not repairing chunks.')
+            else:
+                if not isinstance(repair, str):
+                    raise InputError(f'"repair" has to be text but is {type(repair).__name__}')
+                repair = repair.lower()
+                if repair not in repair_modes:
+                    raise InputError(f'"repair" has to be one of "{", ".join(repair_modes)}"')
+                print(f'Using repair mode "{repair}"')
+
+        if 'backup' in input_data:
+            backup_folder = input_data['backup']
+            if not isinstance(backup_folder, str):
+                raise InputError(f'"backup" has to be text but is {type(backup_folder).__name__}')
+            backup_folder = Path(backup_folder)
+            if not Path(backup_folder, 'level.dat').is_file():
+                raise InputError(f'"{backup_folder}" is not a world folder.')
+            print(f'Using backup world "{backup_folder}"')
+
+        if 'processes' in input_data:
+            processes = input_data['processes']
+            if processes is not None and (not isinstance(processes, int) or processes <= 0):
+                raise InputError(f'"processes" has to be a positive number.')
+
+    if repair is None:
+        print('\nChoose what to do with bad chunks, i.e. chunks that can\'t be read or are saved at the wrong place.'
+              ' Enter nothing to only verify the chunks.'
+              '\n"remove" removes them from their region files, "salvage" replaces them with the same chunks from '
+              'a backup world.')
+        complete(repair_modes, case_insensitive=True)
+        while True:
+            answer = input('Repair mode: ').strip().lower()
+            if not answer:
+                repair = False
+                break
+            if answer not in repair_modes:
+                print('Unknown repair mode.')
+                continue
+            repair = answer
+            break
+        complete([])
+
+    if repair == 'salvage' and backup_folder is None:
+        print('\nState the folder of the backup world to salvage chunks from.')
+        while True:
+            answer = input('Backup world: ').strip()
+            if not Path(answer, 'level.dat').is_file():
+                print('This is not a world folder.')
+                continue
+            backup_folder = Path(answer)
+            break
+
+    processes = processes or os.cpu_count() or 1
+
+    if repair and not confirm:
+        print('\nWarning: This operation will ' + ('remove all bad chunks from their region files.'
+                                                  if repair == 'remove' else
+                                                  'replace all bad chunks with the chunks of the '
+                                                  'backup world.') +
+              '\nIt is recommended to make a backup of your world beforehand.'
+              '\nNo further confirmation requests will be made before chunks are changed.')
+        while True:
+            answer = parse_yes_no(input('Do you want to continue? (y/N): '), default=False)
+            if answer is not None:
+                if not answer:
+                    exit()
+                break
+
+    total_start_time = time.time()
+    total_chunks, total_bad_chunks, total_removed, total_salvaged = 0, 0, 0, 0
+    total_problems = {}
+    worlds = {}
+    for world_folder in world_folders:
+        region_files = get_region_files(world_folder)
+        if not region_files:
+            print(f'\nNo region folder was found in world "{world_folder}"')
+            continue
+
+        file_count = len(region_files)
+        start_time = time.time()
+        metrics.start_world(world_folder)
+        results = []
+        # region files that are repaired can't be split because the parts would allocate sectors independently
+        tasks = schedule_files(region_files, processes, split=not repair)
+        print(f'\nVerifying chunks of world "{world_folder}" with {processes} processes...')
+        with Progress(region_files) as pbar, \
+                ProcessPoolExecutor(max_workers=processes, initializer=_init_worker) as executor:
+            futures = [executor.submit(verify_region, region_file, repair,
+                                       get_backup_file(world_folder, backup_folder, region_file)
+                                       if repair == 'salvage' else None, first, last)
+                       for region_file, first, last in tasks]
+            for future in as_completed(futures):
+                result = future.result()
+                results.append(result)
+                pbar.update(result['bytes'])
+                metrics.count(chunks_decoded=result['chunks'] - result['bad_chunks'],
+                              not_readable_chunks=result['bad_chunks'])
+        results = merge_results(results)
+
+        chunks = sum(result['chunks'] for result in results)
+        bad_chunks = sum(result['bad_chunks'] for result in results)
+        removed = sum(result['removed'] for result in results)
+        salvaged = sum(result['salvaged'] for result in results)
+        problems = [problem for result in results for problem in result['problems']]
+        problem_counts = {}
+        for problem in problems:
+            problem_counts[problem['problem']] = problem_counts.get(problem['problem'], 0) + 1
+
+        elapsed_time = int(round((time.time() - start_time) * 1000))
+        human_readable_elapsed_time = format_time(elapsed_time)
+
+        print(f'Verified {chunks} chunks in {file_count} region files of world "{world_folder}": {bad_chunks} chunks '
+              f'are bad. (Elapsed time: {human_readable_elapsed_time})')
+        for problem, count in problem_counts.items():
+            print(f'    {problem}: {count}')
+        if repair:
+            print(f'Removed {removed} and salvaged {salvaged} chunks.')
+
+        total_chunks += chunks
+        total_bad_chunks += bad_chunks
+        total_removed += removed
+        total_salvaged += salvaged
+        for problem, count in problem_counts.items():
+            total_problems[problem] = total_problems.get(problem, 0) + count
+
+        if output_file:
+            worlds[str(world_folder.resolve())] = {
+                'chunks': chunks,
+                'bad_chunks': bad_chunks,
+                'removed': removed,
+                'salvaged': salvaged,
+                'problem_counts': problem_counts,
+                'problems': problems,
+                'elapsed_time': {
+                    'raw': elapsed_time,
+                    'human_readable': human_readable_elapsed_time
+                }
+            }
+
+    elapsed_time = int(round((time.time() - total_start_time) * 1000))
+    human_readable_elapsed_time = format_time(elapsed_time)
+
+    if len(world_folders) > 1:
+        print(f'\nTotal verified chunks: {total_chunks}'
+              f'\nTotal bad chunks: {total_bad_chunks}'
+              f'\nTotal elapsed time: {human_readable_elapsed_time}')
+
+    if output_file:
+        data = {
+            'worlds': worlds,
+            'total': {
+                'chunks': total_chunks,
+                'bad_chunks': total_bad_chunks,
+                'removed': total_removed,
+                'salvaged': total_salvaged,
+                'problem_counts': total_problems,
+                'elapsed_time': {
+                    'raw': elapsed_time,
+                    'human_readable': human_readable_elapsed_time
+                }
+            }
+        }
+
+        with Path(output_file).open('w') as file:
+            if output_format == 'plain':
+                file.write(f'--- MCWorldTools by Rapha149 ---'
+                           f'\n\u00B7\u00B7\u00B7 Verify chunks \u00B7\u00B7\u00B7'
+                           f'\n\nTotal verified chunks: {total_chunks}'
+                           f'\nTotal bad chunks: {total_bad_chunks}')
+                for problem, count in total_problems.items():
+                    file.write(f'\n    {problem}: {count}')
+                if repair:
+                    file.write(f'\nTotal removed chunks: {total_removed}'
+                               f'\nTotal salvaged chunks: {total_salvaged}')
+                file.write(f'\nTotal elapsed time: {human_readable_elapsed_time}')
+
+                file.write(f'\n\n[ Worlds ]')
+                for world, info in worlds.items():
+                    file.write(f'\n{world}'
+                               f'\n    Verified chunks: {info["chunks"]}'
+                               f'\n    Bad chunks: {info["bad_chunks"]}')
+                    if repair:
+                        file.write(f'\n    Removed chunks: {info["removed"]}'
+                                   f'\n    Salvaged chunks: {info["salvaged"]}')
+                    file.write(f'\n    Elapsed time: {info["elapsed_time"]["human_readable"]}')
+
+                    if info['problems']:
+                        file.write('\n    Problems:')
+                        for problem in info['problems']:
+                            location = 'Region file' if problem['x'] is None else \
+                                f'Chunk {problem["x"]} {problem["z"]}'
+                            file.write(f'\n        {location} in "{problem["file"]}": {problem["problem"]}'
+                                       f'{" (bad)" if problem["bad"] else ""}'
+                                       f'{" - " + problem["message"] if problem["message"] else ""}'
+                                       f'{" - " + problem["repair"] if problem["repair"] else ""}')
+                    file.write('\n')
+
+            else:
+                dump_data(data, file, output_format)
+
+            print(f'\nSaved output to "{output_file}"')
+
+
+def get_region_files(world_folder):
+    """Returns all region files of the region and entity folders of a world."""
+    folders = list(get_region_folders(world_folder))
+    folders += [folder for folder in get_entity_folders(world_folder) if folder not in folders]
+    return list_files(folders)
+
+
+def get_backup_file(world_folder, backup_folder, region_file):
+    """Returns the file at the same place as a region file in the backup world. The nether and the end of Bukkit based
+    servers are expected next to the backup world as well (e.g. "backup_nether" for "world_nether")."""
+    try:
+        return Path(backup_folder, region_file.relative_to(world_folder))
+    except ValueError:
+        world_folder, backup_folder = Path(world_folder).resolve(), Path(backup_folder).resolve()
+        parts = region_file.relative_to(world_folder.parent).parts
+        return Path(backup_folder.parent, backup_folder.name + parts[0][len(world_folder.name):], *parts[1:])
+
+
+def _init_worker():
+    # the main process handles aborting
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def _problem(region_file, x, z, problem, bad, message=None):
+    return {
+        'file': str(region_file),
+        'x': x,
+        'z': z,
+        'problem': problem,
+        'bad': bad,
+        'message': message,
+        'repair': None
+    }
+
+
+def read_chunk(region, x, z):
+    """Decompress and parse a chunk. Returns (data, chunk, None) with the decompressed data or
+    (None, None, (problem, message)) if it can't be read."""
+    try:
+        data = region.get_blockdata(x, z)
+    except ChunkDataError as e:
+        return None, None, ('decompression', str(e))
+    except RegionFileFormatError as e:
+        return None, None, ('header', str(e))
+    try:
+        return data, NBTFile(buffer=BytesIO(data)), None
+    except Exception as e:
+        return None, None, ('nbt', str(e) or type(e).__name__)
+
+
+def merge_results(results):
+    """Merge the results of the parts of region files verified by ``verify_region`` and sort them by file."""
+    results.sort(key=lambda result: (result['file'], result['start']))
+    merged = []
+    for result in results:
+        if merged and merged[-1]['file'] == result['file']:
+            previous = merged[-1]
+            for key in ('chunks', 'bytes', 'bad_chunks', 'removed', 'salvaged', 'problems'):
+                previous[key] += result[key]
+        else:
+            merged.append(result)
+    return merged
+
+
+def verify_region(region_file, repair=False, backup_file=None, start=0, stop=1024):
+    """Verify the header and every chunk of a region file and repair the bad chunks if ``repair`` is "remove" or
+    "salvage". Only the chunks at the positions ``x * 32 + z`` from ``start`` to ``stop`` are verified and problems of
+    the whole file are only reported in the part starting at 0. Runs in a worker process, so only picklable values
+    are returned."""
+    result = {
+        'file': str(region_file),
+        'start': start,
+        'bytes': 0,
+        'chunks': 0,
+        'bad_chunks': 0,
+        'removed': 0,
+        'salvaged': 0,
+        'problems': []
+    }
+    problems = result['problems']
+
+    with region_file.open('r+b' if repair else 'rb') as file:
+        try:
+            region = open_region(file, region_file)
+        except RegionFileFormatError as e:
+            if start == 0:
+                problems.append(_problem(region_file, None, None, 'header', True, str(e)))
+            return result
+        if region.size % 4096 and start == 0:
+            problems.append(_problem(region_file, None, None, 'file_size', False,
+                                     f'The file size of {region.size} bytes is not a multiple of 4096.'))
+
+        bad = []
+        for metadata in region.get_metadata():
+            x, z = metadata.x, metadata.z
+            if not start <= x * 32 + z < stop:
+                continue
+            result['chunks'] += 1
+            result['bytes'] += metadata.blocklength * SECTOR_LENGTH
+            if metadata.status in header_problems:
+                problems.append(_problem(region_file, x, z, header_problems[metadata.status], False))
+
+            _, chunk, error = read_chunk(region, x, z)
+            if error:
+                problems.append(_problem(region_file, x, z, error[0], True, error[1]))
+                bad.append(problems[-1])
+                continue
+
+            if region.loc.x is not None:
+                data = chunk['Level'] if 'Level' in chunk else chunk
+                if 'xPos' in data and 'zPos' in data:
+                    position = data['xPos'].value, data['zPos'].value
+                elif 'Position' in data:
+                    position = tuple(data['Position'].value)
+                else:
+                    continue
+                expected = region.loc.x * 32 + x, region.loc.z * 32 + z
+                if position != expected:
+                    problems.append(_problem(region_file, x, z, 'position', True,
+                                             f'The chunk is saved at {expected[0]} {expected[1]} but contains the '
+                                             f'chunk {position[0]} {position[1]}.'))
+                    bad.append(problems[-1])
+
+        result['bad_chunks'] = len(bad)
+        if not bad or not repair:
+            return result
+
+        backup = None
+        backup_file_obj = None
+        if repair == 'salvage' and backup_file is not None and backup_file.is_file():
+            backup_file_obj = backup_file.open('rb')
+            try:
+                backup = open_region(backup_file_obj, backup_file)
+            except RegionFileFormatError:
+                backup = None
+
+        try:
+            for problem in bad:
+                x, z = problem['x'], problem['z']
+                if repair == 'remove':
+                    region.unlink_chunk(x, z)
+                    problem['repair'] = 'removed'
+                    result['removed'] += 1
+                    continue
+
+                if backup is None or backup.metadata[x, z].status == STATUS_CHUNK_NOT_CREATED:
+                    problem['repair'] = 'not in backup'
+                    continue
+                data, _, error = read_chunk(backup, x, z)
+                if error:
+                    problem['repair'] = 'not readable in backup'
+                    continue
+                try:
+                    region.write_blockdata(x, z, data)
+                except ChunkDataError:
+                    problem['repair'] = 'too large in backup'
+                    continue
+                problem['repair'] = 'salvaged'
+                result['salvaged'] += 1
+        finally:
+            if backup_file_obj is not None:
+                backup_file_obj.close()
+    return result
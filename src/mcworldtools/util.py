@@ -1,23 +1,215 @@
+import re
+import sys
+from datetime import datetime
 from itertools import chain
 from pathlib import Path
 from nbt.nbt import *
-import readline
+from nbt.region import RegionFile, Location, ChunkDataError, SECTOR_LENGTH
+
+from . import metrics
+from .region import Region
 
 dimensions = ['overworld', 'nether', 'end']
-possible_region_folders = {
-    'DIM1/region': 'end',
-    'DIM-1/region': 'nether',
-    'region': 'overworld'
+# the folders of the vanilla dimensions in the world folder
+dimension_folders = {
+    'overworld': '',
+    'nether': 'DIM-1',
+    'end': 'DIM1'
+}
+# Bukkit based servers save the nether and the end as separate worlds next to the main world, e.g. "world_nether/DIM-1"
+bukkit_world_suffixes = {
+    'nether': '_nether',
+    'end': '_the_end'
 }
-possible_entity_folders = {
-    'DIM1/entities': 'end',
-    'DIM-1/entities': 'nether',
-    'entities': 'overworld',
-    'DIM1/region': 'end',
-    'DIM-1/region': 'nether',
-    'region': 'overworld'
+# datapacks and mods save their dimensions in "dimensions/<namespace>/<path>", these are named "<namespace>:<path>"
+custom_dimension_pattern = re.compile(r'[a-z0-9_.-]+:[a-z0-9_./-]+')
+# the first DataVersion (20w45a, 1.17) in which entities are saved in the entity folders instead of the chunks
+entities_data_version = 2681
+legacy_block_entity_ids = {
+    'airportal': 'end_portal',
+    'cauldron': 'brewing_stand',
+    'control': 'command_block',
+    'dldetector': 'daylight_detector',
+    'enchanttable': 'enchanting_table',
+    'endgateway': 'end_gateway',
+    'enderchest': 'ender_chest',
+    'flowerpot': 'flower_pot',
+    'mob_spawner': 'spawner',
+    'mobspawner': 'spawner',
+    'music': 'noteblock',
+    'recordplayer': 'jukebox',
+    'structure': 'structure_block',
+    'trap': 'dispenser'
 }
 
+region_file_pattern = re.compile(r'r\.(-?\d+)\.(-?\d+)\.mca')
+# folder in the world folder in which tools keep their state between runs
+state_folder = '.mcworldtools'
+
+
+class InputError(Exception):
+    """Raised if input values are invalid. The command line interface exits with code 3 in this case."""
+
+
+class ScanStats:
+    """Collects statistics and messages about chunks while scanning a world."""
+
+    def __init__(self):
+        self.not_readable_chunks = 0
+        self.unchanged_chunks = 0
+        self.messages = []
+
+    def add(self, stats):
+        """Add the statistics and messages of another scan, e.g. of one dimension scanned in another process."""
+        self.not_readable_chunks += stats.not_readable_chunks
+        self.unchanged_chunks += stats.unchanged_chunks
+        self.messages += stats.messages
+
+
+class Record:
+    """Base class of compact search hits that use ``__slots__`` instead of nested dicts.
+
+    Records can be indexed like the dicts in the output files (``record['loc']['x']``) and are only expanded to these
+    dicts by ``to_dict`` when they are serialized. Subclasses name their dict keys in ``keys``; "loc" and "chunk" are
+    built from the location slots and all other keys are read from the slot of the same name."""
+
+    __slots__ = ('dimension', 'x', 'y', 'z', 'chunk_x', 'chunk_z', 'world_x', 'world_z')
+    keys = ()
+
+    def __getitem__(self, key):
+        if key == 'loc':
+            return {
+                'dimension': self.dimension,
+                'x': self.x,
+                'y': self.y,
+                'z': self.z
+            }
+        if key == 'chunk':
+            return {
+                'in_region_file': {
+                    'x': self.chunk_x,
+                    'z': self.chunk_z
+                },
+                'in_world': {
+                    'x': self.world_x,
+                    'z': self.world_z
+                }
+            }
+        if key in self.keys:
+            return getattr(self, key)
+        raise KeyError(key)
+
+    def to_dict(self):
+        return {key: self[key] for key in self.keys}
+
+    @classmethod
+    def from_dict(cls, data):
+        record = cls()
+        loc, chunk = data['loc'], data['chunk']
+        record.set_location(loc['dimension'], loc['x'], loc['y'], loc['z'], chunk['in_region_file']['x'],
+                            chunk['in_region_file']['z'], chunk['in_world']['x'], chunk['in_world']['z'])
+        for key in cls.keys:
+            if key != 'loc' and key != 'chunk':
+                setattr(record, key, data[key])
+        return record
+
+    def set_location(self, dimension, x, y, z, chunk_x, chunk_z, world_x, world_z):
+        self.dimension, self.x, self.y, self.z = dimension, x, y, z
+        self.chunk_x, self.chunk_z, self.world_x, self.world_z = chunk_x, chunk_z, world_x, world_z
+
+
+def expand_record(value):
+    """``default`` function for json that expands records to dicts."""
+    if isinstance(value, Record):
+        return value.to_dict()
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+def _represent_record(dumper, record):
+    return dumper.represent_dict(record.to_dict())
+
+
+def _get_yaml_dumper():
+    import yaml
+    # the C implementation of libyaml is a lot faster than the pure Python one
+    dumper = yaml.CSafeDumper if yaml.__with_libyaml__ else yaml.SafeDumper
+    dumper.add_multi_representer(Record, _represent_record)
+    return dumper
+
+
+def _dump_part(key, value, output_format, depth):
+    """Returns a key and its value of output data in json or yaml format as it would be written at the given depth."""
+    if output_format == 'json':
+        import json
+        return ('   ' * depth + json.dumps(key) + ': ' + json.dumps(value, indent=3, default=expand_record)) \
+            .replace('\n', '\n' + '   ' * depth)
+
+    import yaml
+    # the key is dumped in its parents, so that long texts are wrapped at the same columns
+    for parent in range(depth):
+        key, value = parent, {key: value}
+    text = yaml.dump({key: value}, Dumper=_get_yaml_dumper(), indent=3)
+    return text.split('\n', depth)[depth]
+
+
+_indentation_pattern = re.compile(r'^(?:  )+', re.MULTILINE)
+_non_ascii_pattern = re.compile(r'[^\x00-\x7f]+')
+
+
+def _as_json_module_output(output):
+    """Convert json written by orjson with an indent of 2 to the output of the json module with an indent of 3 and
+    escaped non-ASCII characters, so that output files are the same with and without orjson."""
+    import json
+    # texts can't contain line breaks in json, so every line starts with its indentation
+    text = _indentation_pattern.sub(lambda match: '   ' * (len(match.group()) // 2), output.decode('utf-8'))
+    # non-ASCII characters only occur in texts
+    return _non_ascii_pattern.sub(lambda match: json.dumps(match.group())[1:-1], text)
+
+
+def dump_data(data, file, output_format):
+    """Write output data that may contain records to a file in json or yaml format.
+
+    If orjson is installed, it is used for json. Otherwise and for yaml the worlds are serialized in parallel
+    processes if there are multiple ones."""
+    if output_format == 'json':
+        try:
+            import orjson
+        except ImportError:
+            pass
+        else:
+            file.write(_as_json_module_output(orjson.dumps(data, default=expand_record,
+                                                           option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)))
+            return
+
+    from os import cpu_count
+    worlds = data.get('worlds') if isinstance(data, dict) else None
+    processes = min(len(worlds), cpu_count() or 1) if isinstance(worlds, dict) else 1
+    if processes < 2:
+        if output_format == 'json':
+            import json
+            json.dump(data, file, indent=3, default=expand_record)
+        elif output_format == 'yaml':
+            import yaml
+            yaml.dump(data, file, Dumper=_get_yaml_dumper(), indent=3)
+        return
+
+    from concurrent.futures import ProcessPoolExecutor
+    # json keeps the order of the keys and yaml sorts them
+    keys = list(data) if output_format == 'json' else sorted(data)
+    world_keys = list(worlds) if output_format == 'json' else sorted(worlds)
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        world_parts = executor.map(_dump_part, world_keys, [worlds[world] for world in world_keys],
+                                   [output_format] * len(world_keys), [1] * len(world_keys))
+        parts = {key: None if key == 'worlds' else _dump_part(key, data[key], output_format, 0) for key in keys}
+        world_parts = list(world_parts)
+
+    if output_format == 'json':
+        parts['worlds'] = '"worlds": {\n' + ',\n'.join(world_parts) + '\n}'
+        file.write('{\n' + ',\n'.join('   ' + part.replace('\n', '\n   ') for part in parts.values()) + '\n}')
+    else:
+        parts['worlds'] = 'worlds:\n' + ''.join(world_parts)
+        file.write(''.join(parts.values()))
+
 
 def eprint(*args, **kwargs):
     print(*args, file=sys.stderr, **kwargs)
@@ -34,19 +226,99 @@ def parse_yes_no(answer, default=None):
     return None
 
 
+def get_dimension_folders(world_folder):
+    """Returns the folders of all dimensions of a world that contain a region or an entity folder, mapped by dimension.
+
+    Besides the vanilla dimensions these are the dimensions of datapacks and mods in "dimensions/<namespace>/<path>"
+    and the nether and the end of Bukkit based servers, which are saved next to the world folder (e.g.
+    "world_nether/DIM-1"). The vanilla dimensions come first, the others are sorted by name."""
+    world_folder = Path(world_folder)
+    folders = {}
+    for dimension, folder in dimension_folders.items():
+        candidates = [Path(world_folder, folder)]
+        if dimension in bukkit_world_suffixes:
+            world_path = world_folder.resolve()
+            candidates.append(Path(world_path.parent, world_path.name + bukkit_world_suffixes[dimension], folder))
+        for candidate in candidates:
+            if Path(candidate, 'region').is_dir() or Path(candidate, 'entities').is_dir():
+                folders[dimension] = candidate
+                break
+
+    custom_folder = Path(world_folder, 'dimensions')
+    if custom_folder.is_dir():
+        custom_dimensions = {}
+        for storage_folder in chain(custom_folder.glob('*/**/region'), custom_folder.glob('*/**/entities')):
+            parts = storage_folder.parent.relative_to(custom_folder).parts
+            if len(parts) >= 2 and storage_folder.is_dir():
+                custom_dimensions[f'{parts[0]}:{"/".join(parts[1:])}'.lower()] = storage_folder.parent
+        for dimension in sorted(custom_dimensions):
+            folders.setdefault(dimension, custom_dimensions[dimension])
+    return folders
+
+
+def get_dimensions(world_folders):
+    """Returns the names of the dimensions of the worlds, the vanilla dimensions first."""
+    found = set(chain.from_iterable(get_dimension_folders(world_folder) for world_folder in world_folders))
+    return dimensions + sorted(found.difference(dimensions))
+
+
 def get_region_folders(world_folder):
-    return [region_folder for region_folder in [Path(world_folder, folder) for folder in possible_region_folders.keys()]
-            if region_folder.is_dir()]
+    """Returns the region folders of all dimensions of a world, mapped to their dimension."""
+    return {Path(folder, 'region'): dimension for dimension, folder in get_dimension_folders(world_folder).items()
+            if Path(folder, 'region').is_dir()}
 
 
 def get_entity_folders(world_folder):
+    """Returns the entity folders of all dimensions of a world, mapped to their dimension. For dimensions without an
+    entity folder (before 1.17) the region folder is returned instead."""
     entity_folders = {}
-    for folder, dimension in possible_entity_folders.items():
-        if dimension not in entity_folders.values():
-            entity_folder = Path(world_folder, folder)
-            if entity_folder.is_dir():
-                entity_folders[entity_folder] = dimension
-    return entity_folders.keys()
+    for dimension, folder in get_dimension_folders(world_folder).items():
+        for name in ('entities', 'region'):
+            if Path(folder, name).is_dir():
+                entity_folders[Path(folder, name)] = dimension
+                break
+    return entity_folders
+
+
+def get_data_version(world_folder):
+    """Returns the DataVersion of the level.dat of a world or None if it has none (before 1.9)."""
+    try:
+        with Path(world_folder, 'level.dat').open('rb') as file:
+            data = NBTFile(fileobj=file)['Data']
+    except (OSError, KeyError, MalformedFileError):
+        return None
+    return data['DataVersion'].value if 'DataVersion' in data else None
+
+
+def get_storage_layout(world_folder):
+    """Returns "split" if the world saves entities in the entity folders (1.17+) and "legacy" if it saves them in the
+    chunks of the region folders."""
+    data_version = get_data_version(world_folder)
+    return 'split' if data_version is not None and data_version >= entities_data_version else 'legacy'
+
+
+def get_entity_files(world_folder):
+    """Returns the region files that contain entities, mapped by dimension like ``map_files``.
+
+    In legacy worlds these are the region files of the region folders. In split worlds these are the region files of
+    the entity folders and the region files of the region folders that have no entity region file yet, because the
+    region was not loaded since the world was upgraded to 1.17. Chunks of region folders should be read with
+    ``entities_data_version`` as ``skip_data_version`` in ``iter_chunks``, so that upgraded chunks are not parsed."""
+    region_files = map_files(get_region_folders(world_folder))
+    if get_storage_layout(world_folder) == 'legacy':
+        return region_files
+
+    entity_files = map_files({folder: dimension for folder, dimension in get_entity_folders(world_folder).items()
+                              if folder.name == 'entities'})
+    files = {}
+    for dimension in chain(region_files, entity_files):
+        if dimension in files:
+            continue
+        dimension_files = entity_files.get(dimension, [])
+        names = set(region_file.name for region_file in dimension_files)
+        files[dimension] = dimension_files + [region_file for region_file in region_files.get(dimension, [])
+                                              if region_file.name not in names]
+    return files
 
 
 def list_files(folders):
@@ -59,27 +331,240 @@ def list_files(folders):
 
 
 def map_files(folders):
+    """Returns the region files of folders that are mapped to their dimension like by ``get_region_folders``, mapped
+    by dimension. Dimensions without region files are left out."""
     files = {}
-    for folder in folders:
-        folder_str = str(folder)
-        dimension = None
-        for region_folder, dim in possible_entity_folders.items():
-            if folder_str.endswith(region_folder):
-                dimension = dim
-                break
-
-        if not dimension:
-            continue
-
+    for folder, dimension in folders.items():
         files_in_folder = []
         for file in folder.iterdir():
             if file.is_file() and file.name.endswith('.mca'):
                 files_in_folder.append(file)
         if files_in_folder:
-            files[dimension] = files_in_folder
+            files.setdefault(dimension, []).extend(files_in_folder)
     return files
 
 
+def open_region(file, region_file):
+    region = Region(file, region_file.parent)
+    match = region_file_pattern.match(region_file.name)
+    if match:
+        region.loc = Location(x=int(match.group(1)), z=int(match.group(2)))
+    return region
+
+
+def get_chunk_bytes(region_file):
+    """Returns the size of the chunks of a region file according to the sector counts in its header."""
+    with region_file.open('rb') as file:
+        locations = file.read(4096)
+    return sum(locations[3::4]) * SECTOR_LENGTH
+
+
+class Progress:
+    """A progress bar over the compressed size of the chunks of region files according to their headers, so that the
+    estimated remaining time does not depend on the sizes of the region files. The progress is reported to the metrics
+    as well.
+
+    Each chunk is counted ``passes`` times, e.g. for reading and removing it. The bar is only shown if ``show`` is
+    enabled."""
+
+    def __init__(self, region_files, show=True, passes=1):
+        self.sizes = {region_file: get_chunk_bytes(region_file) * passes for region_file in region_files}
+        self.passes = passes
+        self.file_progress = 0
+        total = sum(self.sizes.values())
+        metrics.add_work(total)
+        self.pbar = None
+        if show:
+            from tqdm import tqdm
+            self.pbar = tqdm(total=total or 1, unit='B', unit_scale=True, unit_divisor=1024,
+                             bar_format='{percentage:.2f}% |{bar}| [{n_fmt}/{total_fmt}B, {remaining} left]  ')
+            if not total:
+                self.pbar.update()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def update(self, size):
+        self.file_progress += size
+        metrics.progress(size)
+        if self.pbar is not None:
+            self.pbar.update(size)
+
+    def chunk(self, region, x, z, passes=1):
+        """Count one or more passes of a chunk as processed."""
+        self.update(region.metadata[x, z].blocklength * SECTOR_LENGTH * passes)
+
+    def file_done(self, region_file):
+        """Count the rest of a region file as processed, e.g. chunks that were not readable."""
+        rest = self.sizes.get(region_file, 0) - self.file_progress
+        if rest > 0:
+            self.update(rest)
+        self.file_progress = 0
+
+    def close(self):
+        if self.pbar is not None:
+            self.pbar.close()
+
+
+def iter_chunks(files, stats, progress=False, limit_dimensions=None, writable=False, since=None,
+                skip_data_version=None):
+    """Yield (dimension, region_file, region, x, z, chunk) for every readable chunk of the mapped region files.
+
+    Only the dimensions in ``limit_dimensions`` are read if it is given. Chunks that could not be read are counted in
+    ``stats``. If ``progress`` is enabled, a progress bar is shown while iterating. If ``since`` is a unix timestamp,
+    chunks that were saved before are not read but yielded with None as chunk and counted in ``stats``. If
+    ``skip_data_version`` is given, chunks of region folders with at least that DataVersion are skipped without
+    parsing them."""
+    files = {dimension: region_files for dimension, region_files in files.items()
+             if limit_dimensions is None or dimension in limit_dimensions}
+    with Progress(get_all_files(files), show=progress) as pbar:
+        for dimension, region_files in files.items():
+            for region_file in region_files:
+                with region_file.open('r+b' if writable else 'rb') as file:
+                    region = open_region(file, region_file)
+                    for coords in region.get_chunk_coords():
+                        x, z = coords['x'], coords['z']
+                        if since is not None and region.metadata[x, z].timestamp < since:
+                            stats.unchanged_chunks += 1
+                            metrics.count(chunks_skipped=1)
+                            yield dimension, region_file, region, x, z, None
+                            pbar.chunk(region, x, z)
+                            continue
+
+                        try:
+                            if skip_data_version is not None and region_file.parent.name == 'region':
+                                chunk = region.get_nbt_before(x, z, skip_data_version)
+                            else:
+                                chunk = region.get_chunk(x, z)
+                        except ChunkDataError:
+                            stats.not_readable_chunks += 1
+                        else:
+                            if chunk is not None:
+                                yield dimension, region_file, region, x, z, chunk
+
+                        pbar.chunk(region, x, z)
+                pbar.file_done(region_file)
+
+
+def scan_dimensions(scan, world_folder, files, processes, stats, progress=False, **kwargs):
+    """Yield the results of ``scan`` for the mapped region files of a world in the same order as ``scan`` without a
+    dimension would, but scan each dimension as an independent task in up to ``processes`` parallel processes, the
+    largest dimension first.
+
+    ``scan`` has to be a module level function that takes the world folder, ``kwargs`` and the keyword arguments
+    "dimension" and "stats". The results of every dimension are kept in memory until all dimensions are scanned."""
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    results = {}
+    with Progress(get_all_files(files), show=progress) as pbar, \
+            ProcessPoolExecutor(max_workers=min(processes, len(files)), initializer=_init_scan_worker) as executor:
+        sizes = {dimension: sum(pbar.sizes[region_file] for region_file in region_files)
+                 for dimension, region_files in files.items()}
+        futures = {executor.submit(_scan_dimension, scan, world_folder, dimension, kwargs): dimension
+                   for dimension in sorted(files, key=sizes.get, reverse=True)}
+        for future in as_completed(futures):
+            dimension = futures[future]
+            results[dimension] = future.result()
+            metrics.add_counts(results[dimension][2])
+            pbar.update(sizes[dimension])
+
+    for dimension in files:
+        dimension_results, dimension_stats, _ = results.pop(dimension)
+        stats.add(dimension_stats)
+        yield from dimension_results
+
+
+def _init_scan_worker():
+    import signal
+    # the main process handles aborting
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def _scan_dimension(scan, world_folder, dimension, kwargs):
+    counts = metrics.start_worker()
+    stats = ScanStats()
+    return list(scan(world_folder, dimension=dimension, stats=stats, **kwargs)), stats, counts
+
+
+def chunk_key(dimension, region_file, x, z):
+    return f'{dimension}/{region_file.name}/{x}/{z}'
+
+
+def parse_since(since):
+    """Returns "last" or the unix timestamp of a "--since" value. Raises an InputError if it is invalid."""
+    if since == 'last':
+        return since
+    if re.fullmatch(r'\d+', since):
+        return int(since)
+    try:
+        return int(datetime.fromisoformat(since).timestamp())
+    except ValueError:
+        raise InputError(f'"--since" has to be a unix timestamp, a date (e.g. "2022-05-31 18:00") or "last".')
+
+
+class ScanState:
+    """The found objects per chunk of the last run of a find tool with "--since" in a world, saved in the world folder.
+
+    ``since`` is the value returned by ``parse_since``. The chunks to read again are the ones saved after the last run
+    with the same query or after ``since``, whichever is earlier. The found objects of the other chunks are taken from
+    ``previous``."""
+
+    def __init__(self, world_folder, name, query, since):
+        import json
+        import time
+        self.file = Path(world_folder, state_folder, f'{name}.json')
+        self.query = json.loads(json.dumps(query))
+        self.time = int(time.time())
+        self.previous_time, self.previous = None, {}
+        if self.file.is_file():
+            try:
+                with self.file.open('r') as file:
+                    state = json.load(file)
+                if state.get('query') == self.query:
+                    self.previous_time, self.previous = state['time'], state['chunks']
+            except (ValueError, KeyError):
+                pass
+
+        if since == 'last' or (self.previous_time is not None and self.previous_time < since):
+            self.since = self.previous_time
+        else:
+            self.since = since
+        # the found objects per chunk of this run, filled by the scan
+        self.chunks = {}
+
+    @property
+    def complete(self):
+        """Whether the objects of all chunks are known after the scan, otherwise the state is not saved."""
+        return self.since is None or self.previous_time is not None
+
+    def save(self):
+        import json
+        self.file.parent.mkdir(exist_ok=True)
+        temp_file = self.file.with_suffix('.tmp')
+        with temp_file.open('w') as file:
+            json.dump({
+                'time': self.time,
+                'query': self.query,
+                'chunks': self.chunks
+            }, file, default=expand_record)
+        temp_file.replace(self.file)
+
+
+def print_scan_state(state):
+    if state.since is None:
+        print('No results of a previous run with the same input were found, so all chunks are read.')
+    elif not state.complete:
+        print('No results of a previous run with the same input were found, so only the objects in chunks saved since '
+              'the given time are found.')
+    elif state.since == state.previous_time:
+        print(f'Reading the chunks saved since the previous run with the same input at '
+              f'{datetime.fromtimestamp(state.since):%Y-%m-%d %H:%M:%S}.')
+    else:
+        print(f'Reading the chunks saved since {datetime.fromtimestamp(state.since):%Y-%m-%d %H:%M:%S}.')
+
+
 def get_all_files(mapped_files):
     return list(chain.from_iterable(list(mapped_files.values())))
 
@@ -88,6 +573,47 @@ def get_size(files):
     return sum(file.stat().st_size for file in files)
 
 
+def schedule_files(files, workers=1, split=True):
+    """Returns the region files as (region_file, start, stop) tasks for parallel workers, the largest first, so that no
+    large region file is left until the end. ``start`` and ``stop`` limit the chunks to the positions
+    ``x * 32 + z`` in that range, which is the order of ``RegionFile.get_metadata``.
+
+    If ``split`` is enabled, region files that are larger than a quarter of the share of a worker are split into
+    parts with similar numbers of sectors according to the region header."""
+    sizes = [(file.stat().st_size, file) for file in files]
+    max_size = sum(size for size, _ in sizes) / (workers * 4) if split and workers > 1 else None
+    tasks = []
+    for size, file in sizes:
+        if max_size is None or size <= max_size:
+            tasks.append((size, file, 0, 1024))
+        else:
+            tasks += _split_region_file(file, size, min(32, int(-(-size // max_size))))
+    tasks.sort(key=lambda task: task[0], reverse=True)
+    return [task[1:] for task in tasks]
+
+
+def _split_region_file(file, size, parts):
+    with file.open('rb') as region_file:
+        locations = region_file.read(4096)
+    sectors = [0] * 1024
+    for index in range(len(locations) // 4):
+        # the header is ordered by z and then x
+        sectors[(index % 32) * 32 + index // 32] = locations[index * 4 + 3]
+    total = sum(sectors)
+    if not total:
+        return [(size, file, 0, 1024)]
+
+    tasks = []
+    start, part_sectors, sector_sum = 0, 0, 0
+    for position, count in enumerate(sectors):
+        part_sectors += count
+        sector_sum += count
+        if sector_sum >= total * (len(tasks) + 1) / parts or position == 1023:
+            tasks.append((size * part_sectors / total, file, start, position + 1))
+            start, part_sectors = position + 1, 0
+    return tasks
+
+
 def format_time(input_time):
     seconds = int(input_time / 1000)
     minutes = int(seconds / 60)
@@ -107,10 +633,63 @@ def format_freed_space(raw_freed_space):
     return freed_space, freed_space_unit
 
 
+def check_dimension(dimension):
+    if dimension is None:
+        return None
+    if not isinstance(dimension, str):
+        raise InputError(f'"dimension" has to be text but is {type(dimension).__name__}')
+    dimension = dimension.lower()
+    if not is_dimension(dimension):
+        raise InputError(f'Unknown dimension "{dimension}"')
+    return dimension
+
+
+def is_dimension(dimension):
+    """Whether the name is a vanilla dimension or a namespaced dimension of a datapack or mod (e.g. "mod:mining")."""
+    return dimension in dimensions or custom_dimension_pattern.fullmatch(dimension) is not None
+
+
 def strip_id(minecraft_id):
     return minecraft_id[(len('minecraft:') if minecraft_id.lower().startswith('minecraft:') else 0):]
 
 
+def normalize_block_entity_id(block_entity_id):
+    block_entity_id = strip_id(block_entity_id.lower())
+    return legacy_block_entity_ids.get(block_entity_id, block_entity_id)
+
+
+def compile_text_filter(patterns, literal=False):
+    """Compile the given regular expressions or literal texts into one function that returns whether a text matches
+    any of them. Literal texts are matched with an Aho-Corasick automaton if pyahocorasick is installed."""
+    try:
+        import ahocorasick
+    except ImportError:
+        ahocorasick = None
+
+    if literal and ahocorasick:
+        automaton = ahocorasick.Automaton()
+        for pattern in patterns:
+            automaton.add_word(pattern, pattern)
+        automaton.make_automaton()
+
+        def matches(text):
+            for _ in automaton.iter(text):
+                return True
+            return False
+
+        return matches
+
+    if literal:
+        return re.compile('|'.join(re.escape(pattern) for pattern in patterns)).search
+
+    # regular expressions are compiled one by one because inline flags and group references only work in their own
+    # expression
+    searches = [re.compile(pattern).search for pattern in patterns]
+    if len(searches) == 1:
+        return searches[0]
+    return lambda text: any(search(text) for search in searches)
+
+
 def _int_to_hex(val, nbits):
     return hex((val + (1 << nbits)) % (1 << nbits)).lstrip('0x')
 
@@ -199,6 +778,8 @@ class SimpleCompleter(object):  # Custom completer
 
 
 def complete(completions, case_insensitive=False):
+    # readline is only needed for interactive prompts and is therefore not imported at startup.
+    import readline
     completer = SimpleCompleter(completions, case_insensitive)
     readline.set_completer(completer.complete)
     readline.parse_and_bind('tab: complete')
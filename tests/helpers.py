@@ -0,0 +1,125 @@
+"""Builds small worlds for the tests."""
+from pathlib import Path
+
+from nbt.nbt import *
+from nbt.region import RegionFile
+
+from mcworldtools.util import convert_uuid_to_ints
+
+dimension_folders = {'overworld': '', 'nether': 'DIM-1', 'end': 'DIM1'}
+
+
+def to_tag(name, value):
+    if isinstance(value, TAG):
+        value.name = name
+        return value
+    if isinstance(value, bool):
+        return TAG_Byte(name=name, value=int(value))
+    if isinstance(value, int):
+        return TAG_Int(name=name, value=value)
+    if isinstance(value, float):
+        return TAG_Double(name=name, value=value)
+    if isinstance(value, str):
+        return TAG_String(name=name, value=value)
+    if isinstance(value, dict):
+        tag = TAG_Compound(name=name)
+        for key, item in value.items():
+            tag.tags.append(to_tag(key, item))
+        return tag
+    if isinstance(value, list):
+        items = [to_tag(None, item) for item in value]
+        tag = TAG_List(name=name, type=type(items[0]) if items else TAG_Compound)
+        tag.tags.extend(items)
+        return tag
+    raise TypeError(type(value).__name__)
+
+
+def compound(name=None, **tags):
+    return to_tag(name, tags)
+
+
+def entity(entity_id, x, y, z, uuid, **tags):
+    tag = compound(id=entity_id, Pos=[float(x), float(y), float(z)], **tags)
+    uuid_tag = TAG_Int_Array(name='UUID')
+    uuid_tag.value = convert_uuid_to_ints(uuid)
+    tag.tags.append(uuid_tag)
+    return tag
+
+
+def block_entity(block_entity_id, x, y, z, **tags):
+    return compound(id=block_entity_id, x=x, y=y, z=z, **tags)
+
+
+def command_block(x, y, z, command, powered=False, auto=False):
+    return block_entity('minecraft:command_block', x, y, z, Command=command, CustomName='{"text":"@"}',
+                        LastOutput='', powered=powered, auto=auto)
+
+
+def chunk(x, z, data_version=2975, block_entities=(), entities=None, inhabited_time=0, status='minecraft:full'):
+    root = NBTFile()
+    root.name = ''
+    root.tags.extend([TAG_Int(name='DataVersion', value=data_version), TAG_Int(name='xPos', value=x),
+                      TAG_Int(name='zPos', value=z), TAG_String(name='Status', value=status),
+                      TAG_Long(name='InhabitedTime', value=inhabited_time)])
+    block_entity_list = TAG_List(name='block_entities', type=TAG_Compound)
+    block_entity_list.tags.extend(block_entities)
+    root.tags.append(block_entity_list)
+    if entities is not None:
+        entity_list = TAG_List(name='Entities', type=TAG_Compound)
+        entity_list.tags.extend(entities)
+        root.tags.append(entity_list)
+    return root
+
+
+def entity_chunk(x, z, entities, data_version=2975):
+    root = NBTFile()
+    root.name = ''
+    root.tags.append(TAG_Int(name='DataVersion', value=data_version))
+    position = TAG_Int_Array(name='Position')
+    position.value = [x, z]
+    root.tags.append(position)
+    entity_list = TAG_List(name='Entities', type=TAG_Compound)
+    entity_list.tags.extend(entities)
+    root.tags.append(entity_list)
+    return root
+
+
+def write_chunks(region_file, chunks):
+    """Write the chunks given as {(x, z): NBTFile} into a new region file."""
+    region_file = Path(region_file)
+    region_file.parent.mkdir(parents=True, exist_ok=True)
+    region_file.touch()
+    region = RegionFile(str(region_file))
+    for (x, z), nbt in chunks.items():
+        region.write_chunk(x, z, nbt)
+    region.close()
+    return region_file
+
+
+def write_level(world_folder, data_version=2975):
+    level = NBTFile()
+    level.name = ''
+    level.tags.append(compound('Data', LevelName='Test', DataVersion=data_version, SpawnX=0, SpawnZ=0))
+    Path(world_folder).mkdir(parents=True, exist_ok=True)
+    level.write_file(str(Path(world_folder, 'level.dat')))
+
+
+def make_world(world_folder, commands=('say hi', 'op Steve', 'give @p diamond 64')):
+    """A 1.18 world with a command block with each command and a zombie in chunk 0 0 of every dimension, and a
+    hopper and a pig in chunk 1 0."""
+    world_folder = Path(world_folder)
+    write_level(world_folder)
+    for index, folder in enumerate(dimension_folders.values()):
+        write_chunks(world_folder / folder / 'region' / 'r.0.0.mca', {
+            (0, 0): chunk(0, 0, block_entities=[command_block(i, 64, 0, command) for i, command in enumerate(commands)],
+                          inhabited_time=100),
+            (1, 0): chunk(1, 0, block_entities=[block_entity('minecraft:hopper', 16, 64, 0)])
+        })
+        zombie = entity('minecraft:zombie', 1.5, 64, 1.5, f'00000000-0000-0000-0000-00000000000{index}', Age=6001,
+                        CustomName='{"text":"Bob"}')
+        pig = entity('minecraft:pig', 17.5, 64, 1.5, f'00000000-0000-0000-0001-00000000000{index}', Age=10)
+        write_chunks(world_folder / folder / 'entities' / 'r.0.0.mca', {
+            (0, 0): entity_chunk(0, 0, [zombie]),
+            (1, 0): entity_chunk(1, 0, [pig])
+        })
+    return world_folder
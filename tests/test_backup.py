@@ -0,0 +1,82 @@
+import os
+import struct
+import zlib
+from io import BytesIO
+
+from helpers import chunk, make_world, write_chunks
+from nbt.nbt import TAG_Byte_Array
+from nbt.region import SECTOR_LENGTH
+
+from mcworldtools.tools.backup import ChunkStore, backup_world, restore_snapshot, write_region
+from mcworldtools.util import open_region
+
+
+def compressed(nbt):
+    buffer = BytesIO()
+    nbt.write_file(buffer=buffer)
+    return struct.pack('>B', 2) + zlib.compress(buffer.getvalue())
+
+
+def set_header(region_file, index, location=None, timestamp=None):
+    with region_file.open('r+b') as file:
+        if location is not None:
+            file.seek(index * 4)
+            file.write(struct.pack('>I', location))
+        if timestamp is not None:
+            file.seek(SECTOR_LENGTH + index * 4)
+            file.write(struct.pack('>I', timestamp))
+
+
+def test_write_region_with_external_chunk(tmp_path):
+    store = ChunkStore(tmp_path / 'store')
+    small = chunk(-32, 0, inhabited_time=7)
+    large = chunk(-31, 0)
+    # random bytes don't compress, so the chunk is larger than 255 sectors
+    array = TAG_Byte_Array(name='Data')
+    array.value = bytearray(os.urandom(256 * SECTOR_LENGTH))
+    large.tags.append(array)
+    region_file = tmp_path / 'region' / 'r.-1.0.mca'
+    region_file.parent.mkdir()
+    write_region(region_file, [[0, 100, 0, store.put(compressed(small))], [1, 200, 0, store.put(compressed(large))]],
+                 store)
+
+    assert (tmp_path / 'region' / 'c.-31.0.mcc').is_file()
+    assert region_file.stat().st_size == 4 * SECTOR_LENGTH
+    with region_file.open('rb') as file:
+        region = open_region(file, region_file)
+        assert [(metadata.x, metadata.timestamp) for metadata in region.get_metadata()] == [(0, 100), (1, 200)]
+        assert region.get_chunk(0, 0)['InhabitedTime'].value == 7
+        assert region.get_chunk(1, 0)['Data'].value == array.value
+
+
+def test_backup_and_restore(tmp_path):
+    world = make_world(tmp_path / 'world')
+    store = ChunkStore(tmp_path / 'store')
+    name, manifest, stats = backup_world(world, store)
+    assert stats['chunks'] == 12
+    restore_snapshot(store, store.load_snapshot(name), tmp_path / 'restored')
+    for region_file in world.glob('**/*.mca'):
+        restored_file = tmp_path / 'restored' / region_file.relative_to(world)
+        with region_file.open('rb') as file, restored_file.open('rb') as restored:
+            region, restored_region = open_region(file, region_file), open_region(restored, restored_file)
+            for metadata in region.get_metadata():
+                assert restored_region.get_compressed_blockdata(metadata.x, metadata.z) == \
+                       region.get_compressed_blockdata(metadata.x, metadata.z)
+
+
+def test_unchanged_chunks_of_region_files_saved_as_a_whole(tmp_path):
+    world = tmp_path / 'world'
+    region_file = write_chunks(world / 'region' / 'r.0.0.mca', {(0, 0): chunk(0, 0), (1, 0): chunk(1, 0)})
+    # chunks saved before the first snapshot are not read again in the second one
+    set_header(region_file, 0, timestamp=1000)
+    set_header(region_file, 1, timestamp=1000)
+    store = ChunkStore(tmp_path / 'store')
+    assert backup_world(world, store, 'first')[2]['unchanged_chunks'] == 0
+
+    # chunk 1 0 changed and points behind the end of the file
+    set_header(region_file, 1, location=100 << 8 | 1, timestamp=2000)
+    _, manifest, stats = backup_world(world, store, 'second')
+    assert manifest['folders']['']['regions'] == {}
+    assert 'region/r.0.0.mca' in manifest['folders']['']['files']
+    assert stats['chunks'] == 0
+    assert stats['unchanged_chunks'] == 0
@@ -0,0 +1,46 @@
+import json
+
+import pytest
+from helpers import make_world
+
+from mcworldtools.tools import command_blocks
+from mcworldtools.util import InputError
+
+
+def test_search_in_parallel_processes(tmp_path):
+    world = make_world(tmp_path / 'world')
+    kwargs = {'search': ['op ', 'give '], 'search_in': ['command']}
+    serial = [command_block.to_dict() for command_block in command_blocks.scan(world, processes=1, **kwargs)]
+    parallel = [command_block.to_dict() for command_block in command_blocks.scan(world, processes=3, **kwargs)]
+    assert len(serial) == 6
+    assert parallel == serial
+    assert set(command_block['command'] for command_block in parallel) == {'op Steve', 'give @p diamond 64'}
+
+
+def test_since_only_when_finding():
+    with pytest.raises(InputError, match='finding command blocks'):
+        command_blocks.start([], None, 'json', {'action': 2}, False, since='2024-01-01')
+
+
+def test_search_regex_with_inline_flags(tmp_path):
+    world = make_world(tmp_path / 'world')
+    found = list(command_blocks.scan(world, dimension='overworld', search=['(?i)OP ', 'x'], search_type='regex'))
+    assert [command_block['command'] for command_block in found] == ['op Steve']
+
+
+def no_input(prompt=''):
+    raise EOFError(prompt)
+
+
+@pytest.mark.parametrize('input_data, count', [
+    ({'action': 1}, 9),
+    ({'action': 1, 'search': ['OP ']}, 0),
+    ({'action': 1, 'search': ['op ']}, 3)
+])
+def test_find_with_input_file_without_search_options(tmp_path, monkeypatch, input_data, count):
+    world = make_world(tmp_path / 'world')
+    monkeypatch.setattr('builtins.input', no_input)
+    output_file = tmp_path / 'out.json'
+    input_data = dict(input_data, only_executing=False, dimension=None, processes=1)
+    command_blocks.start([world], output_file, 'json', input_data, True)
+    assert json.loads(output_file.read_text())['total']['command_blocks'] == count
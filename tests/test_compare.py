@@ -0,0 +1,41 @@
+from helpers import chunk, write_chunks, write_level
+
+from mcworldtools.tools.compare import compare_regions
+
+
+def make_pair(tmp_path):
+    world, backup = tmp_path / 'world', tmp_path / 'backup'
+    for folder in (world, backup):
+        write_level(folder)
+    region_file = write_chunks(world / 'region' / 'r.0.0.mca', {(0, 0): chunk(0, 0), (1, 0): chunk(1, 0)})
+    compare_file = write_chunks(backup / 'region' / 'r.0.0.mca', {(0, 0): chunk(0, 0, inhabited_time=5),
+                                                                   (2, 0): chunk(2, 0)})
+    return region_file, compare_file
+
+
+def test_compare_regions(tmp_path):
+    result = compare_regions('overworld', 'region', *make_pair(tmp_path))
+    assert result['counts'] == {'added': 1, 'removed': 1, 'modified': 1, 'unchanged': 0, 'not_readable': 0}
+    assert [(change['x'], change['change']) for change in result['changes']] == \
+           [(0, 'modified'), (1, 'added'), (2, 'removed')]
+    assert result['changes'][0]['keys'] == ['InhabitedTime']
+
+
+def test_not_readable_region_file_is_not_missing(tmp_path):
+    region_file, compare_file = make_pair(tmp_path)
+    compare_file.write_bytes(b'\0' * 100)
+    result = compare_regions('overworld', 'region', region_file, compare_file)
+    assert result['counts'] == {'added': 0, 'removed': 0, 'modified': 0, 'unchanged': 0, 'not_readable': 2}
+    assert result['changes'] == []
+    assert len(result['not_readable_files']) == 1
+
+
+def test_chunks_outside_the_file_are_not_readable(tmp_path):
+    region_file, compare_file = make_pair(tmp_path)
+    with compare_file.open('r+b') as file:
+        # chunk 2 0 points behind the end of the file
+        file.seek(2 * 4)
+        file.write(b'\0\x10\0\x01')
+    result = compare_regions('overworld', 'region', region_file, compare_file)
+    assert result['counts']['removed'] == 0
+    assert result['counts']['not_readable'] == 1
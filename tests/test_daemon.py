@@ -0,0 +1,31 @@
+from urllib.parse import parse_qs
+
+from helpers import make_world
+
+from mcworldtools.daemon import WorldIndex, routes
+
+
+def get(index, path, query_string):
+    return [result.to_dict() for result in routes[path](index, parse_qs(query_string, keep_blank_values=True))]
+
+
+def test_index_keeps_packed_lists(tmp_path):
+    index = WorldIndex(make_world(tmp_path / 'world'))
+    index.refresh()
+    chunks = [chunk for region_index in index.regions.values() for chunk in region_index.chunks.values()]
+    assert len(chunks) == 12
+    assert all(isinstance(packed, (bytes, type(None))) for chunk in chunks for packed in chunk[3:])
+
+    entities = get(index, '/entities', 'query=Age%20%3E%206000&nbt_keys=Age')
+    assert [entity['id'] for entity in entities] == ['minecraft:zombie'] * 3
+    assert entities[0]['nbt'] == '{"Age": 6001}'
+    assert len(get(index, '/block_entities', 'ids=hopper&dimension=nether')) == 1
+
+
+def test_search_is_not_split_at_commas(tmp_path):
+    index = WorldIndex(make_world(tmp_path / 'world', commands=('say hi, there', 'say hi')))
+    index.refresh()
+    found = get(index, '/command_blocks', 'dimension=overworld&search=hi,%20there')
+    assert [command_block['command'] for command_block in found] == ['say hi, there']
+    found = get(index, '/command_blocks', 'dimension=overworld&search=a%7B1,3%7D&search_type=regex')
+    assert [command_block['command'] for command_block in found] == ['say hi, there', 'say hi']
@@ -0,0 +1,9 @@
+import pytest
+
+from mcworldtools.tools import entities
+from mcworldtools.util import InputError
+
+
+def test_since_only_when_finding():
+    with pytest.raises(InputError, match='finding entities'):
+        entities.start([], None, 'json', {'action': 2}, False, since='2024-01-01')
@@ -0,0 +1,92 @@
+import ast
+import json
+import struct
+import zlib
+from array import array
+
+from helpers import make_world
+
+from mcworldtools.tools import heatmap
+
+
+def read_png(path):
+    data = path.read_bytes()
+    assert data[:8] == b'\x89PNG\r\n\x1a\n'
+    chunks, position = {}, 8
+    while position < len(data):
+        length, = struct.unpack('>I', data[position:position + 4])
+        chunk_type = data[position + 4:position + 8]
+        chunk_data = data[position + 8:position + 8 + length]
+        crc, = struct.unpack('>I', data[position + 8 + length:position + 12 + length])
+        assert crc == zlib.crc32(chunk_type + chunk_data)
+        chunks[chunk_type] = chunk_data
+        position += 12 + length
+    assert b'IEND' in chunks
+    width, height, depth, color_type = struct.unpack('>IIBB', chunks[b'IHDR'][:10])
+    assert (depth, color_type) == (8, 3)
+    assert len(chunks[b'PLTE']) == 3 * 256
+    pixels = zlib.decompress(chunks[b'IDAT'])
+    assert len(pixels) == height * (width + 1)
+    rows = [pixels[row * (width + 1):(row + 1) * (width + 1)] for row in range(height)]
+    assert all(row[0] == 0 for row in rows)
+    return width, height, [row[1:] for row in rows]
+
+
+def read_npy(path):
+    data = path.read_bytes()
+    assert data[:8] == b'\x93NUMPY\x01\x00'
+    header_length, = struct.unpack('<H', data[8:10])
+    assert (10 + header_length) % 64 == 0
+    header = ast.literal_eval(data[10:10 + header_length].decode('latin1'))
+    assert header['descr'] == '<u4' and header['fortran_order'] is False
+    height, width = header['shape']
+    values = struct.unpack(f'<{width * height}I', data[10 + header_length:])
+    return width, height, [values[row * width:(row + 1) * width] for row in range(height)]
+
+
+def make_grid():
+    """Two regions next to each other at -1 0 and 0 0 with counts in chunk 0 0 and 31 31 of the first one and in
+    chunk 5 1 of the second one."""
+    first, second = array('I', bytes(4 * 32 * 32)), array('I', bytes(4 * 32 * 32))
+    first[0], first[31 * 32 + 31], second[1 * 32 + 5] = 1, 100, 7
+    return {(-1, 0): first, (0, 0): second}
+
+
+def test_write_npy(tmp_path):
+    path = tmp_path / 'heatmap.npy'
+    heatmap._write_npy(path, 64, 32, heatmap._grid_rows(make_grid(), -1, 0, 64, 32))
+    width, height, rows = read_npy(path)
+    assert (width, height) == (64, 32)
+    assert rows[0][0] == 1 and rows[31][31] == 100 and rows[1][32 + 5] == 7
+    assert sum(map(sum, rows)) == 108
+
+
+def test_write_png(tmp_path):
+    path = tmp_path / 'heatmap.png'
+    heatmap._write_png(path, 64, 32, heatmap._grid_rows(make_grid(), -1, 0, 64, 32), 100)
+    width, height, rows = read_png(path)
+    assert (width, height) == (64, 32)
+    assert rows[31][31] == 255
+    assert 0 < rows[0][0] < rows[1][32 + 5] < 255
+    assert sum(1 for row in rows for pixel in row if pixel) == 3
+
+
+def test_write_png_without_counts(tmp_path):
+    path = tmp_path / 'heatmap.png'
+    heatmap._write_png(path, 32, 32, heatmap._grid_rows({(0, 0): array('I', bytes(4 * 32 * 32))}, 0, 0, 32, 32), 0)
+    assert not any(map(any, read_png(path)[2]))
+
+
+def test_start(tmp_path):
+    world = make_world(tmp_path / 'world')
+    output_file = tmp_path / 'out.json'
+    heatmap.start([world], output_file, 'json', {'dimension': 'overworld', 'heatmap_format': 'array', 'top': 1},
+                  False)
+    info = json.loads(output_file.read_text())['worlds'][str(world)]['dimensions']['overworld']
+    assert info['counts'] == {'entities': 2, 'block_entities': 4, 'command_blocks': 3}
+    assert info['size'] == {'width': 32, 'height': 32}
+    assert info['hotspots'] == [{'chunk': {'x': 0, 'z': 0},
+                                 'counts': {'entities': 1, 'block_entities': 3, 'command_blocks': 3}}]
+    width, height, rows = read_npy(tmp_path / 'out-world-overworld-command_blocks.npy')
+    assert rows[0][:2] == (3, 0) and sum(map(sum, rows)) == 3
+    assert info['heatmaps']['command_blocks'] == str(tmp_path / 'out-world-overworld-command_blocks.npy')
@@ -0,0 +1,16 @@
+import subprocess
+import sys
+
+
+def test_version_does_not_import_nbt():
+    code = ('import sys\n'
+            'sys.argv = ["mcworldtools", "--version"]\n'
+            'from mcworldtools.main import main\n'
+            'try:\n'
+            '    main()\n'
+            'except SystemExit:\n'
+            '    pass\n'
+            'assert "nbt" not in sys.modules, "nbt was imported"\n')
+    result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    assert 'Installed version' in result.stdout
@@ -0,0 +1,66 @@
+import re
+
+import pytest
+from helpers import compound, entity
+
+from mcworldtools.query import compile_query
+from mcworldtools.tools.entities import normalize_entity_id
+from mcworldtools.util import InputError
+
+zombie = entity('minecraft:zombie', 1, 70, 3, '00000000-0000-0000-0000-000000000001', Age=7000,
+                CustomName='{"text":"Bob"}', Tags=['a', 'b'])
+skeleton = entity('minecraft:skeleton', 1, -5, 3, '00000000-0000-0000-0000-000000000002', Age=100)
+pig = compound(id='minecraft:pig', Items=[compound(id='minecraft:carrot', Count=2)])
+entities = [zombie, skeleton, pig]
+
+
+@pytest.mark.parametrize('query, matches', [
+    ('id in (zombie, skeleton) and Age > 6000 and CustomName exists', [True, False, False]),
+    ('id = minecraft:PIG', [False, False, True]),
+    ('id == "zombie" or id = \'pig\'', [True, False, True]),
+    ('not CustomName exists', [False, True, True]),
+    ('Pos[1] < 0', [False, True, False]),
+    ('Pos[-2] >= 70', [True, False, False]),
+    ('Items[0].id = minecraft:carrot and Items[0].Count = 2', [False, False, True]),
+    ('CustomName contains Bob', [True, False, False]),
+    ('Tags contains b', [True, False, False]),
+    ('CustomName matches "B.b"', [True, False, False]),
+    ('Age != 100', [True, False, False]),
+    ('Age not in (1, 2)', [True, True, False]),
+    ('id not in (zombie)', [False, True, True]),
+    ('not Age in (100)', [True, False, True]),
+    ('Age = 7000.0', [True, False, False]),
+    ('Age = "7000"', [False, False, False]),
+    ('(Age < 200 or CustomName exists) and not id = pig', [True, True, False]),
+    ('Foo.Bar[0] = 1', [False, False, False]),
+])
+def test_query(query, matches):
+    test = compile_query(query, normalize_entity_id)
+    assert [test(nbt) for nbt in entities] == matches
+
+
+@pytest.mark.parametrize('query, message', [
+    ('', 'empty'),
+    ('id =', 'expected a value at the end'),
+    ('id in (a', 'expected ")"'),
+    ('Age > 5 foo', 'position 9'),
+    ('Age ? 3', 'unexpected character "?" at position 5'),
+    ('and', 'expected a key'),
+    ('x matches 5', 'regular expression'),
+    ('x matches "("', 'invalid regular expression'),
+])
+def test_invalid_query(query, message):
+    with pytest.raises(InputError, match=re.escape(message)):
+        compile_query(query)
+
+
+def test_cheap_tests_first():
+    checked = []
+
+    class Recorder(dict):
+        def __getitem__(self, key):
+            checked.append(key)
+            raise KeyError(key)
+
+    compile_query('a.b.c = 1 and d exists')(Recorder())
+    assert checked == ['d']
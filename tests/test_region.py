@@ -0,0 +1,162 @@
+import os
+import struct
+import sys
+from io import BytesIO
+
+import pytest
+from helpers import chunk
+from nbt.nbt import TAG_Byte_Array
+from nbt.region import RegionFile, ChunkDataError, SECTOR_LENGTH
+
+from mcworldtools import metrics, region as region_module
+from mcworldtools.region import COMPRESSION_LZ4, COMPRESSION_ZLIB, EXTERNAL_FLAG, decompress, decompress_lz4
+from mcworldtools.util import open_region
+
+
+def to_bytes(nbt):
+    buffer = BytesIO()
+    nbt.write_file(buffer=buffer)
+    return buffer.getvalue()
+
+
+def lz4_stream(*blocks):
+    """An lz4-java LZ4BlockOutputStream of (method, data, original length) blocks, ending with an empty block."""
+    stream = bytearray()
+    for method, data, original_length in blocks + ((0x10, b'', 0),):
+        stream += b'LZ4Block' + struct.pack('<Biii', method, len(data), original_length, 0) + data
+    return bytes(stream)
+
+
+# literals "abc", a match of 9 bytes at offset 3 that overlaps its own output and the last literal "!"
+handmade_block = b'\x35abc\x03\x00\x10!'
+
+
+def test_decompress_lz4_block_without_lz4(monkeypatch):
+    monkeypatch.setitem(sys.modules, 'lz4.block', None)
+    data = lz4_stream((0x20, handmade_block, 13), (0x10, b'raw', 3))
+    assert decompress_lz4(data) == b'abcabcabcabc!raw'
+    with pytest.raises(ChunkDataError, match='wrong length'):
+        decompress_lz4(lz4_stream((0x20, handmade_block, 12)))
+    with pytest.raises(ChunkDataError, match='Invalid LZ4 match offset'):
+        decompress_lz4(lz4_stream((0x20, b'\x35abc\x04\x00\x10!', 13)))
+
+
+def test_decompress_lz4_like_lz4():
+    block = pytest.importorskip('lz4.block')
+    data = to_bytes(chunk(3, 4, inhabited_time=123)) * 20 + os.urandom(1000)
+    compressed = block.compress(data, store_size=False)
+    assert region_module._decompress_lz4_block(compressed, len(data)) == data
+    assert decompress(lz4_stream((0x20, compressed, len(data))), COMPRESSION_LZ4) == data
+
+
+def test_decompress_invalid_lz4():
+    with pytest.raises(ChunkDataError, match='Invalid LZ4 block header'):
+        decompress(b'LZ4Blocx' + bytes(13), COMPRESSION_LZ4)
+    with pytest.raises(ChunkDataError, match='Unknown LZ4 block compression method'):
+        decompress(lz4_stream((0x30, b'abc', 3)), COMPRESSION_LZ4)
+
+
+def test_read_lz4_chunk(tmp_path):
+    region_file = tmp_path / 'r.0.0.mca'
+    region_file.touch()
+    data = to_bytes(chunk(1, 2, inhabited_time=42))
+    region = RegionFile(str(region_file))
+    # nbt writes the data as it is with compression 0, the compression id is set to LZ4 afterwards
+    region.write_blockdata(1, 2, lz4_stream((0x10, data, len(data))), 0)
+    region.file.seek(region.metadata[1, 2].blockstart * SECTOR_LENGTH + 4)
+    region.file.write(struct.pack('>B', COMPRESSION_LZ4))
+    region.close()
+
+    with region_file.open('rb') as file:
+        region = open_region(file, region_file)
+        assert region.get_blockdata(1, 2) == data
+        assert region.get_chunk(1, 2)['InhabitedTime'].value == 42
+
+
+def test_external_chunk(tmp_path):
+    region_file = tmp_path / 'r.-1.2.mca'
+    region_file.touch()
+    large = chunk(-31, 67)
+    # random bytes don't compress, so the chunk is larger than 255 sectors
+    array = TAG_Byte_Array(name='Data')
+    array.value = bytearray(os.urandom(256 * SECTOR_LENGTH))
+    large.tags.append(array)
+    external_file = tmp_path / 'c.-31.67.mcc'
+
+    with region_file.open('r+b') as file:
+        region = open_region(file, region_file)
+        region.write_chunk(1, 3, large)
+        region.write_chunk(2, 3, chunk(-30, 67))
+    assert external_file.is_file()
+    assert region_file.stat().st_size == 4 * SECTOR_LENGTH
+
+    with region_file.open('r+b') as file:
+        region = open_region(file, region_file)
+        assert region.is_readable(1, 3)
+        assert region.metadata[1, 3].compression == COMPRESSION_ZLIB | EXTERNAL_FLAG
+        assert region.get_compressed_blockdata(1, 3) == (COMPRESSION_ZLIB, external_file.read_bytes())
+        assert region.get_chunk(1, 3)['Data'].value == array.value
+        # a chunk that fits into the region file again replaces the external file
+        region.write_chunk(1, 3, chunk(-31, 67, inhabited_time=5))
+        assert not external_file.exists()
+        assert region.get_chunk(1, 3)['InhabitedTime'].value == 5
+
+
+def test_missing_external_file(tmp_path):
+    region_file = tmp_path / 'r.0.0.mca'
+    region_file.touch()
+    large = chunk(0, 0)
+    array = TAG_Byte_Array(name='Data')
+    array.value = bytearray(os.urandom(256 * SECTOR_LENGTH))
+    large.tags.append(array)
+    with region_file.open('r+b') as file:
+        open_region(file, region_file).write_chunk(0, 0, large)
+    (tmp_path / 'c.0.0.mcc').unlink()
+
+    with region_file.open('rb') as file:
+        region = open_region(file, region_file)
+        assert region.is_readable(0, 0)
+        with pytest.raises(ChunkDataError, match='external file'):
+            region.get_chunk(0, 0)
+
+
+def test_compact(tmp_path):
+    region_file = tmp_path / 'r.0.0.mca'
+    region_file.touch()
+    with region_file.open('r+b') as file:
+        region = open_region(file, region_file)
+        for x in range(3):
+            region.write_chunk(x, 0, chunk(x, 0, inhabited_time=x))
+        region.unlink_chunk(0, 0)
+        assert region.compact() == SECTOR_LENGTH
+        assert region.compact() == 0
+    assert region_file.stat().st_size == 4 * SECTOR_LENGTH
+
+    with region_file.open('rb') as file:
+        region = open_region(file, region_file)
+        assert sorted(metadata.blockstart for metadata in region.metadata.values() if metadata.blockstart) == [2, 3]
+        assert [region.get_chunk(x, 0)['InhabitedTime'].value for x in (1, 2)] == [1, 2]
+        assert region.chunk_count() == 2
+
+
+def test_bytes_read_of_external_chunk(tmp_path, monkeypatch):
+    region_file = tmp_path / 'r.0.0.mca'
+    region_file.touch()
+    large = chunk(0, 0)
+    array = TAG_Byte_Array(name='Data')
+    array.value = bytearray(os.urandom(256 * SECTOR_LENGTH))
+    large.tags.append(array)
+    with region_file.open('r+b') as file:
+        region = open_region(file, region_file)
+        region.write_chunk(0, 0, large)
+        region.write_chunk(1, 0, chunk(1, 0))
+
+    monkeypatch.setattr(metrics, '_metrics', None)
+    counts = metrics.start_worker()
+    with region_file.open('rb') as file:
+        region = open_region(file, region_file)
+        region.get_chunk(0, 0)
+        region.get_chunk(1, 0)
+        small = region.metadata[1, 0].length + 4
+    assert counts.chunks_decoded == 2
+    assert counts.bytes_read == (tmp_path / 'c.0.0.mcc').stat().st_size + 5 + small
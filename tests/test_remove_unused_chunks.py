@@ -0,0 +1,19 @@
+import json
+
+from helpers import make_world
+
+from mcworldtools.tools import remove_unused_chunks
+
+
+def no_input(prompt=''):
+    raise EOFError(prompt)
+
+
+def test_input_file_with_only_inhabited_time(tmp_path, monkeypatch):
+    world = make_world(tmp_path / 'world')
+    monkeypatch.setattr('builtins.input', no_input)
+    output_file = tmp_path / 'out.json'
+    remove_unused_chunks.start([world], output_file, 'json', {'inhabited_time': 1}, True)
+    chunks = json.loads(output_file.read_text())['total']['chunks']
+    # the chunks with command blocks are kept because of their inhabited time, not their block entities
+    assert chunks['removed'] == 3 and chunks['kept'] == {'inhabited_time': 3}
@@ -0,0 +1,34 @@
+import random
+
+from mcworldtools.sampling import Estimator, allocate_sample
+
+
+def test_allocation_stays_within_the_sample():
+    assert allocate_sample([1024, 512, 100], 1000) == [624, 313, 62]
+    assert allocate_sample([3, 1], 1000) == [3, 1]
+    assert allocate_sample([], 10) == []
+    counts = allocate_sample([1024] * 20000, 1000, random.Random(1))
+    assert sum(counts) == 1000
+    assert sum(1 for count in counts if count) == 500
+
+
+def test_full_sample_is_exact():
+    estimator = Estimator()
+    estimator.add_strata([(2, [{'a': 1}, {'a': 3}]), (1, [{}])])
+    assert estimator.get('a') == {'estimate': 4, 'low': 4, 'high': 4}
+    assert (estimator.population, estimator.sampled) == (3, 3)
+
+
+def test_cluster_estimate():
+    rng = random.Random(2)
+    # 400 region files with 10 chunks each, every chunk has a value of its region file index % 4
+    sizes = [10] * 400
+    counts = allocate_sample(sizes, 100, rng)
+    estimator = Estimator()
+    estimator.add_strata([(size, [{'value': index % 4}] * count if count else None)
+                          for index, (size, count) in enumerate(zip(sizes, counts))])
+    assert estimator.population == 4000
+    assert estimator.sampled == 100
+    estimate = estimator.get('value')
+    assert estimate['low'] <= 6000 <= estimate['high']
+    assert estimate['high'] - estimate['low'] < 3000
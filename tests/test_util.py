@@ -0,0 +1,44 @@
+import json
+from datetime import datetime
+from io import StringIO
+
+import pytest
+
+from mcworldtools.tools.entities import EntityRecord
+from mcworldtools.util import InputError, compile_text_filter, dump_data, expand_record, parse_since
+
+
+def test_text_filter_literal():
+    matches = compile_text_filter(['op ', 'a.b'], literal=True)
+    assert matches('/op Steve')
+    assert matches('a.b')
+    assert not matches('axb')
+
+
+def test_text_filter_regex_with_inline_flags_and_backreferences():
+    matches = compile_text_filter(['(?i)op', r'(a)\1'])
+    assert matches('OP Steve')
+    assert matches('xaa')
+    assert not matches('ab')
+
+
+def test_parse_since():
+    assert parse_since('last') == 'last'
+    assert parse_since('1654012800') == 1654012800
+    assert parse_since('2022-05-31 18:00') == int(datetime(2022, 5, 31, 18).timestamp())
+    assert parse_since('2022-05-31') == int(datetime(2022, 5, 31).timestamp())
+    with pytest.raises(InputError):
+        parse_since('yesterday')
+
+
+def test_output_is_the_same_with_and_without_orjson():
+    pytest.importorskip('orjson')
+    record = EntityRecord()
+    record.id, record.uuid, record.nbt = 'minecraft:zombie', '00000000-0000-0000-0000-000000000001', '{}'
+    record.set_location('overworld', 1.5, 64.0, -3.25, 0, 0, 0, 0)
+    data = {'worlds': {'world': {'entities': [record], 'names': ['Bob', 'Zoë \U0001F600', 'a "b"\n'],
+                                 'empty': [], 'counts': {'a': 1, 'b': {}}}},
+            'total': {'entities': 1, 'elapsed_time': {'raw': 12, 'human_readable': '0m 0s'}}}
+    with_orjson = StringIO()
+    dump_data(data, with_orjson, 'json')
+    assert with_orjson.getvalue() == json.dumps(data, indent=3, default=expand_record)